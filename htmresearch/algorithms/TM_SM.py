@@ -20,7 +20,6 @@ import copy
 import nupic.math
 from nupic.support.consoleprinter import ConsolePrinterMixin
 from nupic.bindings.math import Random
-from nupic.bindings.algorithms import isSegmentActive, getSegmentActivityLevel
 from TM import TM
 # Default verbosity while running unit tests
 VERBOSITY = 0
@@ -28,6 +27,13 @@ VERBOSITY = 0
 # The numpy equivalent to the floating point type used by NTA
 dtype = nupic.math.GetNTAReal()
 
+
+def _concatenateRanges(starts, ends):
+  """Concatenation of the integer ranges [starts[k], ends[k]), as an array."""
+  lengths = ends - starts
+  offsets = starts - (numpy.cumsum(lengths) - lengths)
+  return numpy.repeat(offsets, lengths) + numpy.arange(lengths.sum())
+
 #TM_SM is a child class of TM
 class TM_SM(TM):
 
@@ -61,6 +67,7 @@ class TM_SM(TM):
                collectStats =False,    # If true, collect training and inference stats
                seed =42,
                learnOnOneCell=False,
+               batchedInference=False,
                verbosity =VERBOSITY,
                ):
     """
@@ -120,6 +127,13 @@ class TM_SM(TM):
                   of different cells per column to represent different pattern context, rather
                   than sequence contexts
 
+    @param batchedInference when set to True, the activity of all the segments
+                  considered in a time step is computed in one pass over their
+                  synapses, and the best matching cells and the predicted cells
+                  are picked with array reductions instead of one segment at a
+                  time. The results are identical, this only makes large
+                  networks faster.
+
     @param seed   seed for random number generator
 
     """
@@ -159,6 +173,7 @@ class TM_SM(TM):
     self.learnDistalInputs = learnDistalInputs
     self.segUpdateValidDuration = 1
     self.learnOnOneCell = learnOnOneCell
+    self.batchedInference = batchedInference
 
     #---------------------------------------------------------------------------------
     # Create data structures
@@ -231,6 +246,16 @@ class TM_SM(TM):
     self._initEphemerals()
 
 
+  def _initEphemerals(self):
+    super(TM_SM, self)._initEphemerals()
+    # Flattened segments of the batched inference path, see _getSegmentIndex()
+    self._segmentIndex = None
+
+
+  def _getEphemeralMembers(self):
+    return super(TM_SM, self)._getEphemeralMembers() + ["_segmentIndex"]
+
+
   ################################################################################
   def reset(self,):
     """ Reset the state of all cells.
@@ -664,6 +689,10 @@ class TM_SM(TM):
     retval:       ?
     """
 
+    if self.batchedInference:
+      self._computePhase2Batched(doLearn)
+      return
+
     # Phase 2: compute predicted state for each cell
     # - if a segment has enough activity, either due to horizontal or distal
     # dendritic input, it's set to be predicting, and we queue up the segment
@@ -703,6 +732,32 @@ class TM_SM(TM):
         self.confidence['t'][c,i] = maxConfidence
 
 
+  def _computePhase2Batched(self, doLearn=False):
+    """
+    Same as computePhase2(), with the activity of all the segments computed
+    in one pass.
+    """
+    (segments, segCols, segCells, activities) = self._getSegmentActivities(
+      xrange(self.numberOfCols), self.activeState['t'],
+      self.distalDendriticInput['t'], connectedSynapsesOnly=True)
+
+    activeSegIdx = numpy.flatnonzero(activities > self.activationThreshold)
+    self.predictedState['t'][segCols[activeSegIdx], segCells[activeSegIdx]] = 1
+
+    if doLearn:
+      for j in activeSegIdx:
+        c, i, s = int(segCols[j]), int(segCells[j]), segments[j]
+        s.totalActivations += 1    # increment activationFrequency
+        s.lastActiveIteration = self.iterationIdx
+        # mark this segment for learning
+        activeUpdate = self.getSegmentActiveSynapses(c, i, s, 't')
+        activeUpdate.phase1Flag = False
+        self.addToSegmentUpdates(c, i, activeUpdate)
+
+    # No confidence is computed for the segments
+    self.confidence['t'][:,:] = 0
+
+
   def compute(self, bottomUpInput, distalDendriticInput, enableLearn, computeInfOutput=None):
     """Computes output for both learning and inference. In both cases, the
     output is the boolean OR of activeState and predictedState at t.
@@ -773,6 +828,15 @@ class TM_SM(TM):
     activeColumns = bottomUpInput.nonzero()[0]
     numUnpredictedColumns = 0
 
+    if self.batchedInference:
+      # Segments don't change during phase 1, so the best matching cells of
+      # all the unpredicted columns can be found at once.
+      unpredictedColumns = [c for c in activeColumns
+                            if not self.predictedState['t-1'][c].any()]
+      bestMatchingCells = self.getBestMatchingCells(
+        unpredictedColumns, self.activeState['t-1'],
+        self.distalDendriticInput['t-1'])
+
     for c in activeColumns:
 
       # todo: cache this list when building it in iteration at t
@@ -808,8 +872,11 @@ class TM_SM(TM):
           i = self.getSeqLearnCell(c)
 
         if not i:
-          i,s = self.getBestMatchingCell(c,self.activeState['t-1'],
-                                         self.distalDendriticInput['t-1'])
+          if self.batchedInference:
+            i,s = bestMatchingCells[c]
+          else:
+            i,s = self.getBestMatchingCell(c,self.activeState['t-1'],
+                                           self.distalDendriticInput['t-1'])
 
           if s is not None and s.isSequenceSegment():
             s.totalActivations += 1      # activationFrequency
@@ -933,6 +1000,15 @@ class TM_SM(TM):
     activeColumns = bottomUpInput.nonzero()[0]
     numUnpredictedColumns = 0
 
+    if self.batchedInference:
+      # Segments don't change during phase 1, so the best matching cells of
+      # all the unpredicted columns can be found at once.
+      unpredictedColumns = [c for c in activeColumns
+                            if not self.predictedState['t-1'][c].any()]
+      bestMatchingCells = self.getBestMatchingCells(
+        unpredictedColumns, self.activeState['t-1'],
+        self.distalDendriticInput['t-1'])
+
     for c in activeColumns:
 
       # todo: cache this list when building it in iteration at t
@@ -971,8 +1047,11 @@ class TM_SM(TM):
           i = self.getSeqLearnCell(c)
 
         if not i:
-          i,s = self.getBestMatchingCell(c,self.activeState['t-1'],
-                                         self.distalDendriticInput['t-1'])
+          if self.batchedInference:
+            i,s = bestMatchingCells[c]
+          else:
+            i,s = self.getBestMatchingCell(c,self.activeState['t-1'],
+                                           self.distalDendriticInput['t-1'])
 
           if s is not None and s.isSequenceSegment():
             s.totalActivations += 1      # activationFrequency
@@ -1032,23 +1111,19 @@ class TM_SM(TM):
             continue
 
           #print "Decrementing seg age %d:" % (age), c, i, segment
-          synsToDel = [] # collect and remove outside the loop
-          for synapse in segment.syns: # skip sequenceSegment flag
-
-            synapse[2] = synapse[2] - self.globalDecay # decrease permanence
+          segment.synPerms -= self.globalDecay # decrease permanence
+          self._invalidateSegmentIndex()
+          synsToDel = numpy.flatnonzero(segment.synPerms <= 0)
 
-            if synapse[2] <= 0:
-              synsToDel.append(synapse) # add to list to delete
-
-          if len(synsToDel) == len(segment.syns): # 1 for sequenceSegment flag
+          if len(synsToDel) == segment.getNumSynapses():
             segsToDel.append(segment) # will remove the whole segment
           elif len(synsToDel) > 0:
-            for syn in synsToDel: # remove some synapses on segment
-              segment.syns.remove(syn)
+            segment.removeSynapses(synsToDel, []) # remove some synapses
 
         for seg in segsToDel: # remove some segments of this cell
           self.cleanUpdatesList(c,i,seg)
           self.cells[c][i].remove(seg)
+          self._invalidateSegmentIndex()
 
 
     # Update the prediction score stats
@@ -1100,21 +1175,18 @@ class TM_SM(TM):
     for segment in segList:
 
       # List if synapses to delete
-      synsToDel = [syn for syn in segment.syns if syn[2] < minPermanence]
-      dsynsToDel = [syn for syn in segment.dsyns if syn[2] < minPermanence]
+      synsToDel = numpy.flatnonzero(segment.synPerms < minPermanence)
+      dsynsToDel = numpy.flatnonzero(segment.dsynPerms < minPermanence)
 
-      if (len(synsToDel) == len(segment.syns) ) and (len(dsynsToDel)==len(segment.dsyns)):
+      if (len(synsToDel) == segment.getNumSynapses()) and \
+         (len(dsynsToDel) == segment.getNumDistalSynapses()):
         segsToDel.append(segment) # will remove the whole segment
       else:
-        if len(synsToDel) > 0:
-          for syn in synsToDel: # remove some synapses on segment
-            segment.syns.remove(syn)
-            nSynsRemoved += 1
-        if len(dsynsToDel) > 0:
-          for syn in dsynsToDel: # remove some synapses on segment
-            segment.dsyns.remove(syn)
-            ndSynsRemoved += 1
-        if len(segment.syns)+len(segment.dsyns) < minNumSyns:
+        # remove some synapses on segment
+        segment.removeSynapses(synsToDel, dsynsToDel)
+        nSynsRemoved += len(synsToDel)
+        ndSynsRemoved += len(dsynsToDel)
+        if segment.getNumSynapses() + segment.getNumDistalSynapses() < minNumSyns:
           segsToDel.append(segment)
 
     # Remove segments that don't have enough synapses and also take them
@@ -1123,7 +1195,8 @@ class TM_SM(TM):
     for seg in segsToDel: # remove some segments of this cell
       self.cleanUpdatesList(colIdx, cellIdx, seg)
       self.cells[colIdx][cellIdx].remove(seg)
-      nSynsRemoved += len(seg.syns)
+      self._invalidateSegmentIndex()
+      nSynsRemoved += seg.getNumSynapses()
 
     return nSegsRemoved, nSynsRemoved, ndSynsRemoved
 
@@ -1331,16 +1404,8 @@ class TM_SM(TM):
     all the synapses of the segment, at either t or t-1.
     """
 
-    # Computing in C++, use function getSegmentActivityLevel
-    lateralActivity = getSegmentActivityLevel(seg.syns, activeState,
-                                              connectedSynapsesOnly,
-                                              self.connectedPerm)
-
-    distalActivity = getSegmentActivityLevel(seg.dsyns, distalDendriticInput,
-                                             connectedSynapsesOnly,
-                                             self.connectedPerm)
-
-    return lateralActivity+distalActivity
+    return seg.getActivityLevel(activeState, distalDendriticInput,
+                                connectedSynapsesOnly, self.connectedPerm)
 
   ##############################################################################
   def getSegmentActiveSynapses(self, c,i,s, timeStep, newSynapses =False):
@@ -1362,13 +1427,12 @@ class TM_SM(TM):
     if s is not None: # s can be None, if adding a new segment
       if self.learnLateralConnections:
         # Here we add *integers* to activeSynapses
-        activeSynapses = [idx for idx, syn in enumerate(s.syns) \
-                          if activeState[syn[0], syn[1]]]
+        activeSynapses = s.getActiveSynapseIndices(activeState).tolist()
 
       if self.learnDistalInputs:
         # Here we add active distal dendritic that receives external input
-        activeDistalSynapses = [idx for idx, syn in enumerate(s.dsyns) \
-                          if distalDendriticInput[syn[0], 0]]
+        activeDistalSynapses = s.getActiveDistalSynapseIndices(
+          distalDendriticInput).tolist()
 
     if newSynapses: # add a few more synapses
 
@@ -1442,7 +1506,8 @@ class TM_SM(TM):
       cands = [syn for syn in zip(tmpCandidates[0], tmpCandidates[1])]
     else:
       # We exclude any synapse that is already in this segment.
-      synapsesAlreadyInSegment = set((syn[0], syn[1]) for syn in s.dsyns)
+      synapsesAlreadyInSegment = set(zip(s.dsynCols.tolist(),
+                                         s.dsynCells.tolist()))
       cands = [syn for syn in zip(tmpCandidates[0], tmpCandidates[1]) \
                if (syn[0], syn[1]) not in synapsesAlreadyInSegment]
 
@@ -1506,6 +1571,183 @@ class TM_SM(TM):
       return bestCellInCol, self.cells[c][bestCellInCol][bestSegIdxInCol]
 
 
+  def getBestMatchingCells(self, columns, activeState, distalDendriticInput):
+    """Batched version of getBestMatchingCell().
+
+    Computes the activity of all the segments of the given columns in one pass,
+    then picks the most active segment of each cell and the most active cell of
+    each column with array reductions. Ties are broken like in
+    getBestMatchingCell(): first segment of a cell, last cell of a column.
+
+    Returns a dict mapping each column to its (cell index, segment) pair, or
+    (None, None) if no cell of the column reaches minThreshold.
+    """
+    (segments, segCols, segCells, activities) = self._getSegmentActivities(
+      columns, activeState, distalDendriticInput, connectedSynapsesOnly=False)
+
+    # Most active segment of each cell, first one in case of ties. Cells
+    # without segments keep an activity of 0 and a segment index of 0.
+    rows = self._columnRows(columns, segCols)
+    cellMax = numpy.zeros((len(columns), self.cellsPerColumn), dtype=int)
+    numpy.maximum.at(cellMax, (rows, segCells), activities)
+    isCellMax = activities == cellMax[rows, segCells]
+    firstMax = numpy.full((len(columns), self.cellsPerColumn), len(segments),
+                          dtype=int)
+    numpy.minimum.at(firstMax, (rows[isCellMax], segCells[isCellMax]),
+                     numpy.flatnonzero(isCellMax))
+
+    # Most active cell of each column, last one in case of ties
+    bestActivity = cellMax.max(axis=1)
+    lastMax = (self.cellsPerColumn - 1 -
+               numpy.argmax(cellMax[:, ::-1] == bestActivity[:, None], axis=1))
+
+    bestMatches = {}
+    for row, c in enumerate(columns):
+      if bestActivity[row] < self.minThreshold:
+        bestMatches[c] = (None, None)
+        continue
+      i = int(lastMax[row])
+      j = firstMax[row, i]
+      if j < len(segments):
+        bestMatches[c] = (i, segments[j])
+      else:
+        # Cell without segments, same as getBestMatchingCell()
+        bestMatches[c] = (i, self.cells[c][i][0])
+    return bestMatches
+
+
+  def _columnRows(self, columns, segCols):
+    """Map the column of each segment to its position in columns."""
+    position = numpy.zeros(self.numberOfCols, dtype=int)
+    position[numpy.asarray(columns, dtype=int)] = numpy.arange(len(columns))
+    return position[segCols]
+
+
+  def _getSegmentActivities(self, columns, activeState, distalDendriticInput,
+                            connectedSynapsesOnly=False):
+    """Compute the activity level of all the segments of the given columns.
+
+    This is the sparse matrix-vector product of the (segments x inputs)
+    synapse matrix with the active cells and distal inputs, done with a single
+    gather and bincount over the synapses of the selected segments, read from
+    the flattened arrays of _getSegmentIndex().
+
+    Returns a tuple (segments, segCols, segCells, activities): the list of
+    segments in column, cell, segment order, and arrays with the column, cell
+    and activity level of each of them.
+    """
+    (allSegments, allSegCols, allSegCells, colStarts,
+     synapseArrays) = self._getSegmentIndex()
+
+    columns = numpy.asarray(columns, dtype=int)
+    if numpy.array_equal(columns, numpy.arange(self.numberOfCols)):
+      segments = allSegments
+      segIdx = None
+      segCols = allSegCols
+      segCells = allSegCells
+    else:
+      segIdx = _concatenateRanges(colStarts[columns], colStarts[columns + 1])
+      segments = [allSegments[j] for j in segIdx]
+      segCols = allSegCols[segIdx]
+      segCells = allSegCells[segIdx]
+      # Position of each selected segment in segments
+      segRows = numpy.zeros(len(allSegments), dtype=int)
+      segRows[segIdx] = numpy.arange(len(segIdx))
+
+    numSegments = len(segments)
+    activities = numpy.zeros(numSegments, dtype=int)
+    if numSegments == 0:
+      return segments, segCols, segCells, activities
+
+    connectedPerm = numpy.float32(self.connectedPerm)
+    for state, (synStarts, owners, cols, cells, perms) in zip(
+        (activeState, distalDendriticInput), synapseArrays):
+      if segIdx is not None:
+        synIdx = _concatenateRanges(synStarts[colStarts[columns]],
+                                    synStarts[colStarts[columns + 1]])
+        owners = segRows[owners[synIdx]]
+        cols = cols[synIdx]
+        cells = cells[synIdx]
+        perms = perms[synIdx]
+      if len(owners) == 0:
+        continue
+      active = state[cols, cells] != 0
+      if connectedSynapsesOnly:
+        active &= perms >= connectedPerm
+      activities += numpy.bincount(owners[active], minlength=numSegments)
+
+    return segments, segCols, segCells, activities
+
+
+  def _getSegmentIndex(self):
+    """Flattened view of all the segments and their synapses, used by the
+    batched inference path. It is built on first use and dropped by
+    _invalidateSegmentIndex() whenever a segment or a synapse is added, removed
+    or updated, so inference steps reuse it as long as no learning happens.
+
+    Returns a tuple (segments, segCols, segCells, colStarts, synapseArrays):
+      - segments: all the segments, in column, cell, segment order
+      - segCols, segCells: column and cell of each segment
+      - colStarts: the segments of column c are segments[colStarts[c]:
+        colStarts[c + 1]]
+      - synapseArrays: for the lateral then the distal synapses, a tuple
+        (synStarts, owners, cols, cells, perms). The synapses of segment j are
+        at synStarts[j]:synStarts[j + 1], owners is the segment of each
+        synapse and perms are the permanences in single precision, like
+        Segment.getActivityLevel() compares them.
+    """
+    if self._segmentIndex is not None:
+      return self._segmentIndex
+
+    segments = []
+    segCols = []
+    segCells = []
+    for c in xrange(self.numberOfCols):
+      for i in xrange(self.cellsPerColumn):
+        cellSegments = self.cells[c][i]
+        if len(cellSegments) > 0:
+          segments.extend(cellSegments)
+          segCols.extend([c] * len(cellSegments))
+          segCells.extend([i] * len(cellSegments))
+
+    numSegments = len(segments)
+    segCols = numpy.array(segCols, dtype=int)
+    segCells = numpy.array(segCells, dtype=int)
+    colStarts = numpy.zeros(self.numberOfCols + 1, dtype=int)
+    colStarts[1:] = numpy.cumsum(numpy.bincount(segCols,
+                                                minlength=self.numberOfCols))
+
+    synapseArrays = []
+    for colsAttr, cellsAttr, permsAttr in (
+        ("synCols", "synCells", "synPerms"),
+        ("dsynCols", "dsynCells", "dsynPerms")):
+      numSyns = numpy.array([len(getattr(seg, permsAttr)) for seg in segments],
+                            dtype=int)
+      synStarts = numpy.zeros(numSegments + 1, dtype=int)
+      synStarts[1:] = numpy.cumsum(numSyns)
+      owners = numpy.repeat(numpy.arange(numSegments), numSyns)
+      if numSegments > 0:
+        cols = numpy.concatenate([getattr(seg, colsAttr) for seg in segments])
+        cells = numpy.concatenate([getattr(seg, cellsAttr) for seg in segments])
+        perms = numpy.concatenate([getattr(seg, permsAttr)
+                                   for seg in segments]).astype(numpy.float32)
+      else:
+        cols = numpy.zeros(0, dtype=numpy.int32)
+        cells = numpy.zeros(0, dtype=numpy.int32)
+        perms = numpy.zeros(0, dtype=numpy.float32)
+      synapseArrays.append((synStarts, owners, cols, cells, perms))
+
+    self._segmentIndex = (segments, segCols, segCells, colStarts,
+                          synapseArrays)
+    return self._segmentIndex
+
+
+  def _invalidateSegmentIndex(self):
+    """Drop the flattened segments of _getSegmentIndex(), after a change to the
+    segments or their synapses."""
+    self._segmentIndex = None
+
+
   def getBestMatchingSegment(self, c, i, activeState, distalDendriticInput):
     """For the given cell, find the segment with the largest number of active
     synapses. This routine is aggressive in finding the best match. The
@@ -1660,10 +1902,10 @@ class TM_SM(TM):
         # First, decrement synapses that are not active
         # s is a synapse *index*, with index 0 in the segment being the tuple
         # (segId, sequence segment flag). See below, creation of segments.
-        lastLateralSynIndex = len(segment.syns) - 1
+        lastLateralSynIndex = segment.getNumSynapses() - 1
         inactiveLateralSynIndices = [s for s in xrange(0, lastLateralSynIndex+1) \
                               if s not in lateralSynToUpdate]
-        lastDistalSynIndex = len(segment.dsyns) - 1
+        lastDistalSynIndex = segment.getNumDistalSynapses() - 1
         inactiveDistalSynIndices = [s for s in xrange(0, lastDistalSynIndex+1) \
                               if s not in distalSynToUpdate]
         trimSegment = segment.updateSynapses(inactiveLateralSynIndices,
@@ -1729,6 +1971,7 @@ class TM_SM(TM):
         newSegment.printSegment()
 
       self.cells[c][i].append(newSegment)
+      self._invalidateSegmentIndex()
 
 
     return trimSegment
@@ -1807,8 +2050,7 @@ class TM_SM(TM):
             #       "nSynapse=",nSynapsesThisSeg,"nDSynapse=",nDistSynapsesThisSeg
 
             # Accumulate permanence value histogram
-            for syn in seg.syns:
-              p = int(syn[2]*10)
+            for p in (seg.synPerms*10).astype(int).tolist():
               if distPermValues.has_key(p):
                 distPermValues[p] += 1
               else:
@@ -1823,9 +2065,8 @@ class TM_SM(TM):
             if collectActiveData:
               if self.isSegmentActive(seg, self.ActiveState['t'],self.distalDendriticInput['t']):
                 nActiveSegs += 1
-              for syn in seg.syns:
-                if self.activeState['t'][syn[0]][syn[1]] == 1:
-                  nActiveSynapses += 1
+              nActiveSynapses += numpy.count_nonzero(
+                self.activeState['t'][seg.synCols, seg.synCells] == 1)
 
     return (nSegments, nSynapses, nDistSynapses, nActiveSegs, nActiveSynapses,
             distSegSizes, distNSegsPerCell, distPermValues, distAges, numSegmentPerCell)
@@ -1869,13 +2110,20 @@ class Segment(object):
     self._lastPosDutyCycle = 1.0 / tp.lrnIterationIdx
     self._lastPosDutyCycleIteration = tp.lrnIterationIdx
 
-    # Each synapse is a tuple (srcCellCol, srcCellIdx, permanence)
+    # Synapses are stored as parallel arrays: the source column and the source
+    # cell index within the column (int32), and the permanence (float32).
+    # The permanence parameters of the TM are float32 too, so updates round
+    # in single precision, like the float32 scalars of the list version.
 
     # synapses that receive lateral connections
-    self.syns = []
+    self.synCols = numpy.zeros(0, dtype=numpy.int32)
+    self.synCells = numpy.zeros(0, dtype=numpy.int32)
+    self.synPerms = numpy.zeros(0, dtype=numpy.float32)
 
     # Distant synapses that receive external input
-    self.dsyns = []
+    self.dsynCols = numpy.zeros(0, dtype=numpy.int32)
+    self.dsynCells = numpy.zeros(0, dtype=numpy.int32)
+    self.dsynPerms = numpy.zeros(0, dtype=numpy.float32)
 
 
   def __ne__(self, s):
@@ -1890,11 +2138,32 @@ class Segment(object):
     for k, v in d1.iteritems():
       if k in ('tp',):
         continue
+      elif isinstance(v, numpy.ndarray):
+        if not numpy.array_equal(v, d2[k]):
+          return False
       elif v != d2[k]:
         return False
     return True
 
 
+  @property
+  def syns(self):
+    """List of the lateral synapses as [srcCellCol, srcCellIdx, permanence].
+    This is a copy, modifying it does not modify the segment."""
+    return [[col, cell, perm] for col, cell, perm in
+            zip(self.synCols.tolist(), self.synCells.tolist(),
+                self.synPerms.tolist())]
+
+
+  @property
+  def dsyns(self):
+    """List of the distal synapses as [srcCellCol, srcCellIdx, permanence].
+    This is a copy, modifying it does not modify the segment."""
+    return [[col, cell, perm] for col, cell, perm in
+            zip(self.dsynCols.tolist(), self.dsynCells.tolist(),
+                self.dsynPerms.tolist())]
+
+
   def dutyCycle(self, active=False, readOnly=False):
     """Compute/update and return the positive activations duty cycle of
     this segment. This is a measure of how often this segment is
@@ -2021,10 +2290,50 @@ class Segment(object):
     return self.isSequenceSeg
 
   def getNumSynapses(self):
-    return len(self.syns)
+    return len(self.synPerms)
 
   def getNumDistalSynapses(self):
-    return len(self.dsyns)
+    return len(self.dsynPerms)
+
+  def getActiveSynapseIndices(self, activeState):
+    """Return the indices of the lateral synapses whose source cell is on in
+    activeState, a (numberOfCols, cellsPerColumn) array."""
+    return numpy.flatnonzero(activeState[self.synCols, self.synCells])
+
+  def getActiveDistalSynapseIndices(self, distalDendriticInput):
+    """Return the indices of the distal synapses whose source is on in
+    distalDendriticInput, a (numberOfDistalInput, 1) array."""
+    return numpy.flatnonzero(distalDendriticInput[self.dsynCols, 0])
+
+  def getActivityLevel(self, activeState, distalDendriticInput,
+                       connectedSynapsesOnly, connectedPerm):
+    """Count the lateral and distal synapses that are active, optionally only
+    the connected ones. Permanences are compared in single precision, like
+    the C++ getSegmentActivityLevel did."""
+    lateralActive = activeState[self.synCols, self.synCells] != 0
+    distalActive = distalDendriticInput[self.dsynCols, self.dsynCells] != 0
+    if connectedSynapsesOnly:
+      connectedPerm = numpy.float32(connectedPerm)
+      lateralActive &= self.synPerms >= connectedPerm
+      distalActive &= self.dsynPerms >= connectedPerm
+    return (int(numpy.count_nonzero(lateralActive)) +
+            int(numpy.count_nonzero(distalActive)))
+
+  def removeSynapses(self, lateralSynapses, distalSynapses):
+    """Remove the lateral and distal synapses at the given indices."""
+    self.tp._invalidateSegmentIndex()
+    if len(lateralSynapses) > 0:
+      keep = numpy.ones(len(self.synPerms), dtype=bool)
+      keep[numpy.asarray(lateralSynapses, dtype=int)] = False
+      self.synCols = self.synCols[keep]
+      self.synCells = self.synCells[keep]
+      self.synPerms = self.synPerms[keep]
+    if len(distalSynapses) > 0:
+      keep = numpy.ones(len(self.dsynPerms), dtype=bool)
+      keep[numpy.asarray(distalSynapses, dtype=int)] = False
+      self.dsynCols = self.dsynCols[keep]
+      self.dsynCells = self.dsynCells[keep]
+      self.dsynPerms = self.dsynPerms[keep]
 
   def freeNSynapses(self, numToFree, inactiveSynapseIndices, verbosity= 0):
     """Free up some synapses in this segment. We always free up inactive
@@ -2035,33 +2344,33 @@ class Segment(object):
     @param inactiveSynapseIndices list of the inactive synapse indices.
     """
     # Make sure numToFree isn't larger than the total number of syns we have
-    assert (numToFree <= len(self.syns))
+    numSyns = len(self.synPerms)
+    assert (numToFree <= numSyns)
 
     if (verbosity >= 4):
       print "\nIn PY freeNSynapses with numToFree =", numToFree,
       print "inactiveSynapseIndices =",
       for i in inactiveSynapseIndices:
-        print self.syns[i][0:2],
+        print [self.synCols[i], self.synCells[i]],
       print
 
     # Remove the lowest perm inactive synapses first
+    inactiveSynapseIndices = numpy.asarray(inactiveSynapseIndices, dtype=int)
     if len(inactiveSynapseIndices) > 0:
-      perms = numpy.array([self.syns[i][2] for i in inactiveSynapseIndices])
-      candidates = numpy.array(inactiveSynapseIndices)[
-          perms.argsort()[0:numToFree]]
-      candidates = list(candidates)
+      perms = self.synPerms[inactiveSynapseIndices]
+      candidates = inactiveSynapseIndices[perms.argsort()[0:numToFree]]
     else:
-      candidates = []
+      candidates = numpy.zeros(0, dtype=int)
 
     # Do we need more? if so, remove the lowest perm active synapses too
     if len(candidates) < numToFree:
-      activeSynIndices = [i for i in xrange(len(self.syns))
-                          if i not in inactiveSynapseIndices]
-      perms = numpy.array([self.syns[i][2] for i in activeSynIndices])
+      isActive = numpy.ones(numSyns, dtype=bool)
+      isActive[inactiveSynapseIndices] = False
+      activeSynIndices = numpy.flatnonzero(isActive)
+      perms = self.synPerms[activeSynIndices]
       moreToFree = numToFree - len(candidates)
-      moreCandidates = numpy.array(activeSynIndices)[
-          perms.argsort()[0:moreToFree]]
-      candidates += list(moreCandidates)
+      moreCandidates = activeSynIndices[perms.argsort()[0:moreToFree]]
+      candidates = numpy.concatenate((candidates, moreCandidates))
 
     if verbosity >= 4:
       print "Deleting %d synapses from segment to make room for new ones:" % (
@@ -2069,10 +2378,16 @@ class Segment(object):
       print "BEFORE:",
       self.printSegment()
 
-    # Free up all the candidates now
-    synsToDelete = [self.syns[i] for i in candidates]
-    for syn in synsToDelete:
-      self.syns.remove(syn)
+    # Free up all the candidates now. Like list.remove(), each candidate
+    # deletes the first synapse identical to it, which is not necessarily
+    # the candidate itself when the segment holds duplicate synapses.
+    alive = numpy.ones(numSyns, dtype=bool)
+    for candidate in candidates:
+      matches = alive & (self.synCols == self.synCols[candidate]) \
+                      & (self.synCells == self.synCells[candidate]) \
+                      & (self.synPerms == self.synPerms[candidate])
+      alive[numpy.argmax(matches)] = False
+    self.removeSynapses(numpy.flatnonzero(~alive), [])
 
     if verbosity >= 4:
       print "AFTER:",
@@ -2086,7 +2401,10 @@ class Segment(object):
     @param srcCellIdx source cell index within the column
     @param perm       initial permanence
     """
-    self.syns.append([int(srcCellCol), int(srcCellIdx), numpy.float32(perm)])
+    self.tp._invalidateSegmentIndex()
+    self.synCols = numpy.append(self.synCols, numpy.int32(srcCellCol))
+    self.synCells = numpy.append(self.synCells, numpy.int32(srcCellIdx))
+    self.synPerms = numpy.append(self.synPerms, numpy.float32(perm))
 
 
   def addDistalSynapse(self, srcCellCol, srcCellIdx, perm):
@@ -2096,7 +2414,10 @@ class Segment(object):
     @param srcCellIdx source cell index within the column
     @param perm       initial permanence
     """
-    self.dsyns.append([int(srcCellCol), int(srcCellIdx), numpy.float32(perm)])
+    self.tp._invalidateSegmentIndex()
+    self.dsynCols = numpy.append(self.dsynCols, numpy.int32(srcCellCol))
+    self.dsynCells = numpy.append(self.dsynCells, numpy.int32(srcCellIdx))
+    self.dsynPerms = numpy.append(self.dsynPerms, numpy.float32(perm))
 
   def updateSynapses(self, lateralSynapses, distalSynapses, delta):
     """Update a set of synapses in the segment.
@@ -2112,36 +2433,28 @@ class Segment(object):
     if delta == 0:
       return reached0
 
-    if delta > 0:
-      for synapse in lateralSynapses:
-        self.syns[synapse][2] = newValue = self.syns[synapse][2] + delta
-
-        # Cap synapse permanence at permanenceMax
-        if newValue > self.tp.permanenceMax:
-          self.syns[synapse][2] = self.tp.permanenceMax
-
-      for synapse in distalSynapses:
-        self.dsyns[synapse][2] = newValue = self.dsyns[synapse][2] + delta
+    self.tp._invalidateSegmentIndex()
+    lateralSynapses = numpy.fromiter(lateralSynapses, dtype=int)
+    distalSynapses = numpy.fromiter(distalSynapses, dtype=int)
+    # Keep the arithmetic in single precision
+    delta = numpy.float32(delta)
+    permanenceMax = numpy.float32(self.tp.permanenceMax)
+    for perms, synapses in ((self.synPerms, lateralSynapses),
+                            (self.dsynPerms, distalSynapses)):
+      if len(synapses) == 0:
+        continue
+      newValues = perms[synapses] + delta
 
+      if delta > 0:
         # Cap synapse permanence at permanenceMax
-        if newValue > self.tp.permanenceMax:
-          self.dsyns[synapse][2] = self.tp.permanenceMax
-
-    else:
-      for synapse in lateralSynapses:
-        self.syns[synapse][2] = newValue = self.syns[synapse][2] + delta
-
+        newValues[newValues > permanenceMax] = permanenceMax
+      else:
         # Cap min synapse permanence to 0 in case there is no global decay
-        if newValue <= 0:
-          self.syns[synapse][2] = 0
+        reachedZero = newValues <= 0
+        if reachedZero.any():
+          newValues[reachedZero] = 0
           reached0 = True
 
-      for synapse in distalSynapses:
-        self.dsyns[synapse][2] = newValue = self.dsyns[synapse][2] + delta
-
-        # Cap min synapse permanence to 0 in case there is no global decay
-        if newValue <= 0:
-          self.dsyns[synapse][2] = 0
-          reached0 = True
+      perms[synapses] = newValues
 
     return reached0
@@ -31,6 +31,12 @@ from nab.detectors.base import AnomalyDetector
 from nupic.bindings.algorithms import SpatialPooler
 from htmresearch_core.experimental import ExtendedTemporalMemory
 
+from htmresearch.algorithms.anomaly_detection.multi_stream import (
+  computeRawAnomalyScore)
+
+NUM_COLUMNS = 2048
+CELLS_PER_COLUMN = 1
+
 
 class DistalTimestamps1CellPerColumnDetector(AnomalyDetector):
   """The 'numenta' detector, with the following changes:
@@ -54,6 +60,7 @@ class DistalTimestamps1CellPerColumnDetector(AnomalyDetector):
     self.sp = None
     self.spOutput = None
     self.etm = None
+    self.columnMask = None
     self.anomalyLikelihood = None
 
 
@@ -84,7 +91,7 @@ class DistalTimestamps1CellPerColumnDetector(AnomalyDetector):
 
     self.sp = SpatialPooler(**{
       "globalInhibition": True,
-      "columnDimensions": [2048],
+      "columnDimensions": [NUM_COLUMNS],
       "inputDimensions": [inputWidth],
       "potentialRadius": inputWidth,
       "numActiveColumnsPerInhArea": 40,
@@ -95,12 +102,13 @@ class DistalTimestamps1CellPerColumnDetector(AnomalyDetector):
       "synPermConnected": 0.2,
       "synPermInactiveDec": 0.0005,
     })
-    self.spOutput = np.zeros(2048, dtype=np.float32)
+    self.spOutput = np.zeros(NUM_COLUMNS, dtype=np.float32)
+    self.columnMask = np.zeros(NUM_COLUMNS, dtype=bool)
 
     self.etm = ExtendedTemporalMemory(**{
       "activationThreshold": 13,
-      "cellsPerColumn": 1,
-      "columnDimensions": (2048,),
+      "cellsPerColumn": CELLS_PER_COLUMN,
+      "columnDimensions": (NUM_COLUMNS,),
       "basalInputDimensions": (self.timestampEncoder.getWidth(),),
       "initialPermanence": 0.21,
       "maxSegmentsPerCell": 128,
@@ -121,6 +129,18 @@ class DistalTimestamps1CellPerColumnDetector(AnomalyDetector):
     )
 
 
+  def __getstate__(self):
+    # The data set is not part of the detector state (see multi_stream.py).
+    state = self.__dict__.copy()
+    state.pop("dataSet", None)
+    return state
+
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.dataSet = None
+
+
   def handleRecord(self, inputData):
     """Returns a tuple (anomalyScore, rawScore)."""
 
@@ -135,12 +155,10 @@ class DistalTimestamps1CellPerColumnDetector(AnomalyDetector):
     self.sp.compute(self.encodedValue, True, self.spOutput)
 
     activeColumns = self.spOutput.nonzero()[0]
-    activeColumnsSet = set(activeColumns.tolist())
-    prevPredictedColumns = set(self.etm.columnForCell(cell)
-                               for cell in self.etm.getPredictiveCells())
-
-    rawScore = (len(activeColumnsSet - prevPredictedColumns) /
-                float(len(activeColumns)))
+    rawScore = computeRawAnomalyScore(activeColumns,
+                                      self.etm.getPredictiveCells(),
+                                      CELLS_PER_COLUMN,
+                                      self.columnMask)
     anomalyScore = self.anomalyLikelihood.anomalyProbability(
       inputData["value"], rawScore, inputData["timestamp"])
     logScore = self.anomalyLikelihood.computeLogLikelihood(anomalyScore)
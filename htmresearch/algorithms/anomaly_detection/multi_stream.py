@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Copyright (C) 2016, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Run the low-level NAB detectors on many streams at once.
+
+The streams are sharded across a pool of worker processes. Each worker runs
+the detectors of its shard one stream at a time, so it only holds one SP and
+TM in memory. Detectors are checkpointed every few records: when the run is
+restarted, each stream resumes from its last checkpoint.
+"""
+
+import cPickle
+import multiprocessing
+import os
+import zlib
+
+import numpy as np
+import pandas
+
+
+
+def computeRawAnomalyScore(activeColumns, predictiveCells, cellsPerColumn,
+                           columnMask):
+  """
+  Fraction of the active columns that were not predicted.
+
+  @param activeColumns: (np.array) indices of the active columns
+  @param predictiveCells: (list) indices of the previously predictive cells
+  @param cellsPerColumn: (int) number of cells per column
+  @param columnMask: (np.array) boolean buffer with one entry per column. It
+    must be all False, and it is reset to all False on return.
+  """
+  predictedColumns = (np.asarray(predictiveCells, dtype=np.int64)
+                      // cellsPerColumn)
+  columnMask[predictedColumns] = True
+  numPredictedActiveColumns = np.count_nonzero(columnMask[activeColumns])
+  columnMask[predictedColumns] = False
+  return ((len(activeColumns) - numPredictedActiveColumns) /
+          float(len(activeColumns)))
+
+
+
+def shardStreams(streamNames, numShards):
+  """
+  Assign streams to shards. The shard of a stream only depends on its name,
+  so a stream is always run by the same worker.
+
+  @param streamNames: (list) names of the streams
+  @param numShards: (int) number of shards
+  @return: (list) stream names of each shard
+  """
+  shards = [[] for _ in xrange(numShards)]
+  for name in sorted(streamNames):
+    shards[(zlib.crc32(name) & 0xffffffff) % numShards].append(name)
+  return shards
+
+
+
+def checkpointDetector(detector, scores, checkpointPath):
+  """
+  Save a detector and the scores of the records it already processed. The
+  data set of the detector is not saved.
+
+  @param detector: (AnomalyDetector) the detector
+  @param scores: (list) values returned by handleRecord() for each record
+  @param checkpointPath: (str) path of the checkpoint file
+  """
+  tmpPath = checkpointPath + ".tmp"
+  with open(tmpPath, "wb") as f:
+    cPickle.dump({"detector": detector, "scores": scores}, f,
+                 cPickle.HIGHEST_PROTOCOL)
+  os.rename(tmpPath, checkpointPath)
+
+
+
+def restoreDetector(checkpointPath, dataSet):
+  """
+  Load a detector saved by checkpointDetector().
+
+  @param checkpointPath: (str) path of the checkpoint file
+  @param dataSet: (DataFile) data set of the detector
+  @return detector: (AnomalyDetector) the detector
+  @return scores: (list) values returned by handleRecord() for each record
+    already processed
+  """
+  with open(checkpointPath, "rb") as f:
+    checkpoint = cPickle.load(f)
+  detector = checkpoint["detector"]
+  detector.dataSet = dataSet
+  return detector, checkpoint["scores"]
+
+
+
+def runDetector(detectorClass, dataSet, probationaryPercent,
+                checkpointPath=None, checkpointInterval=1000):
+  """
+  Run a detector on a data set, resuming from its checkpoint if there is
+  one.
+
+  @param detectorClass: (class) AnomalyDetector subclass
+  @param dataSet: (DataFile) data set with 'timestamp' and 'value' columns
+  @param probationaryPercent: (float) see AnomalyDetector
+  @param checkpointPath: (str) optional path of the checkpoint file
+  @param checkpointInterval: (int) number of records between checkpoints
+  @return: (pandas.DataFrame) same as AnomalyDetector.run()
+  """
+  if checkpointPath is not None and os.path.exists(checkpointPath):
+    detector, scores = restoreDetector(checkpointPath, dataSet)
+  else:
+    detector = detectorClass(dataSet, probationaryPercent)
+    detector.initialize()
+    scores = []
+
+  data = dataSet.data
+  timestamps = data["timestamp"].tolist()
+  values = data["value"].tolist()
+  numRecords = len(values)
+  for i in xrange(len(scores), numRecords):
+    scores.append(detector.handleRecord({"timestamp": timestamps[i],
+                                         "value": values[i]}))
+    if (checkpointPath is not None and (i + 1) % checkpointInterval == 0
+        and i + 1 < numRecords):
+      checkpointDetector(detector, scores, checkpointPath)
+
+  if checkpointPath is not None:
+    # Completed streams are not run again when the run is restarted.
+    checkpointDetector(detector, scores, checkpointPath)
+
+  headers = detector.getHeaders()[data.shape[1]:]
+  results = pandas.DataFrame(scores, columns=headers, index=data.index)
+  return pandas.concat([data, results], axis=1)
+
+
+
+def _getCheckpointPath(checkpointDir, streamName):
+  if checkpointDir is None:
+    return None
+  return os.path.join(checkpointDir,
+                      "%s.checkpoint" % streamName.replace(os.sep, "_"))
+
+
+
+def _runShard(task):
+  """Run the detectors of the streams of one shard."""
+  (detectorClass, dataSets, probationaryPercent, checkpointDir,
+   checkpointInterval) = task
+  results = {}
+  for name in sorted(dataSets):
+    results[name] = runDetector(detectorClass,
+                                dataSets[name],
+                                probationaryPercent,
+                                _getCheckpointPath(checkpointDir, name),
+                                checkpointInterval)
+  return results
+
+
+
+def runDetectors(detectorClass, dataSets, probationaryPercent, numWorkers=1,
+                 checkpointDir=None, checkpointInterval=1000):
+  """
+  Run one detector per stream, with the streams sharded across a pool of
+  worker processes.
+
+  @param detectorClass: (class) AnomalyDetector subclass
+  @param dataSets: (dict) data sets (DataFile) of the streams, keyed by
+    stream name
+  @param probationaryPercent: (float) see AnomalyDetector
+  @param numWorkers: (int) number of worker processes
+  @param checkpointDir: (str) optional directory of the detector
+    checkpoints. Streams with a checkpoint resume from it.
+  @param checkpointInterval: (int) number of records between checkpoints
+  @return: (dict) results of each stream (see AnomalyDetector.run()), keyed
+    by stream name
+  """
+  if checkpointDir is not None and not os.path.exists(checkpointDir):
+    os.makedirs(checkpointDir)
+
+  tasks = [(detectorClass,
+            {name: dataSets[name] for name in shard},
+            probationaryPercent,
+            checkpointDir,
+            checkpointInterval)
+           for shard in shardStreams(dataSets.keys(), numWorkers) if shard]
+
+  if numWorkers > 1:
+    pool = multiprocessing.Pool(numWorkers)
+    try:
+      shardResults = pool.map(_runShard, tasks)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    shardResults = map(_runShard, tasks)
+
+  results = {}
+  for shardResult in shardResults:
+    results.update(shardResult)
+  return results
@@ -31,6 +31,12 @@ from nab.detectors.base import AnomalyDetector
 
 from nupic.bindings.algorithms import SpatialPooler, TemporalMemory
 
+from htmresearch.algorithms.anomaly_detection.multi_stream import (
+  computeRawAnomalyScore)
+
+NUM_COLUMNS = 2048
+CELLS_PER_COLUMN = 32
+
 
 class NumentaTMLowLevelDetector(AnomalyDetector):
   """The 'numentaTM' detector, but not using the CLAModel or network API """
@@ -41,9 +47,11 @@ class NumentaTMLowLevelDetector(AnomalyDetector):
     self.encodedValue = None
     self.timestampEncoder = None
     self.encodedTimestamp = None
+    self.spInput = None
     self.sp = None
     self.spOutput = None
     self.tm = None
+    self.columnMask = None
     self.anomalyLikelihood = None
 
     # Set this to False if you want to get results based on raw scores
@@ -70,20 +78,19 @@ class NumentaTMLowLevelDetector(AnomalyDetector):
     numBuckets = 130.0
     resolution = max(0.001, (maxVal - minVal) / numBuckets)
     self.valueEncoder = RandomDistributedScalarEncoder(resolution, seed=42)
-    self.encodedValue = np.zeros(self.valueEncoder.getWidth(),
-                                 dtype=np.uint32)
 
     # Initialize the timestamp encoder
     self.timestampEncoder = DateEncoder(timeOfDay=(21, 9.49, ))
-    self.encodedTimestamp = np.zeros(self.timestampEncoder.getWidth(),
-                                     dtype=np.uint32)
 
+    # The encoders write directly into the SP input.
     inputWidth = (self.timestampEncoder.getWidth() +
                   self.valueEncoder.getWidth())
+    self.spInput = np.zeros(inputWidth, dtype=np.uint32)
+    self._setEncoderOutputs()
 
     self.sp = SpatialPooler(**{
       "globalInhibition": True,
-      "columnDimensions": [2048],
+      "columnDimensions": [NUM_COLUMNS],
       "inputDimensions": [inputWidth],
       "potentialRadius": inputWidth,
       "numActiveColumnsPerInhArea": 40,
@@ -94,12 +101,13 @@ class NumentaTMLowLevelDetector(AnomalyDetector):
       "synPermConnected": 0.2,
       "synPermInactiveDec": 0.0005,
     })
-    self.spOutput = np.zeros(2048, dtype=np.float32)
+    self.spOutput = np.zeros(NUM_COLUMNS, dtype=np.float32)
+    self.columnMask = np.zeros(NUM_COLUMNS, dtype=bool)
 
     self.tm = TemporalMemory(**{
       "activationThreshold": 20,
-      "cellsPerColumn": 32,
-      "columnDimensions": (2048,),
+      "cellsPerColumn": CELLS_PER_COLUMN,
+      "columnDimensions": (NUM_COLUMNS,),
       "initialPermanence": 0.24,
       "maxSegmentsPerCell": 128,
       "maxSynapsesPerSegment": 128,
@@ -119,6 +127,28 @@ class NumentaTMLowLevelDetector(AnomalyDetector):
       )
 
 
+  def _setEncoderOutputs(self):
+    timestampWidth = self.timestampEncoder.getWidth()
+    self.encodedTimestamp = self.spInput[:timestampWidth]
+    self.encodedValue = self.spInput[timestampWidth:]
+
+
+  def __getstate__(self):
+    # The data set is not part of the detector state (see multi_stream.py),
+    # and the encoder outputs are views on the SP input.
+    state = self.__dict__.copy()
+    for name in ("dataSet", "encodedValue", "encodedTimestamp"):
+      state.pop(name, None)
+    return state
+
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.dataSet = None
+    if self.spInput is not None:
+      self._setEncoderOutputs()
+
+
   def handleRecord(self, inputData):
     """Returns a tuple (anomalyScore, rawScore)."""
 
@@ -129,18 +159,16 @@ class NumentaTMLowLevelDetector(AnomalyDetector):
         inputData["timestamp"], self.encodedTimestamp)
 
     # Run the encoded data through the spatial pooler
-    self.sp.compute(np.concatenate((self.encodedTimestamp,
-                                    self.encodedValue,)),
-                    True, self.spOutput)
+    self.sp.compute(self.spInput, True, self.spOutput)
 
     # At the current state, the set of the region's active columns and the set
     # of columns that have previously-predicted cells are used to calculate the
     # raw anomaly score.
-    activeColumns = set(self.spOutput.nonzero()[0].tolist())
-    prevPredictedColumns = set(self.tm.columnForCell(cell)
-                               for cell in self.tm.getPredictiveCells())
-    rawScore = (len(activeColumns - prevPredictedColumns) /
-                float(len(activeColumns)))
+    activeColumns = self.spOutput.nonzero()[0]
+    rawScore = computeRawAnomalyScore(activeColumns,
+                                      self.tm.getPredictiveCells(),
+                                      CELLS_PER_COLUMN,
+                                      self.columnMask)
 
     self.tm.compute(activeColumns)
 
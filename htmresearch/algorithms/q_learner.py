@@ -19,7 +19,6 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
-from collections import defaultdict
 import random
 
 import numpy
@@ -37,37 +36,53 @@ class QLearner(ReinforcementLearner):
                                    alpha=alpha, gamma=gamma, elambda=elambda)
     self.n = n
 
-    self.weights = defaultdict(lambda: numpy.zeros(self.n))
+    # One row of weights per action. Actions that are not in self.actions get
+    # a row the first time they are seen in an update.
+    self._actionIndices = dict((action, i) for i, action in enumerate(actions))
+    self.weights = numpy.zeros((len(actions), self.n))
 
+    # Eligibility traces, same layout as the weights. Only the entries of the
+    # state-action pairs seen since the last reset can be nonzero, their flat
+    # indices are kept sorted in _traceIndices.
+    self.traces = numpy.zeros((len(actions), self.n))
+    self._traceIndices = numpy.zeros(0, dtype=int)
 
-  def qValue(self, state, action):
-    qValue = 0
 
-    for i in state.nonzero()[0]:
-      qValue += self.weights[action][i] * state[i]
+  def reset(self):
+    """Clear the eligibility traces, e.g. at the end of an episode."""
+    self.traces.ravel()[self._traceIndices] = 0
+    self._traceIndices = numpy.zeros(0, dtype=int)
 
-    return qValue
 
+  def qValues(self, state):
+    """Return the Q values of all the actions in self.actions for a state."""
+    activeBits = state.nonzero()[0]
+    return numpy.dot(self.weights[:len(self.actions), activeBits],
+                     state[activeBits])
 
-  def value(self, state):
-    qValues = [self.qValue(state, action) for action in self.actions]
-    return max(qValues) if len(qValues) else 0.0
 
+  def qValue(self, state, action):
+    index = self._actionIndices.get(action)
+    if index is None:
+      return 0.0
 
-  def bestAction(self, state):
-    bestActions = []
-    maxQValue = float("-inf")
+    activeBits = state.nonzero()[0]
+    return numpy.dot(self.weights[index, activeBits], state[activeBits])
 
-    for action in self.actions:
-      qValue = self.qValue(state, action)
 
-      if qValue > maxQValue:
-        bestActions = [action]
-        maxQValue = qValue
-      elif qValue == maxQValue:
-        bestActions.append(action)
+  def value(self, state):
+    qValues = self.qValues(state)
+    return qValues.max() if len(qValues) else 0.0
+
+
+  def bestAction(self, state):
+    qValues = self.qValues(state)
+    if not len(qValues):
+      return None
 
-    return random.choice(bestActions) if len(bestActions) else None
+    bestActions = [self.actions[i]
+                   for i in numpy.flatnonzero(qValues == qValues.max())]
+    return random.choice(bestActions)
 
 
   def update(self, state, action, nextState, nextAction, reward):
@@ -75,5 +90,69 @@ class QLearner(ReinforcementLearner):
     qValue = self.qValue(state, action)
     correction = (targetValue - qValue) / sum(state)
 
-    for i in state.nonzero()[0]:
-      self.weights[action][i] += self.alpha * correction
+    index = self._actionIndex(action)
+    activeBits = state.nonzero()[0]
+    decay = self.gamma * self.elambda
+    if decay == 0:
+      # Without traces only the current state-action pair is updated
+      self.weights[index, activeBits] += self.alpha * correction
+      return
+
+    # Decay the traces, then add 1 to the bits of the state for this action,
+    # whatever their value in the state, so that with elambda=0 each active bit
+    # moves by alpha * correction. Only the nonzero traces are touched.
+    traceIndices = numpy.union1d(self._traceIndices,
+                                 index * self.n + activeBits)
+    self._traceIndices = traceIndices
+    traces = self.traces.ravel()
+    traces[traceIndices] *= decay
+    self.traces[index, activeBits] += 1
+
+    self.weights.ravel()[traceIndices] += (self.alpha * correction *
+                                           traces[traceIndices])
+
+
+  def updateBatch(self, states, actions, nextStates, nextActions, rewards):
+    """
+    Replay a batch of transitions. The Q values and the targets of all the
+    transitions are computed from the current weights, and the corrections
+    are applied together. Eligibility traces are not used, since replayed
+    transitions are not consecutive.
+
+    @param states      (2D array or list of arrays) states of the transitions
+    @param actions     (list) actions taken in each state
+    @param nextStates  (2D array or list of arrays) resulting states
+    @param nextActions (list) actions taken in the resulting states
+    @param rewards     (list) rewards of the transitions
+    """
+    states = numpy.atleast_2d(numpy.asarray(states, dtype=float))
+    nextStates = numpy.atleast_2d(numpy.asarray(nextStates, dtype=float))
+    rewards = numpy.asarray(rewards, dtype=float)
+    rows = numpy.array([self._actionIndex(action) for action in actions],
+                       dtype=int)
+
+    numActions = len(self.actions)
+    if numActions:
+      nextValues = numpy.dot(nextStates, self.weights[:numActions].T).max(axis=1)
+    else:
+      nextValues = numpy.zeros(len(rewards))
+    targetValues = rewards + self.gamma * nextValues
+    qValues = numpy.einsum("ij,ij->i", states, self.weights[rows])
+    corrections = (targetValues - qValues) / states.sum(axis=1)
+
+    # Same update as update() with elambda=0, for every transition
+    deltas = numpy.zeros((len(self.weights), self.n))
+    activeRows, activeBits = (states != 0).nonzero()
+    numpy.add.at(deltas, (rows[activeRows], activeBits),
+                 corrections[activeRows])
+    self.weights += self.alpha * deltas
+
+
+  def _actionIndex(self, action):
+    index = self._actionIndices.get(action)
+    if index is None:
+      index = len(self.weights)
+      self._actionIndices[action] = index
+      self.weights = numpy.vstack((self.weights, numpy.zeros(self.n)))
+      self.traces = numpy.vstack((self.traces, numpy.zeros(self.n)))
+    return index
@@ -30,6 +30,7 @@ from collections import deque
 import itertools
 
 import numpy
+from scipy import sparse
 
 g_debugPrefix = "SDRClassifier"
 
@@ -74,12 +75,13 @@ class SDRClassifier(object):
                steps=(1,),
                alpha=0.001,
                actValueAlpha=0.3,
-               verbosity=0):
+               verbosity=0,
+               numInputs=None,
+               numBuckets=None):
     """Constructor for the SDR classifier.
 
     Parameters:
     ---------------------------------------------------------------------
-    @param numInputs (int) Length of the input activation pattern
     @param steps (list) Sequence of the different steps of multi-step
         predictions to learn
     @param alpha (float) The alpha used to adapt the weight matrix during
@@ -87,6 +89,11 @@ class SDRClassifier(object):
     @param actValueAlpha (float) Used to track the actual value within each
         bucket. A lower actValueAlpha results in longer term memory
     @param verbosity (int) verbosity level, can be 0, 1, or 2
+    @param numInputs (int) Expected length of the input activation pattern.
+        Optional; used to pre-allocate the weight matrices. Larger input
+        indices are still accepted, the storage grows as needed.
+    @param numBuckets (int) Expected number of buckets. Optional; used to
+        pre-allocate the weight matrices.
     """
     # Save constructor args
     self.steps = steps
@@ -124,11 +131,16 @@ class SDRClassifier(object):
     # each bucket index during inference
     self._maxBucketIdx = 0
 
-    # The connection weight matrix
+    # The connection weight matrix. The matrices are allocated with spare
+    # capacity: only the [:_maxInputIdx+1, :_maxBucketIdx+1] block is in use,
+    # the rest is zero padding that lets the classifier see new inputs and
+    # buckets without reallocating on every new index.
     self._weightMatrix = dict()
+    self._inputCapacity = max(numInputs or 0, 1)
+    self._bucketCapacity = max(numBuckets or 0, 1)
     for step in self.steps:
-      self._weightMatrix[step] = numpy.zeros(shape=(self._maxInputIdx+1,
-                                                    self._maxBucketIdx+1))
+      self._weightMatrix[step] = numpy.zeros(shape=(self._inputCapacity,
+                                                    self._bucketCapacity))
 
     # This keeps track of the actual value to use for each bucket index. We
     # start with 1 bucket, no actual value so that the first infer has something
@@ -200,15 +212,9 @@ class SDRClassifier(object):
     # of the inference block.
     retval = None
 
-    # Update maxInputIdx and augment weight matrix with zero padding
-    if max(patternNZ) > self._maxInputIdx:
-      newMaxInputIdx = max(patternNZ)
-      for nSteps in self.steps:
-        self._weightMatrix[nSteps] = numpy.concatenate((
-          self._weightMatrix[nSteps],
-          numpy.zeros(shape=(newMaxInputIdx-self._maxInputIdx,
-                             self._maxBucketIdx+1))), axis=0)
-      self._maxInputIdx = newMaxInputIdx
+    # Update maxInputIdx and make room in the weight matrix
+    if len(patternNZ) > 0:
+      self._growWeightMatrix(maxInputIdx=max(patternNZ))
 
     # ------------------------------------------------------------------------
     # Inference:
@@ -223,38 +229,22 @@ class SDRClassifier(object):
       bucketIdx = classification["bucketIdx"]
       actValue = classification["actValue"]
 
-      # Update maxBucketIndex and augment weight matrix with zero padding
-      if bucketIdx > self._maxBucketIdx:
-        for nSteps in self.steps:
-          self._weightMatrix[nSteps] = numpy.concatenate((
-            self._weightMatrix[nSteps],
-            numpy.zeros(shape=(self._maxInputIdx+1,
-                               bucketIdx-self._maxBucketIdx))), axis=1)
-
-        self._maxBucketIdx = bucketIdx
-
-      # Update rolling average of actual values if it's a scalar. If it's
-      # not, it must be a category, in which case each bucket only ever
-      # sees one category so we don't need a running average.
-      while self._maxBucketIdx > len(self._actualValues) - 1:
-        self._actualValues.append(None)
-      if self._actualValues[bucketIdx] is None:
-        self._actualValues[bucketIdx] = actValue
-      else:
-        if isinstance(actValue, int) or isinstance(actValue, float):
-          self._actualValues[bucketIdx] = ((1.0 - self.actValueAlpha)
-                                           * self._actualValues[bucketIdx]
-                                           + self.actValueAlpha * actValue)
-        else:
-          self._actualValues[bucketIdx] = actValue
+      # Update maxBucketIndex and make room in the weight matrix
+      self._growWeightMatrix(maxBucketIdx=bucketIdx)
 
-      for (iteration, learnPatternNZ) in self._patternNZHistory:
-        error = self.calculateError(classification)
+      self._updateActualValue(bucketIdx, actValue)
 
+      # Each step's weight matrix is only updated once per record, so all the
+      # errors can be computed up front, before any update.
+      error = self.calculateError(classification, retval)
+
+      numBuckets = self._maxBucketIdx + 1
+      for (iteration, learnPatternNZ) in self._patternNZHistory:
         nSteps = self._learnIteration - iteration
         if nSteps in self.steps:
-          for bit in learnPatternNZ:
-            self._weightMatrix[nSteps][bit, :] += self.alpha * error[nSteps]
+          self._addToRows(self._weightMatrix[nSteps][:, :numBuckets],
+                          numpy.asarray(learnPatternNZ, dtype=int),
+                          self.alpha * error[nSteps])
 
     # ------------------------------------------------------------------------
     # Verbose print
@@ -274,6 +264,92 @@ class SDRClassifier(object):
     return retval
 
 
+  def computeBatch(self, recordNums, patternNZs, classifications,
+                   learn=True, infer=True):
+    """
+    Process a block of consecutive input samples at once.
+
+    Inference and learning are done for all the records with one sparse row
+    gather and one scatter-add per step instead of a Python loop per record
+    and per active bit. Within a batch, the predictions and the errors are
+    computed with the weights as they were at the start of the batch, and the
+    weight updates of all the records are applied together (i.e. minibatch
+    learning). With a batch of one record, this is the same as compute().
+
+    Parameters:
+    --------------------------------------------------------------------
+    @param recordNums  List of record numbers, in increasing order.
+    @param patternNZs  List of active indices lists, one per record.
+    @param classifications List of classification dicts, one per record.
+                See compute().
+    @param learn (bool) if true, learn these samples
+    @param infer (bool) if true, perform inference
+
+    @return     List with one inference dict per record (see compute()), or
+                None if infer is False.
+    """
+    numRecords = len(recordNums)
+    if numRecords == 0:
+      return [] if infer else None
+
+    if self._recordNumMinusLearnIteration is None:
+      self._recordNumMinusLearnIteration = recordNums[0] - self._learnIteration
+
+    iterations = [recordNum - self._recordNumMinusLearnIteration
+                  for recordNum in recordNums]
+
+    # Patterns available for learning, keyed by learn iteration. It combines
+    # the history of previous computes with the patterns of this batch.
+    patternsByIteration = dict(self._patternNZHistory)
+    for iteration, patternNZ in itertools.izip(iterations, patternNZs):
+      patternsByIteration[iteration] = patternNZ
+      self._patternNZHistory.append((iteration, patternNZ))
+    self._learnIteration = iterations[-1]
+
+    maxInputIdx = max([max(patternNZ) for patternNZ in patternNZs
+                       if len(patternNZ) > 0] or [0])
+    self._growWeightMatrix(maxInputIdx=maxInputIdx)
+
+    retval = None
+    if infer:
+      activations = self._batchActivations(patternNZs)
+      retval = []
+      for i in xrange(numRecords):
+        retval.append(self._formatInference(
+          classifications[i],
+          dict((nSteps, activations[nSteps][i]) for nSteps in self.steps)))
+
+    if learn:
+      learnRecords = [i for i in xrange(numRecords)
+                      if classifications[i]["bucketIdx"] is not None]
+      if len(learnRecords) > 0:
+        self._growWeightMatrix(
+          maxBucketIdx=max(classifications[i]["bucketIdx"]
+                           for i in learnRecords))
+        for i in learnRecords:
+          self._updateActualValue(classifications[i]["bucketIdx"],
+                                  classifications[i]["actValue"])
+
+        numBuckets = self._maxBucketIdx + 1
+        for nSteps in self.steps:
+          # Records that have a pattern from nSteps ago to learn from.
+          records = [i for i in learnRecords
+                     if iterations[i] - nSteps in patternsByIteration]
+          if len(records) == 0:
+            continue
+          learnPatternNZs = [patternsByIteration[iterations[i] - nSteps]
+                             for i in records]
+          predictDist = self._batchActivations(learnPatternNZs, [nSteps])
+          error = -predictDist[nSteps]
+          error[numpy.arange(len(records)),
+                [classifications[i]["bucketIdx"] for i in records]] += 1.0
+
+          bits, patterns = self._patternMatrix(learnPatternNZs)
+          self._weightMatrix[nSteps][bits, :numBuckets] += (
+            patterns.T.dot(self.alpha * error))
+
+    return retval
+
 
   def infer(self, patternNZ, classification):
     """
@@ -302,7 +378,19 @@ class SDRClassifier(object):
     # Return value dict. For buckets which we don't have an actual value
     # for yet, just plug in any valid actual value. It doesn't matter what
     # we use because that bucket won't have non-zero likelihood anyways.
+    predictDists = dict()
+    for nSteps in self.steps:
+      predictDists[nSteps] = self.inferSingleStep(patternNZ,
+                                                  self._weightMatrix[nSteps])
+
+    return self._formatInference(classification, predictDists)
 
+
+  def _formatInference(self, classification, predictDists):
+    """
+    Build the inference dict returned by infer() from the predicted
+    distributions of each step.
+    """
     # NOTE: If doing 0-step prediction, we shouldn't use any knowledge
     #  of the classification input during inference.
     if self.steps[0] == 0:
@@ -312,19 +400,14 @@ class SDRClassifier(object):
     actValues = [x if x is not None else defaultValue
                  for x in self._actualValues]
     retval = {"actualValues": actValues}
-
-    for nSteps in self.steps:
-      predictDist = self.inferSingleStep(patternNZ, self._weightMatrix[nSteps])
-
-      retval[nSteps] = predictDist
-
+    retval.update(predictDists)
     return retval
 
 
   def inferSingleStep(self, patternNZ, weightMatrix):
-    outputActivation = numpy.zeros(self._maxBucketIdx + 1)
-    for bit in patternNZ:
-      outputActivation += weightMatrix[bit, :]
+    numBuckets = self._maxBucketIdx + 1
+    outputActivation = weightMatrix[numpy.asarray(patternNZ, dtype=int),
+                                    :numBuckets].sum(axis=0)
 
     # softmax normalization
     expOutputActivation = numpy.exp(outputActivation)
@@ -332,10 +415,14 @@ class SDRClassifier(object):
     return predictDist
 
 
-  def calculateError(self, classification):
+  def calculateError(self, classification, inference=None):
     """
     Calculate error signal
     :param classification:
+    :param inference: optional dict returned by infer() for the current
+                      pattern. Its 0-step distribution is reused instead of
+                      being computed again when the number of buckets hasn't
+                      changed since.
     :return: dict containing error. The key is the number of steps
              The value is a numpy array of error at the output layer
     """
@@ -346,9 +433,120 @@ class SDRClassifier(object):
     for (iteration, learnPatternNZ) in self._patternNZHistory:
       nSteps = self._learnIteration - iteration
       if nSteps in self.steps:
-        predictDist = self.inferSingleStep(learnPatternNZ,
-                                           self._weightMatrix[nSteps])
+        if (nSteps == 0 and inference is not None and
+            len(inference[0]) == len(targetDist)):
+          predictDist = inference[0]
+        else:
+          predictDist = self.inferSingleStep(learnPatternNZ,
+                                             self._weightMatrix[nSteps])
         error[nSteps] = targetDist - predictDist
 
     return error
 
+
+  def _batchActivations(self, patternNZs, steps=None):
+    """
+    Compute the predicted distributions of several patterns at once.
+
+    :param patternNZs: list of active indices lists
+    :param steps: steps to compute, defaults to self.steps
+    :return: dict, the key is the number of steps, the value is an array of
+             shape (len(patternNZs), numBuckets) with one softmax distribution
+             per pattern
+    """
+    numBuckets = self._maxBucketIdx + 1
+    bits, patterns = self._patternMatrix(patternNZs)
+    predictDists = dict()
+    for nSteps in steps if steps is not None else self.steps:
+      outputActivation = patterns.dot(
+        self._weightMatrix[nSteps][bits, :numBuckets])
+      expOutputActivation = numpy.exp(outputActivation)
+      predictDists[nSteps] = (expOutputActivation /
+                              expOutputActivation.sum(axis=1)[:, None])
+    return predictDists
+
+
+  @staticmethod
+  def _addToRows(matrix, rows, values):
+    """
+    Scatter-add values to the given rows of matrix, in place. Repeated rows
+    receive all their updates.
+    """
+    if len(numpy.unique(rows)) == len(rows):
+      # Plain fancy-index update, much faster than numpy.add.at
+      matrix[rows] += values
+    else:
+      numpy.add.at(matrix, rows, values)
+
+
+  @staticmethod
+  def _patternMatrix(patternNZs):
+    """
+    Build a sparse matrix representation of a list of patterns.
+
+    :return: (bits, patterns) where bits is the sorted array of the distinct
+             active bits of all the patterns and patterns is a CSR matrix of
+             shape (len(patternNZs), len(bits)) counting how many times each
+             bit is active in each pattern.
+    """
+    lengths = [len(patternNZ) for patternNZ in patternNZs]
+    if sum(lengths) == 0:
+      return (numpy.zeros(0, dtype=int),
+              sparse.csr_matrix((len(patternNZs), 0)))
+    allBits = numpy.concatenate([numpy.asarray(patternNZ, dtype=int)
+                                 for patternNZ in patternNZs])
+    bits, columns = numpy.unique(allBits, return_inverse=True)
+    indptr = numpy.concatenate(([0], numpy.cumsum(lengths)))
+    patterns = sparse.csr_matrix((numpy.ones(len(allBits)), columns, indptr),
+                                 shape=(len(patternNZs), len(bits)))
+    patterns.sum_duplicates()
+    return bits, patterns
+
+
+  def _growWeightMatrix(self, maxInputIdx=None, maxBucketIdx=None):
+    """
+    Make sure the weight matrices can hold input index maxInputIdx and bucket
+    index maxBucketIdx. The matrices double their capacity when they run out
+    of room, so a growing number of inputs or buckets only costs a logarithmic
+    number of reallocations.
+    """
+    if maxInputIdx is not None and maxInputIdx > self._maxInputIdx:
+      self._maxInputIdx = maxInputIdx
+    if maxBucketIdx is not None and maxBucketIdx > self._maxBucketIdx:
+      self._maxBucketIdx = maxBucketIdx
+
+    inputCapacity = self._inputCapacity
+    while inputCapacity < self._maxInputIdx + 1:
+      inputCapacity *= 2
+    bucketCapacity = self._bucketCapacity
+    while bucketCapacity < self._maxBucketIdx + 1:
+      bucketCapacity *= 2
+
+    if (inputCapacity, bucketCapacity) != (self._inputCapacity,
+                                           self._bucketCapacity):
+      for nSteps in self.steps:
+        weightMatrix = numpy.zeros(shape=(inputCapacity, bucketCapacity))
+        weightMatrix[:self._inputCapacity, :self._bucketCapacity] = (
+          self._weightMatrix[nSteps])
+        self._weightMatrix[nSteps] = weightMatrix
+      self._inputCapacity = inputCapacity
+      self._bucketCapacity = bucketCapacity
+
+
+  def _updateActualValue(self, bucketIdx, actValue):
+    """
+    Update rolling average of actual values if it's a scalar. If it's
+    not, it must be a category, in which case each bucket only ever
+    sees one category so we don't need a running average.
+    """
+    while self._maxBucketIdx > len(self._actualValues) - 1:
+      self._actualValues.append(None)
+    if self._actualValues[bucketIdx] is None:
+      self._actualValues[bucketIdx] = actValue
+    else:
+      if isinstance(actValue, int) or isinstance(actValue, float):
+        self._actualValues[bucketIdx] = ((1.0 - self.actValueAlpha)
+                                         * self._actualValues[bucketIdx]
+                                         + self.actValueAlpha * actValue)
+      else:
+        self._actualValues[bucketIdx] = actValue
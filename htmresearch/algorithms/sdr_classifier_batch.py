@@ -5,11 +5,12 @@ Training is achieved with gradient descent
 import numpy as np
 import scipy
 from scipy import optimize
+from scipy import sparse
 
 def L2regularization(w, regularizationLambda):
   dW = np.zeros(w.shape)
   costLL = 0
-  if regularizationLambda is None:
+  if not regularizationLambda:
     return costLL, dW
   else:
     for i in range(len(regularizationLambda['lambdaL2'])):
@@ -21,34 +22,53 @@ def L2regularization(w, regularizationLambda):
 
 
 
+def asInputMatrix(sdrInputs):
+  """
+  Stack sdr inputs into a (numSamples, numInputs) matrix. Sparse matrices are
+  converted to CSR and kept sparse, anything else becomes a dense 2D array.
+  :param sdrInputs: list of sdr inputs, 2D array or scipy sparse matrix
+  :return: 2D numpy array or CSR matrix
+  """
+  if sparse.issparse(sdrInputs):
+    return sdrInputs.tocsr()
+  return np.atleast_2d(np.asarray(sdrInputs, dtype=np.float64))
+
+
+
+def logSoftmax(activation):
+  """
+  Numerically stable log of the softmax of each row of activation
+  :param activation: (numSamples, numClass) array
+  :return: (numSamples, numClass) array of log-probabilities
+  """
+  shifted = activation - np.max(activation, axis=1, keepdims=True)
+  return shifted - np.log(np.sum(np.exp(shifted), axis=1, keepdims=True))
+
+
+
 def costFuncClassifier(w, sdrInputs, classLabels, regularizationLambda=0):
   """
   :param w: feedforward weight matrix (numInputs, numClass)
-  :param sdrInputs: list of sdr inputs
+  :param sdrInputs: list of sdr inputs, 2D array or scipy sparse matrix
   :param classLabels: list of class labels
   :return: costLL negative log likelihood
   """
-
-  numSamples = len(sdrInputs)
-  numInputs = len(sdrInputs[0])
+  sdrInputs = asInputMatrix(sdrInputs)
+  classLabels = np.asarray(classLabels, dtype=int)
+  numSamples, numInputs = sdrInputs.shape
   numClass = len(w)/numInputs
 
   costLLL2, dWL2 = L2regularization(w, regularizationLambda)
   w = np.reshape(w, (numInputs, numClass))
   # cost: negative log-likelihood
-  costLL = 0
-  dW = np.zeros((numInputs, numClass))
-  for i in range(numSamples):
-    activation = np.dot(sdrInputs[i], w)
-    y = np.exp(activation)
-    y = y/np.sum(y)
+  logY = logSoftmax(sdrInputs.dot(w))
+  samples = np.arange(numSamples)
+  costLL = -np.sum(logY[samples, classLabels])
 
-    target = np.zeros((numClass, ))
-    target[classLabels[i]] = 1
-
-    costLL -= np.log(y[classLabels[i]])
-    dW += np.dot(np.reshape(sdrInputs[i], (numInputs, 1)),
-                 np.reshape((y - target), (1, numClass)))
+  # gradient: sum over samples of the outer product of input and (y - target)
+  yMinusTarget = np.exp(logY)
+  yMinusTarget[samples, classLabels] -= 1
+  dW = np.asarray(sdrInputs.T.dot(yMinusTarget))
 
   dW = np.reshape(dW, (numInputs * numClass,))
 
@@ -68,28 +88,81 @@ class classificationNetwork(object):
 
   def optimize(self, sdrInputs, trainLabel, wInit):
     (wOpt, nfeval, rc) = scipy.optimize.fmin_tnc(costFuncClassifier, wInit,
-                                                 args=(sdrInputs, trainLabel,
+                                                 args=(asInputMatrix(sdrInputs),
+                                                       trainLabel,
                                                        self.regularizationLambda))
     self.w = wOpt
 
 
+  def optimizeMinibatch(self, sdrInputs, trainLabel, wInit=None,
+                        method="adam", learningRate=0.001, batchSize=128,
+                        numEpochs=10, beta1=0.9, beta2=0.999, epsilon=1e-8,
+                        seed=None):
+    """
+    Minibatch gradient descent, for training sets too big for optimize().
+    Each step follows the mean gradient of a random minibatch.
+    :param sdrInputs: list of sdr inputs, 2D array or scipy sparse matrix
+    :param trainLabel: list of class labels
+    :param wInit: initial weights, defaults to the current weights
+    :param method: "sgd" or "adam"
+    :param learningRate: step size
+    :param batchSize: number of samples per minibatch
+    :param numEpochs: number of passes over the training set
+    :param beta1: adam decay rate of the first moment estimate
+    :param beta2: adam decay rate of the second moment estimate
+    :param epsilon: adam numerical stability constant
+    :param seed: seed of the minibatch shuffling
+    :return: list of the cost of each epoch
+    """
+    if method not in ("sgd", "adam"):
+      raise ValueError("Unknown optimization method: {}".format(method))
+
+    sdrInputs = asInputMatrix(sdrInputs)
+    trainLabel = np.asarray(trainLabel, dtype=int)
+    numSamples = sdrInputs.shape[0]
+    rng = np.random.RandomState(seed)
+
+    w = np.array(self.w if wInit is None else wInit, dtype=np.float64)
+    m = np.zeros(w.shape)
+    v = np.zeros(w.shape)
+    t = 0
+
+    costs = []
+    for _ in range(numEpochs):
+      order = rng.permutation(numSamples)
+      epochCost = 0
+      for start in range(0, numSamples, batchSize):
+        batch = order[start:start + batchSize]
+        # spread the regularization over the minibatches of an epoch
+        cost, dW = costFuncClassifier(w, sdrInputs[batch], trainLabel[batch])
+        costLLL2, dWL2 = L2regularization(w, self.regularizationLambda)
+        fraction = float(len(batch)) / numSamples
+        epochCost += cost + costLLL2 * fraction
+        grad = (dW + dWL2 * fraction) / len(batch)
+
+        if method == "sgd":
+          w -= learningRate * grad
+        else:
+          t += 1
+          m = beta1 * m + (1 - beta1) * grad
+          v = beta2 * v + (1 - beta2) * np.square(grad)
+          mHat = m / (1 - beta1 ** t)
+          vHat = v / (1 - beta2 ** t)
+          w -= learningRate * mHat / (np.sqrt(vHat) + epsilon)
+      costs.append(epochCost)
+
+    self.w = w
+    return costs
+
+
   def classify(self, sdrInputs):
     w = np.reshape(self.w, (self.numInputs, self.numClass))
-    numSample = len(sdrInputs)
-    classProb = np.zeros((numSample, self.numClass))
-    for i in range(numSample):
-      activation = np.dot(sdrInputs[i], w)
-      y = np.exp(activation)
-      classProb[i, :] = y / np.sum(y)
-    return classProb
+    return np.exp(logSoftmax(asInputMatrix(sdrInputs).dot(w)))
 
 
   def accuracy(self, sdrInputs, labels):
     classProb = self.classify(sdrInputs)
-    numSample = len(sdrInputs)
-    numCorrect = 0
-    for i in range(numSample):
-      numCorrect += (np.argmax(classProb[i, :]) == labels[i])
+    numCorrect = np.sum(np.argmax(classProb, axis=1) == np.asarray(labels))
 
-    accuracy = np.float(numCorrect)/numSample
-    return accuracy
\ No newline at end of file
+    accuracy = np.float(numCorrect)/len(labels)
+    return accuracy
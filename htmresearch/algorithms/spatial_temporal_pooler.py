@@ -113,7 +113,12 @@ class SpatialTemporalPooler(object):
   def _computeOverlaps(self, inputVector, predictedCells):
     scores = numpy.array(inputVector)
     scores[predictedCells == 1] += 10
-    overlaps = numpy.dot(self._permanences, numpy.transpose(scores))
+
+    # Inputs with a zero score don't contribute, so only the permanences of
+    # the active and predicted inputs are read.
+    activeInputs = scores.nonzero()[0]
+    overlaps = numpy.dot(self._permanences[:, activeInputs],
+                         scores[activeInputs])
 
     overlaps = self._overlaps * .32 + overlaps
     self._overlaps = overlaps
@@ -136,13 +141,17 @@ class SpatialTemporalPooler(object):
 
 
   def _adaptPermanences(self, activeColumns, inputVector, predictedCells):
-    for column in activeColumns:
-      delta = numpy.zeros(self.getNumInputs())
-      delta[predictedCells == 1] = self.synPredictedInc
-      permanences = self._permanences[column]
-      total = permanences.sum()
-      permanences += delta
-      permanences /= (permanences.sum() / total)
-      self._permanences[column] = permanences
-
-    self._connectedCounts = self._computeConnectedCounts()
+    # Reinforce the predicted inputs of all the active columns at once, then
+    # scale each of their rows back to its previous total.
+    predictedInputs = numpy.where(predictedCells == 1)[0]
+    if len(activeColumns) == 0 or len(predictedInputs) == 0:
+      return
+
+    permanences = self._permanences[activeColumns]
+    total = permanences.sum(axis=1)
+    permanences[:, predictedInputs] += self.synPredictedInc
+    permanences /= (permanences.sum(axis=1) / total)[:, numpy.newaxis]
+    self._permanences[activeColumns] = permanences
+
+    # Only the rows of the active columns changed
+    self._connectedCounts[activeColumns] = permanences.sum(axis=1)
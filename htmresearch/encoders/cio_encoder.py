@@ -18,20 +18,19 @@
 #
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
+import copy
 import itertools
 import numpy
 import os
 
-import random
-
 from cortipy.cortical_client import CorticalClient, RETINA_SIZES
 from cortipy.exceptions import UnsuccessfulEncodingError
 from htmresearch.encoders import EncoderTypes
+from htmresearch.encoders.fingerprint_store import FingerprintCache
 from htmresearch.encoders.language_encoder import LanguageEncoder
+from htmresearch.encoders.window_union import WindowUnion
 from htmresearch.support.text_preprocess import TextPreprocess
 
-from nupic.bindings.math import SparseMatrix
-
 
 DEFAULT_RETINA = "en_synonymous"
 
@@ -49,7 +48,8 @@ class CioEncoder(LanguageEncoder):
   def __init__(self, retina=DEFAULT_RETINA, retinaScaling=1.0, cacheDir=None,
                verbosity=0, fingerprintType=EncoderTypes.document,
                unionSparsity=0.20, apiKey=None,
-               maxSparsity=0.50):
+               maxSparsity=0.50, client=None, fingerprintStoreDir=None,
+               fingerprintCacheSize=100000):
     """
     @param retina          (str)      Cortical.io retina, either "en_synonymous"
                                       or "en_associative".
@@ -64,10 +64,21 @@ class CioEncoder(LanguageEncoder):
                                       bitmap. If the percentage of bits in the
                                       encoding is > maxSparsity, it will be
                                       randomly subsampled.
+    @param client          (object)   Client used instead of cortipy's
+                                      CorticalClient, e.g. a
+                                      FakeCorticalClient. No API key is
+                                      needed then.
+    @param fingerprintStoreDir (str)  Where to store word fingerprints (see
+                                      FingerprintStore). Defaults to a
+                                      directory in cacheDir, unless a client
+                                      is given.
+    @param fingerprintCacheSize (int) Number of word fingerprints kept in
+                                      memory.
 
     TODO: replace enum with a simple string
     """
-    if apiKey is None and "CORTICAL_API_KEY" not in os.environ:
+    if (client is None and apiKey is None and
+        "CORTICAL_API_KEY" not in os.environ):
       print ("Missing CORTICAL_API_KEY environment variable. If you have a "
         "key, set it with $ export CORTICAL_API_KEY=api_key\n"
         "You can retrieve a key by registering for the REST API at "
@@ -81,10 +92,23 @@ class CioEncoder(LanguageEncoder):
       root = os.path.dirname(os.path.realpath(__file__))
       cacheDir = os.path.join(root, "CioCache")
 
-    self.apiKey = apiKey if apiKey else os.environ["CORTICAL_API_KEY"]
+    self.apiKey = apiKey if apiKey else os.environ.get("CORTICAL_API_KEY")
     self.retina = retina
-
-    self.client = CorticalClient(self.apiKey, retina=retina, cacheDir=cacheDir)
+    # Whether the word fingerprints are stored in cacheDir, which may not be
+    # the same on the machine that unpickles the encoder.
+    self._defaultFingerprintStore = (client is None and
+                                     fingerprintStoreDir is None)
+
+    if client is None:
+      self.client = CorticalClient(self.apiKey, retina=retina,
+                                   cacheDir=cacheDir)
+      if fingerprintStoreDir is None:
+        fingerprintStoreDir = os.path.join(cacheDir, "fingerprints", retina)
+    else:
+      self.client = client
+    self._fingerprints = FingerprintCache(self.client,
+                                          storePath=fingerprintStoreDir,
+                                          maxSize=fingerprintCacheSize)
 
     self._setDimensions(retinaScaling)
 
@@ -120,6 +144,10 @@ class CioEncoder(LanguageEncoder):
       self.client = CorticalClient(self.apiKey,
                                    retina=self.retina,
                                    cacheDir=value)
+      self._fingerprints.client = self.client
+      if getattr(self, "_defaultFingerprintStore", False):
+        self._fingerprints.openStore(
+          os.path.join(value, "fingerprints", self.retina))
 
 
   def __setstate__(self, state):
@@ -128,12 +156,24 @@ class CioEncoder(LanguageEncoder):
     calculated cacheDir, in the event that the previously pickled
     CorticalClient instance includes a cacheDir that does not exist, which is
     likely the case when a model is trained on one machine for reuse elsewhere.
+    The default fingerprint store is reopened in the calculated cacheDir too.
     """
-    if "_cacheDir" not in state:
+    relocate = "_cacheDir" not in state
+    if relocate and isinstance(state["client"], CorticalClient):
       state["client"] = CorticalClient(state["apiKey"],
                                        retina=state["client"].retina,
                                        cacheDir=self.cacheDir)
 
+    if "_fingerprints" in state:
+      state["_fingerprints"].client = state["client"]
+    else:
+      # Encoders pickled before the fingerprint cache existed.
+      state["_fingerprints"] = FingerprintCache(state["client"])
+
+    if relocate and state.get("_defaultFingerprintStore"):
+      state["_fingerprints"].openStore(
+        os.path.join(self.cacheDir, "fingerprints", state["retina"]))
+
     self.__dict__ = state
 
 
@@ -185,6 +225,33 @@ class CioEncoder(LanguageEncoder):
     return self.finishEncoding(encoding)
 
 
+  def encodeMany(self, texts):
+    """
+    Encode a batch of texts, as encode() does. Word fingerprints are looked up
+    once for all the distinct tokens of the batch, and identical texts are
+    only encoded once.
+
+    @param  texts   (list)            Non-tokenized samples of text.
+    @return         (list)            Encoding dict of each text (see
+                                      encode()).
+    """
+    if self.fingerprintType == EncoderTypes.word:
+      preprocessor = TextPreprocess()
+      self._fingerprints.getMany(itertools.chain.from_iterable(
+        preprocessor.tokenize(text) for text in set(texts)))
+
+    encodings = {}
+    results = []
+    for text in texts:
+      if text in encodings:
+        # Encodings are mutable dicts, so duplicates get their own copy.
+        results.append(copy.deepcopy(encodings[text]))
+      else:
+        encodings[text] = self.encode(text)
+        results.append(encodings[text])
+    return results
+
+
   def getUnionEncodingFromTokens(self, tokens):
     """
     Create a single, sparsified bitmap from a union of bitmaps for given tokens
@@ -192,32 +259,19 @@ class CioEncoder(LanguageEncoder):
     @param  tokens  (sequence) A sequence of tokens
     @return         (sequence) Bitmap
     """
-    # Accumulate counts by inplace-adding sparse matrices
-    counts = SparseMatrix()
-    counts.resize(1, self.width*self.height)
-
-    # Pre-allocate buffer sparse matrix
-    sparseBitmap = SparseMatrix()
-    sparseBitmap.resize(1, self.width*self.height)
+    tokens = list(tokens)
+    fingerprints = self._fingerprints.getMany(tokens)
 
+    # Accumulate counts of each bit over the tokens
+    counts = WindowUnion(self.width*self.height)
     for t in tokens:
-      bitmap = self._getWordBitmap(t)
-      sparseBitmap.setRowFromSparse(0, bitmap, [1]*len(bitmap))
-      counts += sparseBitmap
-
-    numNonZeros = counts.nNonZerosOnRow(0)
-
-    # Add some jitter to aid in tie-breaking during sort
-    jitterValues = tuple((random.random()/100)+0.1
-                         for _ in xrange(numNonZeros))
-    sparseBitmap.setRowFromSparse(0, counts.nonZeroCols(), jitterValues)
-    counts += sparseBitmap
+      counts.append(fingerprints[t])
 
     maxSparsity = int(self.unionSparsity * self.n)
-    w = min(numNonZeros, maxSparsity)
+    w = min(counts.size, maxSparsity)
 
     # Return top w most popular positions
-    return  tuple(x[1] for x in counts.getNonZerosSorted())[:w]
+    return tuple(counts.topBits(w).tolist())
 
 
   def getUnionEncoding(self, text):
@@ -267,30 +321,37 @@ class CioEncoder(LanguageEncoder):
       print ("Although the encoder type is not set for words, the window "
         "encodings use word-level fingerprints.")
 
-    bitmaps = tuple(numpy.array(self._getWordBitmap(t)) for t in tokens)
+    fingerprints = self._fingerprints.getMany(tokens)
+    bitmaps = tuple(fingerprints[t] for t in tokens)
 
     windowBitmaps = []
-    for tokenIndex, windowBitmap in enumerate(bitmaps):
-      # Each index in the tokens list is the end of a possible window.
-      for i in reversed(xrange(tokenIndex)):
-        # From the current token, increase the window by successively adding the
-        # previous tokens.
-        windowSparsity = len(windowBitmap) / float(self.n)
+    window = WindowUnion(self.n)
+    for tokenIndex, bitmap in enumerate(bitmaps):
+      # Each index in the tokens list is the end of a possible window. The
+      # window grows by successively adding the previous tokens, until the
+      # union would exceed the maximum sparsity. Adding a token only grows the
+      # unions, so the start of the window never moves backward: the previous
+      # window is updated instead of rebuilt.
+      window.append(bitmap)
+      suffixSizes = window.suffixSizes()
+      start = tokenIndex
+      for i in reversed(xrange(window.start, tokenIndex)):
+        windowSparsity = suffixSizes[i + 1 - window.start] / float(self.n)
         nextSparsity = len(bitmaps[i]) / float(self.n)
         if windowSparsity + nextSparsity > self.unionSparsity:
           # stopping criterion reached -- window is full
           break
-        else:
-          # add bitmap to the current window bitmap
-          windowBitmap = numpy.union1d(windowBitmap, bitmaps[i])
+        start = i
+      while window.start < start:
+        window.popleft()
 
-      sparsity = len(windowBitmap) / float(self.n)
+      sparsity = window.size / float(self.n)
       if sparsity > minSparsity:
         # only include windows of sufficient density
         windowBitmaps.append(
-          {"text": tokens[i:tokenIndex+1],
+          {"text": tokens[start:tokenIndex+1],
            "sparsity": sparsity,
-           "bitmap": numpy.array(windowBitmap)})
+           "bitmap": window.union()})
 
     return windowBitmaps
 
@@ -328,7 +389,7 @@ class CioEncoder(LanguageEncoder):
     Return a bitmap for the word. If the Cortical.io API can't encode, cortipy
     will use a random encoding for the word.
     """
-    return self.client.getBitmap(term)["fingerprint"]["positions"]
+    return self._fingerprints.get(term)
 
 
   def encodeIntoArray(self, inputText, output):
@@ -0,0 +1,111 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+import zlib
+
+import numpy
+
+from cortipy.cortical_client import RETINA_SIZES
+from cortipy.exceptions import UnsuccessfulEncodingError
+
+
+
+class FakeCorticalClient(object):
+  """
+  Offline stand-in for cortipy's CorticalClient, e.g. for tests and
+  benchmarks: CioEncoder(client=FakeCorticalClient()).
+
+  The fingerprint of a term is a random bitmap seeded by the term, so it is
+  the same across runs. Text fingerprints are the most frequent positions of
+  the fingerprints of their words.
+  """
+
+  def __init__(self, apiKey=None, retina="en_synonymous", cacheDir=None,
+               sparsity=0.02):
+    """
+    @param retina     (str)     Name of the retina, for its dimensions.
+    @param sparsity   (float)   Sparsity of the fingerprints.
+    """
+    self.apiKey = apiKey
+    self.retina = retina
+    self.cacheDir = cacheDir
+    self.width = RETINA_SIZES[retina]["width"]
+    self.height = RETINA_SIZES[retina]["height"]
+    self.n = self.width * self.height
+    self.w = int(sparsity * self.n)
+    self.numQueries = 0
+
+
+  def _fingerprint(self, text, positions):
+    return {"text": text,
+            "term": text,
+            "df": 0.0,
+            "score": 0.0,
+            "pos_types": [],
+            "width": self.width,
+            "height": self.height,
+            "sparsity": len(positions) / float(self.n),
+            "fingerprint": {"positions": positions}}
+
+
+  def getBitmap(self, term):
+    self.numQueries += 1
+    seed = zlib.crc32(term.encode("utf-8")) & 0xffffffff
+    positions = numpy.random.RandomState(seed).choice(self.n, self.w,
+                                                      replace=False)
+    return self._fingerprint(term, sorted(positions.tolist()))
+
+
+  def tokenize(self, text):
+    return [",".join(text.lower().split())]
+
+
+  def getTextBitmap(self, text):
+    terms = text.lower().split()
+    if not terms:
+      raise UnsuccessfulEncodingError("No terms in '{}'".format(text))
+    positions = numpy.concatenate(
+      [self.getBitmap(t)["fingerprint"]["positions"] for t in terms])
+    counts = numpy.bincount(positions, minlength=self.n)
+    top = numpy.argsort(-counts, kind="mergesort")[:self.w]
+    return self._fingerprint(text, sorted(top[counts[top] > 0].tolist()))
+
+
+  def compare(self, bitmap1, bitmap2):
+    overlap = len(set(bitmap1) & set(bitmap2))
+    union = len(set(bitmap1) | set(bitmap2))
+    return {"overlappingAll": overlap,
+            "sizeLeft": len(bitmap1),
+            "sizeRight": len(bitmap2),
+            "jaccardDistance": 1.0 - overlap / float(max(union, 1)),
+            "cosineSimilarity": overlap / max(numpy.sqrt(
+              len(bitmap1) * len(bitmap2)), 1.0)}
+
+
+  def bitmapToTerms(self, bitmap, numTerms=10):
+    return []
+
+
+  def createClassification(self, label, positives, negatives=None):
+    positions = numpy.concatenate([numpy.asarray(p) for p in positives])
+    counts = numpy.bincount(positions.astype(int), minlength=self.n)
+    top = numpy.argsort(-counts, kind="mergesort")[:self.w]
+    return {"categoryName": label,
+            "positions": sorted(top[counts[top] > 0].tolist())}
@@ -0,0 +1,297 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+import collections
+import contextlib
+import fcntl
+import json
+import os
+
+import numpy
+
+
+POSITIONS_FILE = "positions.bin"
+OFFSETS_FILE = "offsets.bin"
+TERMS_FILE = "terms.txt"
+LOCK_FILE = "lock"
+POSITION_DTYPE = numpy.uint32
+OFFSET_DTYPE = numpy.int64
+
+
+
+class FingerprintStore(object):
+  """
+  Persistent store of term fingerprints (sorted bitmap positions), in three
+  files:
+  - positions.bin: the positions of all the fingerprints, concatenated.
+  - offsets.bin: the end offset of each fingerprint in positions.bin.
+  - terms.txt: the terms, one JSON string per line, in fingerprint order.
+
+  The positions are read through a memory map. New fingerprints are appended
+  to the files under an exclusive lock of the store, so several processes can
+  share a store.
+  """
+
+  def __init__(self, path):
+    """
+    @param path     (str)     Directory of the store, created if needed.
+    """
+    self.path = path
+    if not os.path.exists(path):
+      os.makedirs(path)
+    with self._lock():
+      self._load()
+
+
+  def __len__(self):
+    return len(self._rows)
+
+
+  def __contains__(self, term):
+    return term in self._rows
+
+
+  def __getstate__(self):
+    # The store is read again when unpickled, see FingerprintCache for stores
+    # that may not exist there.
+    return {"path": self.path}
+
+
+  def __setstate__(self, state):
+    self.__init__(state["path"])
+
+
+  def get(self, term):
+    """
+    @param term     (str)     Term to look up.
+    @return         (numpy.array) Sorted positions of the term fingerprint, or
+                              None if the term is not in the store.
+    """
+    row = self._rows.get(term)
+    if row is None:
+      return None
+    end = self._offsets[row + 1]
+    if self._positions is None or len(self._positions) < end:
+      self._positions = self._mapPositions()
+    return numpy.array(self._positions[self._offsets[row]:end])
+
+
+  def addMany(self, fingerprints):
+    """
+    Append fingerprints to the store.
+
+    @param fingerprints (dict) Bitmap positions, keyed by term.
+    """
+    with self._lock():
+      # Other processes may have appended fingerprints since the store was
+      # read, or have been interrupted while appending.
+      if (self._getTermsSize() != self._termsSize or
+          self._getNumPositions() != self._offsets[-1]):
+        self._load()
+
+      newTerms = [t for t in fingerprints if t not in self._rows]
+      if not newTerms:
+        return
+      positions = [numpy.sort(numpy.asarray(fingerprints[t],
+                                            dtype=POSITION_DTYPE))
+                   for t in newTerms]
+      offsets = self._offsets[-1] + numpy.cumsum(
+        [len(p) for p in positions]).astype(OFFSET_DTYPE)
+
+      # Positions are written first: a term is only in the store once its
+      # offset and its line in terms.txt are written.
+      with open(os.path.join(self.path, POSITIONS_FILE), "ab") as f:
+        numpy.concatenate(positions).astype(POSITION_DTYPE).tofile(f)
+      with open(os.path.join(self.path, OFFSETS_FILE), "ab") as f:
+        offsets.tofile(f)
+      with open(os.path.join(self.path, TERMS_FILE), "a") as f:
+        f.write("".join(json.dumps(t) + "\n" for t in newTerms))
+      self._termsSize = self._getTermsSize()
+
+    numTerms = len(self._rows)
+    for i, term in enumerate(newTerms):
+      self._rows[term] = numTerms + i
+    self._offsets = numpy.concatenate((self._offsets, offsets))
+
+
+  @contextlib.contextmanager
+  def _lock(self):
+    """Hold the exclusive lock of the store, across processes."""
+    with open(os.path.join(self.path, LOCK_FILE), "a") as f:
+      fcntl.flock(f, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+  def _load(self):
+    """Read the terms and offsets of the store, with the lock held."""
+    termsPath = os.path.join(self.path, TERMS_FILE)
+    terms = []
+    if os.path.exists(termsPath):
+      with open(termsPath, "r") as f:
+        terms = [json.loads(line) for line in f if line.endswith("\n")]
+    offsetsPath = os.path.join(self.path, OFFSETS_FILE)
+    if os.path.exists(offsetsPath):
+      offsets = numpy.fromfile(offsetsPath, dtype=OFFSET_DTYPE)
+    else:
+      offsets = numpy.zeros(0, dtype=OFFSET_DTYPE)
+
+    # Only keep the fingerprints that were completely written.
+    numTerms = min(len(terms), len(offsets))
+    self._rows = {term: i for i, term in enumerate(terms[:numTerms])}
+    self._offsets = numpy.zeros(numTerms + 1, dtype=OFFSET_DTYPE)
+    self._offsets[1:] = offsets[:numTerms]
+    if (numTerms < len(terms) or numTerms < len(offsets) or
+        self._getNumPositions() != self._offsets[-1]):
+      self._truncate(terms[:numTerms])
+    self._termsSize = self._getTermsSize()
+    self._positions = None
+
+
+  def _getTermsSize(self):
+    termsPath = os.path.join(self.path, TERMS_FILE)
+    return os.path.getsize(termsPath) if os.path.exists(termsPath) else 0
+
+
+  def _getNumPositions(self):
+    positionsPath = os.path.join(self.path, POSITIONS_FILE)
+    if not os.path.exists(positionsPath):
+      return 0
+    return (os.path.getsize(positionsPath) //
+            numpy.dtype(POSITION_DTYPE).itemsize)
+
+
+  def _mapPositions(self):
+    numPositions = self._offsets[-1]
+    if numPositions == 0:
+      return numpy.zeros(0, dtype=POSITION_DTYPE)
+    return numpy.memmap(os.path.join(self.path, POSITIONS_FILE),
+                        dtype=POSITION_DTYPE, mode="r",
+                        shape=(numPositions,))
+
+
+  def _truncate(self, terms):
+    """Drop the fingerprints of an interrupted write."""
+    with open(os.path.join(self.path, TERMS_FILE), "w") as f:
+      f.write("".join(json.dumps(t) + "\n" for t in terms))
+    with open(os.path.join(self.path, OFFSETS_FILE), "wb") as f:
+      self._offsets[1:].tofile(f)
+    with open(os.path.join(self.path, POSITIONS_FILE), "ab") as f:
+      f.truncate(self._offsets[-1] * numpy.dtype(POSITION_DTYPE).itemsize)
+
+
+
+class FingerprintCache(object):
+  """
+  Term fingerprints from a Cortical.io client, looked up in an in-process LRU
+  cache, then in an optional FingerprintStore, and only then queried from the
+  client.
+  """
+
+  def __init__(self, client, storePath=None, maxSize=100000):
+    """
+    @param client     (CorticalClient) Client queried for unknown terms; any
+                                  object with a getBitmap(term) method.
+    @param storePath  (str)       Optional FingerprintStore directory.
+    @param maxSize    (int)       Max number of fingerprints in the LRU cache.
+    """
+    self.client = client
+    self.maxSize = maxSize
+    self.store = None
+    self.storePath = None
+    if storePath:
+      self.openStore(storePath)
+    self._lru = collections.OrderedDict()
+
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state["_lru"] = collections.OrderedDict()
+    state["store"] = None
+    return state
+
+
+  def __setstate__(self, state):
+    if "storePath" not in state:
+      # Caches pickled with their store.
+      store = state.get("store")
+      state["storePath"] = store.path if store is not None else None
+    self.__dict__.update(state)
+    # The store may have been pickled on another machine: it is only reopened
+    # if its directory exists here.
+    self.store = None
+    if self.storePath and os.path.isdir(self.storePath):
+      self.store = FingerprintStore(self.storePath)
+
+
+  def openStore(self, storePath):
+    """
+    Use the FingerprintStore in the given directory, created if needed.
+    """
+    self.store = FingerprintStore(storePath)
+    self.storePath = storePath
+
+
+  def get(self, term):
+    """
+    @param term     (str)     Term to look up.
+    @return         (numpy.array) Sorted positions of the term fingerprint.
+    """
+    return self.getMany([term])[term]
+
+
+  def getMany(self, terms):
+    """
+    Look up several terms. Each distinct term is only looked up once, and the
+    terms missing from the cache and the store are added to the store in one
+    write.
+
+    @param terms    (iterable) Terms to look up.
+    @return         (dict)    Sorted positions of the fingerprints, keyed by
+                              term.
+    """
+    fingerprints = {}
+    missing = {}
+    for term in terms:
+      if term in fingerprints or term in missing:
+        continue
+      positions = self._lru.pop(term, None)
+      if positions is None and self.store is not None:
+        positions = self.store.get(term)
+      if positions is None:
+        positions = numpy.sort(numpy.asarray(
+          self.client.getBitmap(term)["fingerprint"]["positions"],
+          dtype=POSITION_DTYPE))
+        missing[term] = positions
+      fingerprints[term] = positions
+      self._lru[term] = positions
+
+    if missing and self.store is not None:
+      self.store.addMany(missing)
+    while len(self._lru) > self.maxSize:
+      self._lru.popitem(last=False)
+    return fingerprints
+
+
+  def clear(self):
+    """Clear the LRU cache. The store is not modified."""
+    self._lru.clear()
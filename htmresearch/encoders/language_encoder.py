@@ -19,7 +19,6 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
-import math
 import numpy
 import random
 
@@ -30,6 +29,54 @@ from nupic.encoders.utils import bitsToString
 DEFAULT_N = 16384
 DEFAULT_W = 328
 
+# Similarity measures returned by compare(), in the column order of the
+# compareMany() matrix.
+COMPARE_METRICS = (
+  "sizeLeft",
+  "sizeRight",
+  "overlappingAll",
+  "euclideanDistance",
+  "overlappingLeftRight",
+  "overlappingRightLeft",
+  "cosineSimilarity",
+  "jaccardDistance",
+)
+
+
+
+def _sortedBitmap(bitmap):
+  """Return the bitmap as a sorted array of unique positions."""
+  bitmap = numpy.asarray(bitmap, dtype=numpy.int64)
+  if len(bitmap) > 1 and not (bitmap[1:] > bitmap[:-1]).all():
+    bitmap = numpy.unique(bitmap)
+  return bitmap
+
+
+
+def _similarityMeasures(sizeLeft, sizeRight, overlap, numUnique1=None,
+                        numUnique2=None):
+  """
+  Compute the compare() measures from the sizes of the bitmaps and their
+  overlap. Works on scalars as well as on numpy arrays.
+
+  @param numUnique1/2 (int)  Number of distinct positions of the bitmaps, if
+                             it differs from their size.
+  """
+  numUnique1 = sizeLeft if numUnique1 is None else numUnique1
+  numUnique2 = sizeRight if numUnique2 is None else numUnique2
+  return {
+    "sizeLeft": sizeLeft,
+    "sizeRight": sizeRight,
+    "overlappingAll": overlap,
+    # The SDRs are binary: the squared distance counts the differing bits.
+    "euclideanDistance": numpy.sqrt(numUnique1 + numUnique2 - 2 * overlap),
+    "overlappingLeftRight": overlap / sizeLeft,
+    "overlappingRightLeft": overlap / sizeRight,
+    "cosineSimilarity": overlap / (numpy.sqrt(sizeLeft) *
+                                   numpy.sqrt(sizeRight)),
+    "jaccardDistance": 1 - (overlap / (numUnique1 + numUnique2 - overlap)),
+  }
+
 
 
 class LanguageEncoder(object):
@@ -117,13 +164,13 @@ class LanguageEncoder(object):
   def bitmapToSDR(self, bitmap):
     """Convert SDR encoding from bitmap to binary numpy array."""
     sdr = numpy.zeros(self.n)
-    sdr[bitmap] = 1
+    sdr[numpy.asarray(bitmap, dtype=numpy.int64)] = 1
     return sdr
 
 
   def bitmapFromSDR(self, sdr):
     """Convert SDR encoding from binary numpy array to bitmap."""
-    return numpy.array([i for i in range(len(sdr)) if sdr[i]==1])
+    return numpy.flatnonzero(numpy.asarray(sdr) == 1)
 
 
   def encodeRandomly(self, text, w, n):
@@ -155,26 +202,54 @@ class LanguageEncoder(object):
     if not len(bitmap1) > 0 or not len(bitmap2) > 0:
       raise ValueError("Bitmaps must have ON bits to compare.")
 
-    sdr1 = self.bitmapToSDR(bitmap1)
-    sdr2 = self.bitmapToSDR(bitmap2)
+    # All the measures follow from the overlap of the sorted bitmaps.
+    sorted1 = _sortedBitmap(bitmap1)
+    sorted2 = _sortedBitmap(bitmap2)
+    matches = numpy.searchsorted(sorted2, sorted1)
+    matches[matches == len(sorted2)] = 0
+    overlap = float(numpy.count_nonzero(sorted2[matches] == sorted1))
+
+    distances = _similarityMeasures(float(len(bitmap1)),
+                                    float(len(bitmap2)),
+                                    overlap,
+                                    len(sorted1),
+                                    len(sorted2))
+    return {name: float(value) for name, value in distances.iteritems()}
 
-    distances = {
-      "sizeLeft": float(len(bitmap1)),
-      "sizeRight": float(len(bitmap2)),
-      "overlappingAll": float(len(numpy.intersect1d(bitmap1, bitmap2))),
-      "euclideanDistance": numpy.linalg.norm(sdr1 - sdr2)
-    }
 
-    distances["overlappingLeftRight"] = (distances["overlappingAll"] /
-                                         distances["sizeLeft"])
-    distances["overlappingRightLeft"] = (distances["overlappingAll"] /
-                                         distances["sizeRight"])
-    distances["cosineSimilarity"] = (distances["overlappingAll"] /
-        (math.sqrt(distances["sizeLeft"]) * math.sqrt(distances["sizeRight"])))
-    distances["jaccardDistance"] = 1 - (distances["overlappingAll"] /
-        len(numpy.union1d(bitmap1, bitmap2)))
+  def compareMany(self, bitmap, bitmaps):
+    """
+    Compare a bitmap to several bitmaps at once.
+
+    @param bitmap      (list)        Indices of ON bits.
+    @param bitmaps     (list)        Bitmaps to compare to, each a list of
+                                     indices of ON bits without duplicates.
+    @return            (numpy.array) Similarity measures of compare(), with one
+                                     row per bitmap of bitmaps and one column
+                                     per measure, in COMPARE_METRICS order.
+    """
+    sizes = numpy.array([len(b) for b in bitmaps], dtype=numpy.float64)
+    if not len(bitmap) > 0 or not (sizes > 0).all():
+      raise ValueError("Bitmaps must have ON bits to compare.")
 
-    return distances
+    sortedBitmap = _sortedBitmap(bitmap)
+    mask = numpy.zeros(self.n, dtype=bool)
+    mask[sortedBitmap] = True
+    positions = numpy.concatenate(
+      [numpy.asarray(b, dtype=numpy.int64) for b in bitmaps])
+    hits = numpy.zeros(len(positions) + 1, dtype=numpy.int64)
+    hits[1:] = numpy.cumsum(mask[positions])
+    ends = numpy.cumsum(sizes).astype(numpy.int64)
+    overlaps = (hits[ends] - hits[ends - sizes.astype(numpy.int64)]).astype(
+      numpy.float64)
+
+    distances = _similarityMeasures(float(len(bitmap)),
+                                    sizes,
+                                    overlaps,
+                                    len(sortedBitmap))
+    return numpy.column_stack(
+      [numpy.broadcast_to(distances[name], overlaps.shape)
+       for name in COMPARE_METRICS])
 
 
   @staticmethod
@@ -187,8 +262,11 @@ class LanguageEncoder(object):
                                   size (n) by.
     @return             (list)    Scaled down bitmap of the encoding.
     """
-    scaledBitmap = [int(i * float(scaleFactor)) for i in encoding]
-    return sorted(set(scaledBitmap), key=lambda x: scaledBitmap.index(x))
+    scaledBitmap = (numpy.asarray(encoding, dtype=numpy.float64) *
+                    float(scaleFactor)).astype(numpy.int64)
+    # Keep the first occurrence of each position, in the encoding order.
+    _, firstIndices = numpy.unique(scaledBitmap, return_index=True)
+    return scaledBitmap[numpy.sort(firstIndices)].tolist()
 
 
   def pprintHeader(self, prefix=""):
@@ -0,0 +1,124 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+import collections
+import random
+
+import numpy
+
+
+
+class WindowUnion(object):
+  """
+  Union of the bitmaps of a sliding window of tokens, updated incrementally:
+  bitmaps are appended at the end of the window and evicted from its start.
+
+  Each bit keeps a reference count (the number of bitmaps of the window it is
+  in) and the index of the last bitmap it is in. The reference counts give
+  the union and the most frequent bits of the window; the last indices give
+  the size of the union of every suffix of the window.
+  """
+
+  def __init__(self, n):
+    """
+    @param n        (int)     Number of bits of the bitmaps.
+    """
+    self.n = n
+    self.counts = numpy.zeros(n, dtype=numpy.int32)
+    self.lastIndices = numpy.full(n, -1, dtype=numpy.int64)
+    self.start = 0
+    self.end = 0
+    self.size = 0
+    self._bitmaps = collections.deque()
+    # Number of bits whose last bitmap is each bitmap of the window, keyed by
+    # bitmap index.
+    self._numLastBits = {}
+
+
+  def __len__(self):
+    return self.end - self.start
+
+
+  def append(self, bitmap):
+    """
+    Add a bitmap at the end of the window.
+
+    @param bitmap   (sequence) Positions of the active bits, without
+                              duplicates.
+    """
+    bitmap = numpy.asarray(bitmap, dtype=numpy.int64)
+    self.counts[bitmap] += 1
+    self.size += int(numpy.count_nonzero(self.counts[bitmap] == 1))
+
+    previous = self.lastIndices[bitmap]
+    previous, numMoved = numpy.unique(previous[previous >= self.start],
+                                      return_counts=True)
+    for i, num in zip(previous.tolist(), numMoved.tolist()):
+      self._numLastBits[i] -= num
+    self.lastIndices[bitmap] = self.end
+
+    self._bitmaps.append(bitmap)
+    self._numLastBits[self.end] = len(bitmap)
+    self.end += 1
+
+
+  def popleft(self):
+    """Evict the bitmap at the start of the window."""
+    bitmap = self._bitmaps.popleft()
+    del self._numLastBits[self.start]
+    self.counts[bitmap] -= 1
+    self.size -= int(numpy.count_nonzero(self.counts[bitmap] == 0))
+    self.start += 1
+
+
+  def suffixSizes(self):
+    """
+    @return         (list)    Size of the union of the bitmaps from each index
+                              of the window to its end, e.g. the first
+                              element is the size of the whole union.
+    """
+    numLastBits = [self._numLastBits[i]
+                   for i in xrange(self.end - 1, self.start - 1, -1)]
+    return numpy.cumsum(numLastBits)[::-1].tolist()
+
+
+  def union(self):
+    """
+    @return         (numpy.array) Sorted positions of the union of the window.
+    """
+    return numpy.flatnonzero(self.counts)
+
+
+  def topBits(self, w):
+    """
+    The w bits that are in the most bitmaps of the window, with random
+    tie-breaking.
+
+    @param w        (int)     Max number of bits.
+    @return         (numpy.array) Positions of the bits, most frequent first.
+    """
+    positions = numpy.flatnonzero(self.counts)
+    # Add some jitter to aid in tie-breaking during sort
+    jitterValues = numpy.array([(random.random() / 100) + 0.1
+                                for _ in xrange(len(positions))],
+                               dtype=numpy.float32)
+    values = self.counts[positions].astype(numpy.float32) + jitterValues
+    order = numpy.argsort(-values, kind="mergesort")
+    return positions[order[:w]]
@@ -19,7 +19,14 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
+import multiprocessing
+
 import numpy as np
+from scipy import sparse
+
+# Upper bound on the number of chunk-to-chunk distances held in memory at once
+# by pairwise_sequence_distances(), when block_size is not given.
+MAX_BLOCK_DISTANCES = 2 ** 24
 
 
 
@@ -99,6 +106,267 @@ def distance_matrix(sp_sequence_embeddings,
 
 
 
+def chunk_matrix(sequence_embeddings, nb_chunks):
+  """
+  Stack the chunk embeddings of all the sequences in a 2D matrix.
+
+  :param sequence_embeddings: either a 3D array of shape
+    (nb_sequences, nb_chunks, width), or a 2D array or scipy sparse matrix of
+    flattened sequence embeddings of shape (nb_sequences, nb_chunks * width).
+  :param nb_chunks: (int) number of chunks (i.e. embeddings) per sequence.
+  :return: (np.array or CSR matrix) float64 matrix of shape
+    (nb_sequences * nb_chunks, width). Sparse input stays sparse.
+  """
+  if sparse.issparse(sequence_embeddings):
+    coo = sequence_embeddings.tocoo()
+    nb_sequences, flat_width = coo.shape
+    width = flat_width / nb_chunks
+    rows = coo.row * nb_chunks + coo.col / width
+    cols = coo.col % width
+    return sparse.csr_matrix((coo.data.astype(np.float64), (rows, cols)),
+                             shape=(nb_sequences * nb_chunks, width))
+
+  sequence_embeddings = np.asarray(sequence_embeddings)
+  if sequence_embeddings.ndim == 3:
+    width = sequence_embeddings.shape[2]
+  else:
+    width = sequence_embeddings.shape[1] / nb_chunks
+  return sequence_embeddings.reshape((-1, width)).astype(np.float64)
+
+
+
+def squared_norms(x):
+  """
+  Squared L2 norm of each row of a 2D array or scipy sparse matrix.
+  """
+  if sparse.issparse(x):
+    return np.asarray(x.multiply(x).sum(axis=1)).ravel()
+  return np.einsum('ij,ij->i', x, x)
+
+
+
+def euclidian_distances(x1, x2, x1_squared_norms=None, x2_squared_norms=None):
+  """
+  All the pair-wise euclidian distances between the rows of x1 and x2,
+  computed with a matrix product: ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b
+
+  :param x1: (np.array or scipy sparse matrix) shape (n1, width)
+  :param x2: (np.array or scipy sparse matrix) shape (n2, width)
+  :param x1_squared_norms: (np.array) pre-computed squared norms of x1 rows
+  :param x2_squared_norms: (np.array) pre-computed squared norms of x2 rows
+  :return: (np.array) distances, shape (n1, n2)
+  """
+  if x1_squared_norms is None:
+    x1_squared_norms = squared_norms(x1)
+  if x2_squared_norms is None:
+    x2_squared_norms = squared_norms(x2)
+
+  products = x1.dot(x2.T)
+  if sparse.issparse(products):
+    products = products.toarray()
+  dists = x1_squared_norms[:, np.newaxis] + x2_squared_norms - 2 * products
+  # Rounding errors can make the squared distances slightly negative.
+  np.maximum(dists, 0, out=dists)
+  return np.sqrt(dists, out=dists)
+
+
+
+class _SequenceDistanceTask(object):
+  """
+  Distances between the sequences of several (x1, x2) chunk matrix pairs, for
+  a block of x1 sequences. The chunk matrices are set once per worker process
+  by _init_worker() so that they are not sent with each block.
+  """
+  pairs = None
+
+
+  def __init__(self, nb_chunks, assume_sequence_alignment):
+    self.nb_chunks = nb_chunks
+    self.assume_sequence_alignment = assume_sequence_alignment
+
+
+  def __call__(self, block):
+    start, end = block
+    c = self.nb_chunks
+    results = []
+    for x1, x2, x1_norms, x2_norms in _SequenceDistanceTask.pairs:
+      nb_sequences_2 = x2.shape[0] / c
+      if self.assume_sequence_alignment:
+        dists = np.zeros((end - start, nb_sequences_2))
+        for k in range(c):
+          rows_1 = np.arange(start, end) * c + k
+          rows_2 = np.arange(nb_sequences_2) * c + k
+          dists += euclidian_distances(x1[rows_1], x2[rows_2],
+                                       x1_norms[rows_1], x2_norms[rows_2])
+        dists /= c
+      else:
+        rows_1 = slice(start * c, end * c)
+        chunk_dists = euclidian_distances(x1[rows_1], x2,
+                                          x1_norms[rows_1], x2_norms)
+        chunk_dists = chunk_dists.reshape((end - start, c, nb_sequences_2, c))
+        dists = chunk_dists.min(axis=3).mean(axis=1)
+      results.append(dists)
+    return results
+
+
+
+def _init_worker(pairs):
+  _SequenceDistanceTask.pairs = pairs
+
+
+
+def pairwise_sequence_distances(embedding_pairs, nb_chunks,
+                                assume_sequence_alignment, block_size=None,
+                                n_jobs=1):
+  """
+  Compute sequence distance matrices (see sequence_distance()) for one or
+  more pairs of sequence embedding sets, in a single pass over blocks of rows.
+
+  :param embedding_pairs: (list) pairs (sequence_embeddings_1,
+    sequence_embeddings_2) of sequence embeddings. See chunk_matrix() for the
+    accepted formats. Dense and sparse (e.g. binary) embeddings are accepted.
+    All the first embeddings must have the same number of sequences, same
+    for the second embeddings.
+  :param nb_chunks: (int) number of chunks (i.e. embeddings) per sequence.
+  :param assume_sequence_alignment: (bool) whether to compare chunks with the
+    same index only.
+  :param block_size: (int) number of rows computed at once. Defaults to a
+    value that keeps about MAX_BLOCK_DISTANCES chunk distances in memory.
+  :param n_jobs: (int) number of worker processes. Blocks of rows are spread
+    across the workers.
+  :return: (list of np.array) one distance matrix per pair, of shape
+    (nb_sequences_1, nb_sequences_2).
+  """
+  pairs = []
+  for sequence_embeddings_1, sequence_embeddings_2 in embedding_pairs:
+    x1 = chunk_matrix(sequence_embeddings_1, nb_chunks)
+    if sequence_embeddings_2 is sequence_embeddings_1:
+      x2 = x1
+    else:
+      x2 = chunk_matrix(sequence_embeddings_2, nb_chunks)
+    x1_norms = squared_norms(x1)
+    x2_norms = x1_norms if x2 is x1 else squared_norms(x2)
+    pairs.append((x1, x2, x1_norms, x2_norms))
+
+  nb_sequences_1 = pairs[0][0].shape[0] / nb_chunks
+  nb_sequences_2 = pairs[0][1].shape[0] / nb_chunks
+  if block_size is None:
+    distances_per_row = max(1, nb_chunks * nb_chunks * nb_sequences_2)
+    block_size = max(1, MAX_BLOCK_DISTANCES / distances_per_row)
+  blocks = [(start, min(start + block_size, nb_sequences_1))
+            for start in range(0, nb_sequences_1, block_size)]
+
+  task = _SequenceDistanceTask(nb_chunks, assume_sequence_alignment)
+  if n_jobs > 1 and len(blocks) > 1:
+    pool = multiprocessing.Pool(n_jobs, initializer=_init_worker,
+                                initargs=(pairs,))
+    try:
+      block_results = pool.map(task, blocks)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    _init_worker(pairs)
+    block_results = [task(block) for block in blocks]
+  _init_worker(None)
+
+  if len(blocks) == 0:
+    return [np.zeros((0, nb_sequences_2)) for _ in pairs]
+  return [np.vstack([results[i] for results in block_results])
+          for i in range(len(pairs))]
+
+
+
+def sequence_distance_matrices(sp_sequence_embeddings, tm_sequence_embeddings,
+                               nb_chunks, assume_sequence_alignment,
+                               sp_w=1.0, tm_w=1.0, block_size=None, n_jobs=1):
+  """
+  Vectorized equivalent of distance_matrix() with sequence_distance(): the
+  SP and TM sequence distance matrices are computed in the same pass with
+  pairwise_sequence_distances().
+
+  :return: (col_mat, cell_mat, combined_mat) like distance_matrix()
+  """
+  if sp_sequence_embeddings.shape[0] != tm_sequence_embeddings.shape[0]:
+    raise ValueError('The number of SP sequence embeddings (%s) is '
+                     'different from the number of TM sequence embeddings (%s)'
+                     % (sp_sequence_embeddings.shape[0],
+                        tm_sequence_embeddings.shape[0]))
+
+  col_mat, cell_mat = pairwise_sequence_distances(
+    [(sp_sequence_embeddings, sp_sequence_embeddings),
+     (tm_sequence_embeddings, tm_sequence_embeddings)],
+    nb_chunks, assume_sequence_alignment, block_size=block_size,
+    n_jobs=n_jobs)
+
+  col_mat = symmetrize(col_mat)
+  cell_mat = symmetrize(cell_mat)
+  combined_mat = (tm_w * col_mat + sp_w * cell_mat) / (tm_w + sp_w)
+  return col_mat, cell_mat, combined_mat
+
+
+
+def symmetrize(mat):
+  """
+  Make a square distance matrix symmetric like distance_matrix() does: use
+  d(i, j) with i <= j for both halves, and zero distances on the diagonal.
+
+  :param mat: (np.array) square matrix of directed distances d(i, j)
+  :return: (np.array) symmetric copy of the matrix
+  """
+  mat = np.triu(mat, 1)
+  return mat + mat.T
+
+
+
+# Number of active bits in each byte value.
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)],
+                           dtype='uint8')
+
+
+
+def pack_sdrs(sdrs, block_size=1024):
+  """
+  Pack binary SDRs (or binary embeddings) in bits, 8 bits per byte. Non-zero
+  values are considered active.
+
+  :param sdrs: (np.array or scipy sparse matrix) SDRs, shape (n, width)
+  :param block_size: (int) number of sparse SDRs densified at once
+  :return packed: (np.array) uint8 array of shape (n, ceil(width / 8))
+  :return nb_active: (np.array) number of active bits of each SDR
+  """
+  if not sparse.issparse(sdrs):
+    sdrs = np.asarray(sdrs) != 0
+    return np.packbits(sdrs, axis=1), sdrs.sum(axis=1)
+
+  sdrs = sdrs.tocsr()
+  packed = [np.packbits(sdrs[start:start + block_size].toarray() != 0, axis=1)
+            for start in range(0, sdrs.shape[0], block_size)]
+  packed = np.vstack(packed)
+  return packed, _POPCOUNT_TABLE[packed].sum(axis=1)
+
+
+
+def percent_overlap_distances(packed_1, nb_active_1, packed_2, nb_active_2):
+  """
+  All the pair-wise percent overlap distances (see percent_overlap_distance())
+  between two sets of packed SDRs (see pack_sdrs()). Overlaps are computed
+  with a popcount of the bitwise AND of the packed bits.
+
+  :return: (np.array) distances, shape (len(packed_1), len(packed_2))
+  """
+  overlaps = np.zeros((len(packed_1), len(packed_2)), dtype=np.float64)
+  for i in range(len(packed_1)):
+    overlaps[i] = _POPCOUNT_TABLE[np.bitwise_and(packed_2, packed_1[i])].sum(
+      axis=1, dtype='int64')
+
+  norms = np.sqrt(np.outer(nb_active_1, nb_active_2).astype(np.float64))
+  pct_overlaps = np.zeros_like(overlaps)
+  np.divide(overlaps, norms, out=pct_overlaps, where=norms > 0)
+  return 1 - pct_overlaps
+
+
+
 def euclidian_distance(x1, x2):
   return np.linalg.norm(np.array(x1) - np.array(x2))
 
@@ -113,21 +381,27 @@ def percent_overlap(x1, x2):
   """
   Computes the percentage of overlap between SDR 1 and 2
 
-  :param x1: (np.array) binary vector 1
-  :param x2: (np.array) binary vector 2
+  :param x1: (np.array or scipy sparse matrix) binary vector 1
+  :param x2: (np.array or scipy sparse matrix) binary vector 2
 
   :return pct_overlap: (float) percentage overlap between SDR 1 and 2
   """
   if type(x1) is np.ndarray and type(x2) is np.ndarray:
     non_zero_1 = float(np.count_nonzero(x1))
     non_zero_2 = float(np.count_nonzero(x2))
-    min_non_zero = min(non_zero_1, non_zero_2)
-    pct_overlap = 0
-    if min_non_zero > 0:
-      pct_overlap = float(np.dot(x1, x2)) / np.sqrt(non_zero_1 * non_zero_2)
+    overlap = float(np.dot(x1, x2))
+  elif sparse.issparse(x1) and sparse.issparse(x2):
+    non_zero_1 = float(x1.count_nonzero())
+    non_zero_2 = float(x2.count_nonzero())
+    overlap = float(x1.multiply(x2).sum())
   else:
-    raise ValueError("x1 and x2 need to be binary numpy array but are: "
-                     "%s" % type(x1))
+    raise ValueError("x1 and x2 need to be binary numpy array or scipy sparse "
+                     "matrix but are: %s" % type(x1))
+
+  min_non_zero = min(non_zero_1, non_zero_2)
+  pct_overlap = 0
+  if min_non_zero > 0:
+    pct_overlap = overlap / np.sqrt(non_zero_1 * non_zero_2)
 
   return pct_overlap
 
@@ -22,6 +22,9 @@
 import json
 import numpy as np
 import pandas as pd
+from scipy import sparse
+
+from htmresearch.frameworks.capybara.sdr import iter_sdrs
 
 
 
@@ -60,21 +63,250 @@ def make_embeddings(sdrs_sequence, aggregation, nb_chunks):
 
 
 
-def convert_to_embeddings(sdr_sequences, aggregation, nb_chunks):
-  sp_embeddings = []
-  for sdr_sequence in sdr_sequences.spActiveColumns.values:
-    sp_embeddings.append(make_embeddings(sdr_sequence, aggregation, nb_chunks))
-  sp_embeddings = np.array(sp_embeddings)
+def chunk_counts(sdr_sequences, nb_chunks, keep_tail=False, batch_size=100):
+  """
+  Count how many times each bit is active in each chunk of each sequence.
+
+  A sequence of length L is split in nb_chunks chunks of L / nb_chunks SDRs,
+  like make_embeddings(). The last L % nb_chunks SDRs are dropped, unless
+  keep_tail is True, in which case they are added to the last chunk.
+
+  Dense sequences of the same length are stacked and reduced together
+  through a (sequences, chunks, chunk_len, width) view. Sparse sequences are
+  reduced with one sparse product per batch of sequences.
+
+  :param sdr_sequences: (list) sequences of SDRs, either dense arrays of
+    shape (sequence_length, width) or scipy sparse matrices of the same shape
+    (see sdr.load_sdrs())
+  :param nb_chunks: (int) how many chunks in each SDRs sequence
+  :param keep_tail: (bool) whether to add the remaining SDRs to the last chunk
+  :param batch_size: (int) number of sequences reduced at once
+  :return counts: (np.array) shape (nb_sequences, nb_chunks, width) for
+    dense sequences, or (CSR matrix) shape (nb_sequences * nb_chunks, width)
+    for sparse sequences.
+  :return chunk_sizes: (np.array) number of SDRs in each chunk, shape
+    (nb_sequences, nb_chunks)
+  """
+  nb_sequences = len(sdr_sequences)
+  lengths = np.array([sdr_sequence.shape[0] for sdr_sequence in sdr_sequences],
+                     dtype='int64')
+  if nb_sequences > 0 and lengths.min() < nb_chunks:
+    raise ValueError('A sequence has fewer SDRs (%s) than chunks (%s).'
+                     % (lengths.min(), nb_chunks))
+  chunk_lengths = lengths / nb_chunks
+  chunk_sizes = np.repeat(chunk_lengths[:, np.newaxis], nb_chunks, axis=1)
+  if keep_tail:
+    chunk_sizes[:, -1] += lengths - chunk_lengths * nb_chunks
+
+  is_sparse = nb_sequences > 0 and sparse.issparse(sdr_sequences[0])
+  width = sdr_sequences[0].shape[1] if nb_sequences > 0 else 0
+
+  count_batches = []
+  for start in range(0, nb_sequences, batch_size):
+    batch = range(start, min(start + batch_size, nb_sequences))
+    if is_sparse:
+      count_batches.append(_sparse_chunk_counts(
+        [sdr_sequences[i] for i in batch], chunk_lengths[batch], nb_chunks,
+        keep_tail))
+    else:
+      count_batches.append(_dense_chunk_counts(
+        [sdr_sequences[i] for i in batch], lengths[batch], nb_chunks,
+        keep_tail))
+
+  if is_sparse:
+    counts = sparse.vstack(count_batches).tocsr()
+  elif count_batches:
+    counts = np.concatenate(count_batches)
+  else:
+    counts = np.zeros((0, nb_chunks, width))
+  return counts, chunk_sizes
+
+
+
+def _dense_chunk_counts(sdr_sequences, lengths, nb_chunks, keep_tail):
+  counts = np.zeros((len(sdr_sequences), nb_chunks,
+                     sdr_sequences[0].shape[1]))
+  for length in np.unique(lengths):
+    idx = np.where(lengths == length)[0]
+    stacked = np.array([sdr_sequences[i] for i in idx])
+    chunk_length = length / nb_chunks
+    head = stacked[:, :chunk_length * nb_chunks]
+    counts[idx] = head.reshape((len(idx), nb_chunks, chunk_length, -1)).sum(
+      axis=2)
+    if keep_tail:
+      counts[idx, -1] += stacked[:, chunk_length * nb_chunks:].sum(axis=1)
+  return counts
+
 
-  tm_embeddings = []
-  for sdr_sequence in sdr_sequences.tmPredictedActiveCells.values:
-    tm_embeddings.append(make_embeddings(sdr_sequence, aggregation, nb_chunks))
-  tm_embeddings = np.array(tm_embeddings)
 
+def _sparse_chunk_counts(sdr_sequences, chunk_lengths, nb_chunks, keep_tail):
+  # Map each SDR of the batch to a row (sequence, chunk) of the counts.
+  rows = []
+  cols = []
+  offset = 0
+  for i, sdr_sequence in enumerate(sdr_sequences):
+    length = sdr_sequence.shape[0]
+    if keep_tail:
+      steps = np.arange(length)
+    else:
+      steps = np.arange(chunk_lengths[i] * nb_chunks)
+    chunk_ids = np.minimum(steps / chunk_lengths[i], nb_chunks - 1)
+    rows.append(i * nb_chunks + chunk_ids)
+    cols.append(offset + steps)
+    offset += length
+  rows = np.concatenate(rows)
+  chunk_selector = sparse.csr_matrix(
+    (np.ones(len(rows)), (rows, np.concatenate(cols))),
+    shape=(len(sdr_sequences) * nb_chunks, offset))
+  return chunk_selector.dot(sparse.vstack(sdr_sequences).tocsr()).tocsr()
+
+
+
+def aggregate_counts(counts, chunk_sizes, aggregation):
+  """
+  Turn chunk counts (see chunk_counts()) into embeddings.
+
+  :param counts: (np.array or CSR matrix) chunk counts
+  :param chunk_sizes: (np.array) number of SDRs in each chunk
+  :param aggregation: (str) type of aggregation: 'or', 'and' or 'mean'
+  :return: (np.array) embeddings of shape (nb_sequences, nb_chunks, width)
+    for dense counts, or (CSR matrix) flattened embeddings of shape
+    (nb_sequences, nb_chunks * width) for sparse counts.
+  """
+  if aggregation not in ['or', 'and', 'mean']:
+    raise ValueError('Invalid aggregation name.')
+
+  if not sparse.issparse(counts):
+    sizes = chunk_sizes[:, :, np.newaxis]
+    if aggregation == 'or':
+      return counts > 0
+    elif aggregation == 'and':
+      return counts == sizes
+    else:
+      return counts / sizes.astype(np.float64)
+
+  nb_sequences, nb_chunks = chunk_sizes.shape
+  row_sizes = np.repeat(chunk_sizes.ravel(), np.diff(counts.indptr))
+  if aggregation == 'or':
+    data = counts.data > 0
+  elif aggregation == 'and':
+    data = counts.data == row_sizes
+  else:
+    data = counts.data / row_sizes.astype(np.float64)
+  # Copy the index arrays: eliminate_zeros() would change the counts in place.
+  embeddings = sparse.csr_matrix((data, counts.indices.copy(),
+                                  counts.indptr.copy()), shape=counts.shape)
+  embeddings.eliminate_zeros()
+  return embeddings.reshape((nb_sequences, nb_chunks * counts.shape[1])).tocsr()
+
+
+
+def sequences_to_embeddings(sdr_sequences, aggregation, nb_chunks,
+                            keep_tail=False):
+  """
+  Create the embeddings of several sequences of SDRs.
+  :param sdr_sequences: (list) sequences of SDRs, either dense arrays or
+    scipy sparse matrices (see sdr.load_sdrs())
+  :param aggregation: (str) type of aggregation
+  :param nb_chunks: (int) how many chunks in each SDRs sequence
+  :param keep_tail: (bool) see chunk_counts()
+  :return: see aggregate_counts()
+  """
+  counts, chunk_sizes = chunk_counts(sdr_sequences, nb_chunks, keep_tail)
+  return aggregate_counts(counts, chunk_sizes, aggregation)
+
+
+
+def convert_to_embeddings(sdr_sequences, aggregation, nb_chunks,
+                          keep_tail=False):
+  sp_embeddings = sequences_to_embeddings(
+    sdr_sequences.spActiveColumns.values, aggregation, nb_chunks, keep_tail)
+  tm_embeddings = sequences_to_embeddings(
+    sdr_sequences.tmPredictedActiveCells.values, aggregation, nb_chunks,
+    keep_tail)
   return  sp_embeddings, tm_embeddings
 
 
 
+class EmbeddingCache(object):
+  """
+  SP and TM embeddings of a fixed set of SDR sequences, cached per
+  (aggregation, nb_chunks). The chunk counts are cached per nb_chunks and
+  shared by all the aggregations.
+  """
+
+
+  def __init__(self, sdr_sequences, keep_tail=False):
+    """
+    :param sdr_sequences: (pd.DataFrame) SDR sequences (see sdr.load_sdrs())
+    :param keep_tail: (bool) see chunk_counts()
+    """
+    self.sdr_sequences = sdr_sequences
+    self.keep_tail = keep_tail
+    self._counts = {}
+    self._embeddings = {}
+
+
+  def get(self, aggregation, nb_chunks):
+    """
+    :return: (tuple) SP and TM embeddings. See convert_to_embeddings().
+    """
+    key = (aggregation, nb_chunks)
+    if key not in self._embeddings:
+      if nb_chunks not in self._counts:
+        self._counts[nb_chunks] = [
+          chunk_counts(sdr_sequences, nb_chunks, self.keep_tail)
+          for sdr_sequences in [self.sdr_sequences.spActiveColumns.values,
+                                self.sdr_sequences.tmPredictedActiveCells.values]]
+      self._embeddings[key] = tuple(
+        aggregate_counts(counts, chunk_sizes, aggregation)
+        for counts, chunk_sizes in self._counts[nb_chunks])
+    return self._embeddings[key]
+
+
+  def clear(self):
+    self._counts = {}
+    self._embeddings = {}
+
+
+
+def load_embeddings(file_path, sp_output_width, tm_output_width, aggregations,
+                    chunks, keep_tail=False, batch_size=100):
+  """
+  Stream SDR sequences from disk in batches and build their embeddings for
+  every (aggregation, nb_chunks) combination, without holding all the SDR
+  sequences in memory.
+
+  :param file_path: (str) path to the traces CSV
+  :param sp_output_width: (int) width of the SP SDRs
+  :param tm_output_width: (int) width of the TM SDRs
+  :param aggregations: (list of str) types of aggregation
+  :param chunks: (list of int) numbers of chunks
+  :param keep_tail: (bool) see chunk_counts()
+  :param batch_size: (int) number of sequences read at once
+  :return labels: (np.array) sequence labels
+  :return embeddings: (dict) (aggregation, nb_chunks) -> (SP embeddings,
+    TM embeddings), as sparse flattened embeddings.
+  """
+  labels = []
+  sp_batches = {(a, c): [] for a in aggregations for c in chunks}
+  tm_batches = {(a, c): [] for a in aggregations for c in chunks}
+  for sdr_sequences in iter_sdrs(file_path, sp_output_width, tm_output_width,
+                                 as_sparse=True, chunksize=batch_size):
+    labels.append(sdr_sequences.label.values)
+    cache = EmbeddingCache(sdr_sequences, keep_tail)
+    for key in sp_batches:
+      sp_embeddings, tm_embeddings = cache.get(*key)
+      sp_batches[key].append(sp_embeddings)
+      tm_batches[key].append(tm_embeddings)
+
+  embeddings = {key: (sparse.vstack(sp_batches[key]).tocsr(),
+                      sparse.vstack(tm_batches[key]).tocsr())
+                for key in sp_batches}
+  return np.concatenate(labels), embeddings
+
+
+
 def save_embeddings(embeddings, labels, output_file_path):
   assert len(embeddings) == len(labels)
 
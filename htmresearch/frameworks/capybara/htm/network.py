@@ -30,30 +30,64 @@ from nupic.encoders.random_distributed_scalar import (
 
 def _computeAnomalyScore(activeColumnsNZ,
                          previouslyPredictiveCellsNZ,
-                         nCellsPerColumn):
+                         nCellsPerColumn,
+                         columnMask):
   """
   The set of the region's active columns and the set of columns that have 
   previously-predicted cells are used to calculate the anomaly score.
-  """
 
-  if type(previouslyPredictiveCellsNZ) != np.ndarray:
-    previouslyPredictiveCellsNZ = np.array(previouslyPredictiveCellsNZ)
+  :param columnMask: (np.array) boolean buffer with one entry per column. It
+    must be all False, and it is reset to all False on return.
+  """
 
-  previouslyPredictiveColumnsNZ = previouslyPredictiveCellsNZ / nCellsPerColumn
-  burstingColumnsNZ = np.setdiff1d(activeColumnsNZ,
-                                   previouslyPredictiveColumnsNZ)
-  return len(burstingColumnsNZ) / float(len(activeColumnsNZ))
+  previouslyPredictiveColumnsNZ = (np.asarray(previouslyPredictiveCellsNZ,
+                                              dtype=np.int64)
+                                   // nCellsPerColumn)
+  columnMask[previouslyPredictiveColumnsNZ] = True
+  numPredictedColumns = np.count_nonzero(columnMask[activeColumnsNZ])
+  columnMask[previouslyPredictiveColumnsNZ] = False
+  numBurstingColumns = len(activeColumnsNZ) - numPredictedColumns
+  return numBurstingColumns / float(len(activeColumnsNZ))
 
 
 
 def _computePredictedActiveCells(activeCellsNZ,
-                                 previouslyPredictiveCellsNZ):
-  predictedActive = np.intersect1d(activeCellsNZ, previouslyPredictiveCellsNZ)
+                                 previouslyPredictiveCellsNZ,
+                                 cellMask):
+  """
+  :param cellMask: (np.array) boolean buffer with one entry per cell. It must
+    be all False, and it is reset to all False on return.
+  """
+  activeCellsNZ = np.asarray(activeCellsNZ, dtype=np.uint32)
+  previouslyPredictiveCellsNZ = np.asarray(previouslyPredictiveCellsNZ,
+                                           dtype=np.uint32)
+  cellMask[previouslyPredictiveCellsNZ] = True
+  predictedActive = activeCellsNZ[cellMask[activeCellsNZ]]
+  cellMask[previouslyPredictiveCellsNZ] = False
   assert len(predictedActive) <= len(activeCellsNZ)
   return predictedActive
 
 
 
+def _stackIndices(indicesList):
+  """
+  Stack arrays of indices.
+
+  :param indicesList: (list) arrays of indices
+  :return indices: (np.array) concatenated indices
+  :return offsets: (np.array) start offset of each array in indices, followed
+    by the end offset of the last array.
+  """
+  offsets = np.zeros(len(indicesList) + 1, dtype=np.int64)
+  offsets[1:] = np.cumsum([len(nz) for nz in indicesList])
+  if len(indicesList) > 0:
+    indices = np.concatenate(indicesList).astype(np.uint32)
+  else:
+    indices = np.zeros(0, dtype=np.uint32)
+  return indices, offsets
+
+
+
 class BaseNetwork(object):
   def __init__(self, inputMin=None, inputMax=None, runSanity=False):
 
@@ -78,6 +112,10 @@ class BaseNetwork(object):
     self.predictedActiveCells = None
     self.previouslyPredictiveCells = None
 
+    # Buffers re-used by each record.
+    self._columnMask = None
+    self._cellMask = None
+
 
   def initialize(self):
 
@@ -120,6 +158,10 @@ class BaseNetwork(object):
     }
     self.tm = TemporalMemory(**self.tmParams)
 
+    self._columnMask = np.zeros(self.numColumns, dtype=bool)
+    self._cellMask = np.zeros(self.numColumns * self.cellsPerColumn,
+                              dtype=bool)
+
     # Sanity
     if self.runSanity:
       self.sanity = sanity.SPTMInstance(self.sp, self.tm)
@@ -136,6 +178,88 @@ class BaseNetwork(object):
     if not skipEncoding:
       self.encodeValue(scalarValue)
 
+    self._runEncodedRecord(learningMode)
+
+    # Run Sanity
+    if self.runSanity:
+      self.sanity.appendTimestep(self.getEncoderOutputNZ(),
+                                 self.getSpOutputNZ(),
+                                 self.previouslyPredictiveCells,
+                                 {
+                                   'value': scalarValue,
+                                   'label':label
+                                   })
+
+
+  def handleRecords(self, scalarValues, labels=None, learningMode=True):
+    """
+    Process a block of records. The values are encoded in one pass, then
+    run through the SP and TM one record at a time.
+
+    :param scalarValues: (list) scalar values of the records
+    :param labels: (list) optional labels of the records. Only used by sanity.
+    :param learningMode: (bool) whether the SP and TM learn
+    :return outputs: (dict) outputs of the network for all the records. Index
+      outputs ('encoderOutput', 'spActiveColumns', 'tmActiveCells' and
+      'tmPredictedActiveCells') are tuples (indices, offsets): the indices of
+      record i are indices[offsets[i]:offsets[i + 1]]. 'rawAnomalyScore' is
+      an array with the anomaly score of each record.
+    """
+    numRecords = len(scalarValues)
+    encodings = self.encodeValues(scalarValues)
+
+    # SP outputs have at most numActiveColumnsPerInhArea columns per record.
+    maxActiveColumns = self.spParams["numActiveColumnsPerInhArea"]
+    spActiveColumns = np.empty(numRecords * maxActiveColumns, dtype=np.uint32)
+    spOffsets = np.zeros(numRecords + 1, dtype=np.int64)
+    anomalyScores = np.empty(numRecords, dtype=np.float64)
+    tmActiveCells = []
+    tmPredictedActiveCells = []
+
+    for i in xrange(numRecords):
+      if self.runSanity:
+        self.sanity.waitForUserContinue()
+
+      self.encoderOutput[:] = encodings[i]
+      self._runEncodedRecord(learningMode)
+
+      numActiveColumns = len(self.spOutputNZ)
+      if spOffsets[i] + numActiveColumns > len(spActiveColumns):
+        spActiveColumns = np.resize(spActiveColumns, 2 * len(spActiveColumns)
+                                    + numActiveColumns)
+      spActiveColumns[spOffsets[i]:spOffsets[i] + numActiveColumns] = (
+        self.spOutputNZ)
+      spOffsets[i + 1] = spOffsets[i] + numActiveColumns
+      anomalyScores[i] = self.anomalyScore
+      tmActiveCells.append(self.getTmActiveCellsNZ())
+      tmPredictedActiveCells.append(self.predictedActiveCells)
+
+      if self.runSanity:
+        self.sanity.appendTimestep(self.getEncoderOutputNZ(),
+                                   self.getSpOutputNZ(),
+                                   self.previouslyPredictiveCells,
+                                   {
+                                     'value': scalarValues[i],
+                                     'label': (labels[i] if labels is not None
+                                               else None)
+                                   })
+
+    encoderRows, encoderOutputNZ = encodings.nonzero()
+    encoderOffsets = np.zeros(numRecords + 1, dtype=np.int64)
+    encoderOffsets[1:] = np.cumsum(np.bincount(encoderRows,
+                                               minlength=numRecords))
+    return {
+      'encoderOutput': (encoderOutputNZ.astype(np.uint32), encoderOffsets),
+      'spActiveColumns': (spActiveColumns[:spOffsets[-1]], spOffsets),
+      'tmActiveCells': _stackIndices(tmActiveCells),
+      'tmPredictedActiveCells': _stackIndices(tmPredictedActiveCells),
+      'rawAnomalyScore': anomalyScores,
+    }
+
+
+  def _runEncodedRecord(self, learningMode):
+    """Run the current encoder output through the SP and TM."""
+
     # Run the encoded data through the spatial pooler
     self.sp.compute(self.encoderOutput, learningMode, self.spOutput)
     self.spOutputNZ = self.spOutput.nonzero()[0]
@@ -146,28 +270,39 @@ class BaseNetwork(object):
     # Run SP output through temporal memory
     self.tm.compute(self.spOutputNZ)
     self.predictedActiveCells = _computePredictedActiveCells(
-      self.tm.getActiveCells(), self.previouslyPredictiveCells)
+      self.tm.getActiveCells(), self.previouslyPredictiveCells,
+      self._cellMask)
 
     # Anomaly score
     self.anomalyScore = _computeAnomalyScore(self.spOutputNZ,
                                              self.previouslyPredictiveCells,
-                                             self.cellsPerColumn)
-
-    # Run Sanity
-    if self.runSanity:
-      self.sanity.appendTimestep(self.getEncoderOutputNZ(),
-                                 self.getSpOutputNZ(),
-                                 self.previouslyPredictiveCells,
-                                 {
-                                   'value': scalarValue,
-                                   'label':label
-                                   })
+                                             self.cellsPerColumn,
+                                             self._columnMask)
 
 
   def encodeValue(self, scalarValue):
     self.encoder.encodeIntoArray(scalarValue, self.encoderOutput)
 
 
+  def encodeValues(self, scalarValues):
+    """
+    Encode a block of values. Each distinct value is only encoded once, in
+    order of first appearance so that the encoder creates its buckets in the
+    same order as when the values are encoded one by one.
+
+    :param scalarValues: (list) scalar values
+    :return: (np.array) encoder output of each value, one row per value
+    """
+    scalarValues = np.asarray(scalarValues, dtype=np.float64)
+    uniqueValues, firstIndices, inverse = np.unique(
+      scalarValues, return_index=True, return_inverse=True)
+    encodings = np.zeros((len(uniqueValues), self.encoder.getWidth()),
+                         dtype=np.uint32)
+    for i in np.argsort(firstIndices):
+      self.encoder.encodeIntoArray(uniqueValues[i], encodings[i])
+    return encodings[inverse]
+
+
   def getEncoderResolution(self):
     """
     Compute the Random Distributed Scalar Encoder (RDSE) resolution. It's 
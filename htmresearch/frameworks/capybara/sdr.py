@@ -22,16 +22,119 @@
 import sys
 import copy
 import csv
+import itertools
+import os
 import pandas as pd
 import json
 import numpy as np
+from scipy import sparse
 
+from htmresearch.frameworks.classification.utils.trace_store import \
+  TraceStore, isTraceStore
 
+SDR_COLUMNS = ['spActiveColumns', 'tmPredictedActiveCells']
 
-def load_sdrs(file_path, sp_output_width, tm_output_width):
-  return pd.read_csv(file_path, converters={
-    'spActiveColumns': sdr_converter_factory(sp_output_width),
-    'tmPredictedActiveCells': sdr_converter_factory(tm_output_width)})
+
+
+def load_sdrs(file_path, sp_output_width, tm_output_width, as_sparse=False,
+              chunksize=1000):
+  """
+  Load SDR traces from CSV. The rows are parsed in chunks of `chunksize` rows.
+
+  :param file_path: (str) path to the traces CSV
+  :param sp_output_width: (int) width of the SP SDRs
+  :param tm_output_width: (int) width of the TM SDRs
+  :param as_sparse: (bool) if True, each sequence of SDRs is stored as a
+    CSR matrix of shape (sequence_length, sdr_width) instead of a dense array.
+  :param chunksize: (int) number of rows parsed at once
+  :return: (pd.DataFrame) SDR sequences
+  """
+  return pd.concat(iter_sdrs(file_path, sp_output_width, tm_output_width,
+                             as_sparse, chunksize), ignore_index=True)
+
+
+
+def iter_sdrs(file_path, sp_output_width, tm_output_width, as_sparse=False,
+              chunksize=1000):
+  """
+  Same as load_sdrs(), but yields the SDR sequences by batches of `chunksize`
+  rows (pd.DataFrame) instead of loading the whole file.
+  """
+  if as_sparse:
+    converter_factory = sparse_sdr_converter_factory
+  else:
+    converter_factory = sdr_converter_factory
+  return pd.read_csv(file_path, chunksize=chunksize, converters={
+    'spActiveColumns': converter_factory(sp_output_width),
+    'tmPredictedActiveCells': converter_factory(tm_output_width)})
+
+
+
+def save_sparse_sdrs(sdr_sequences, dir_path):
+  """
+  Save sparse SDR sequences (see load_sdrs()) as .npy arrays, so that several
+  processes can share them read-only with load_sparse_sdrs().
+
+  For each SDR column, the active bit indices of all the SDRs are stored in
+  one int32 array, with int64 offsets per SDR and per sequence.
+
+  :param sdr_sequences: (pd.DataFrame) sparse SDR sequences
+  :param dir_path: (str) output directory. It must not exist.
+  """
+  os.makedirs(dir_path)
+  np.save(os.path.join(dir_path, 'label.npy'), sdr_sequences.label.values)
+  widths = {}
+  for column in SDR_COLUMNS:
+    sequences = sdr_sequences[column].values
+    widths[column] = int(sequences[0].shape[1])
+    sequence_offsets = np.zeros(len(sequences) + 1, dtype='int64')
+    np.cumsum([s.shape[0] for s in sequences], out=sequence_offsets[1:])
+    sdr_offsets = np.zeros(sequence_offsets[-1] + 1, dtype='int64')
+    np.cumsum(np.concatenate([np.diff(s.indptr) for s in sequences]),
+              out=sdr_offsets[1:])
+    indices = np.concatenate([s.indices for s in sequences]).astype('int32')
+    np.save(os.path.join(dir_path, column + '_sequence_offsets.npy'),
+            sequence_offsets)
+    np.save(os.path.join(dir_path, column + '_sdr_offsets.npy'), sdr_offsets)
+    np.save(os.path.join(dir_path, column + '_indices.npy'), indices)
+    np.save(os.path.join(dir_path, column + '_data.npy'),
+            np.ones(len(indices), dtype='int8'))
+  with open(os.path.join(dir_path, 'widths.json'), 'w') as f:
+    json.dump(widths, f)
+
+
+
+def load_sparse_sdrs(dir_path, mmap_mode='r'):
+  """
+  Load SDR sequences saved by save_sparse_sdrs(). The CSR matrix of each
+  sequence is a view on the memory-mapped arrays: only the SDR offsets are
+  copied.
+
+  :param dir_path: (str) directory of the saved SDR sequences
+  :param mmap_mode: (str) see np.load(). None to read the arrays in memory.
+  :return: (pd.DataFrame) sparse SDR sequences
+  """
+  with open(os.path.join(dir_path, 'widths.json')) as f:
+    widths = json.load(f)
+  columns = {'label': np.load(os.path.join(dir_path, 'label.npy'))}
+  for column in SDR_COLUMNS:
+    arrays = {}
+    for name in ['sequence_offsets', 'sdr_offsets', 'indices', 'data']:
+      arrays[name] = np.load(os.path.join(dir_path, '%s_%s.npy'
+                                          % (column, name)),
+                             mmap_mode=mmap_mode)
+    sequence_offsets = np.asarray(arrays['sequence_offsets'])
+    sequences = []
+    for i in range(len(sequence_offsets) - 1):
+      offsets = np.asarray(arrays['sdr_offsets'][sequence_offsets[i]:
+                                                 sequence_offsets[i + 1] + 1])
+      start, end = offsets[0], offsets[-1]
+      sequences.append(sparse.csr_matrix(
+        (arrays['data'][start:end], arrays['indices'][start:end],
+         (offsets - start).astype('int32')),
+        shape=(len(offsets) - 1, widths[column]), copy=False))
+    columns[column] = sequences
+  return pd.DataFrame(columns)
 
 
 
@@ -50,6 +153,39 @@ def sdr_converter_factory(sdr_width):
 
 
 
+def sparse_sdr_converter_factory(sdr_width):
+  def convert_sdr(patternNZ_strings):
+    return convert_to_sparse_sdrs(json.loads(patternNZ_strings), sdr_width)
+
+
+  return convert_sdr
+
+
+
+def convert_to_sparse_sdrs(patternNZs, input_width):
+  """
+  Convert a sequence of patternNZs to a CSR matrix, without going through
+  dense SDRs. The active bit indices of all the SDRs are stored in one index
+  array, with one offset per SDR.
+
+  :param patternNZs: (list of lists) active bit indices of each SDR
+  :param input_width: (int) SDR width
+  :return: (CSR matrix) binary matrix of shape (len(patternNZs), input_width)
+  """
+  indptr = np.zeros(len(patternNZs) + 1, dtype='int32')
+  np.cumsum([len(patternNZ) for patternNZ in patternNZs], out=indptr[1:])
+  indices = np.fromiter(itertools.chain.from_iterable(patternNZs),
+                        dtype='int32', count=indptr[-1])
+  data = np.ones(len(indices), dtype='int8')
+  sdrs = sparse.csr_matrix((data, indices, indptr),
+                           shape=(len(patternNZs), input_width))
+  # Repeated indices of a patternNZ are merged, and the SDRs stay binary
+  sdrs.sum_duplicates()
+  sdrs.data[:] = 1
+  return sdrs
+
+
+
 def convert_to_sdr(patternNZ, input_width):
   sdr = np.zeros(input_width)
   sdr[np.array(patternNZ, dtype='int')] = 1
@@ -120,10 +256,13 @@ def generate_sdrs(num_sdr_classes, num_sdr_per_class, n, w, noise_level):
 
 def load_traces(file_name):
   """
-  Load network traces from CSV
+  Load network traces from CSV, or from a columnar trace store (see
+  htmresearch.frameworks.classification.utils.trace_store).
   :param file_name: (str) name of the file
   :return traces: (dict) network traces. E.g: activeCells, sensorValues, etc.
   """
+  if isTraceStore(file_name):
+    return TraceStore(file_name).toDict()
 
   csv.field_size_limit(sys.maxsize)
 
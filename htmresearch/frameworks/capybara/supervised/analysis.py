@@ -18,27 +18,35 @@
 #
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
+import cPickle
 import datetime
+import hashlib
+import multiprocessing
 import os
+import shutil
+import tempfile
 import time
 
 from htmresearch.frameworks.capybara.distance import \
-  distance_matrix, sequence_distance, reshaped_sequence_distance
-from htmresearch.frameworks.capybara.embedding import \
-  convert_to_embeddings, reshape_embeddings
-from htmresearch.frameworks.capybara.sdr import load_sdrs
+  pairwise_sequence_distances, symmetrize
+from htmresearch.frameworks.capybara.embedding import EmbeddingCache
+from htmresearch.frameworks.capybara.sdr import \
+  load_sdrs, save_sparse_sdrs, load_sparse_sdrs
 from htmresearch.frameworks.capybara.supervised.classification import \
-  train_and_test
+  train_and_test_precomputed, train_and_test_overlap
 from htmresearch.frameworks.capybara.supervised.plot import \
   plot_matrix, plot_projections, make_plot_title, make_subplots
 from htmresearch.frameworks.capybara.util import \
   get_logger, check_shape, indent, hours_minutes_seconds
-from htmresearch.frameworks.dimensionality_reduction.proj import project_vectors
+from htmresearch.frameworks.dimensionality_reduction.proj import project_matrix
 
 PHASES = ['train', 'test']
 CELL_TYPES = ['sp', 'tm']
+KNN_DISTANCES = ['sequence', 'overlap']
 SP_OUT_WIDTH = 2048
 TM_OUT_WIDTH = 65536
+# Number of TSNE iterations of the 2D projections
+TSNE_N_ITER = 500
 
 LOGGER = get_logger()
 
@@ -46,73 +54,92 @@ LOGGER = get_logger()
 
 def analyze_sdr_sequences(sdr_sequences_train, sdr_sequences_test, data_id,
                           nb_chunks, n_neighbors, tsne, aggregation, plot_dir,
-                          assume_sequence_alignment):
+                          assume_sequence_alignment, embedding_caches=None,
+                          checkpoint_path=None, knn_distance='sequence',
+                          checkpoint_params=None):
+  """
+  :param knn_distance: (str) distance of the kNN classifier. 'sequence' is
+    the sequence distance of the distance matrices. 'overlap' is the percent
+    overlap distance between the flattened sequence embeddings, with non-zero
+    values considered active, as for the 'or' and 'and' aggregations.
+  :param embedding_caches: (dict) optional EmbeddingCache of the SDR sequences
+    sorted by label, for each phase. Pass the same caches to successive calls
+    to re-use the embeddings across aggregations and numbers of chunks.
+  :param checkpoint_path: (str) optional path where the accuracies, distance
+    matrices and labels are saved once the analysis is done.
+  :param checkpoint_params: (dict) parameters of the analysis saved with the
+    checkpoint, see get_analysis_params() and load_checkpoint().
+  """
   sdr_widths = {'sp': SP_OUT_WIDTH, 'tm': TM_OUT_WIDTH}
   accuracies = {cell_type: {} for cell_type in CELL_TYPES}
   dist_mats = {cell_type: {} for cell_type in CELL_TYPES}
+  knn_dists = {cell_type: {} for cell_type in CELL_TYPES}
   embeddings = {cell_type: {} for cell_type in CELL_TYPES}
-  X = {cell_type: {} for cell_type in CELL_TYPES}
   y = {}
 
   # Step 1: convert the SDR sequences to "sequence embeddings" and compute the
   # pair-wise sequence distances.
-  for phase, sdr_sequences in zip(PHASES,
-                                  [sdr_sequences_train, sdr_sequences_test]):
+  if embedding_caches is None:
+    embedding_caches = make_embedding_caches(sdr_sequences_train,
+                                             sdr_sequences_test)
+  for phase in PHASES:
 
-    # Sort by label to make it easier to visualize embeddings later.
-    sorted_sdr_sequences = sdr_sequences.sort_values('label')
+    # The sequences are sorted by label to make it easier to visualize
+    # embeddings later.
+    sorted_sdr_sequences = embedding_caches[phase].sdr_sequences
     y[phase] = sorted_sdr_sequences.label.values
 
     # Convert SDRs to embeddings.
     (embeddings['sp'][phase],
-     embeddings['tm'][phase]) = convert_to_embeddings(sorted_sdr_sequences,
-                                                      aggregation,
-                                                      nb_chunks)
-    # Make sure the shapes are ok.
+     embeddings['tm'][phase]) = embedding_caches[phase].get(aggregation,
+                                                            nb_chunks)
+    # Make sure the shapes are ok. The SDRs are loaded as sparse matrices, so
+    # the embeddings are flattened CSR matrices.
     nb_sequences = len(sorted_sdr_sequences)
     for cell_type in CELL_TYPES:
-      check_shape(embeddings[cell_type][phase], (nb_sequences, nb_chunks,
-                                                 sdr_widths[cell_type]))
-      check_shape(embeddings[cell_type][phase], (nb_sequences, nb_chunks,
+      check_shape(embeddings[cell_type][phase], (nb_sequences, nb_chunks *
                                                  sdr_widths[cell_type]))
     check_shape(y[phase], (nb_sequences,))
 
-    # Compute distance matrix.
-    distance = lambda a, b: sequence_distance(a, b, assume_sequence_alignment)
-    dist_mats['sp'][phase], dist_mats['tm'][phase], _ = distance_matrix(
-      embeddings['sp'][phase], embeddings['tm'][phase], distance)
+    # Compute distance matrices. The SP and TM matrices are computed in the
+    # same vectorized pass. The directed distances d(i, j) are kept for the
+    # classifier; the plots use the symmetric matrices.
+    sp_dists, tm_dists = pairwise_sequence_distances(
+      [(embeddings['sp'][phase], embeddings['sp'][phase]),
+       (embeddings['tm'][phase], embeddings['tm'][phase])],
+      nb_chunks, assume_sequence_alignment)
+    if phase == 'train':
+      knn_dists['sp'][phase] = sp_dists
+      knn_dists['tm'][phase] = tm_dists
+    dist_mats['sp'][phase] = symmetrize(sp_dists)
+    dist_mats['tm'][phase] = symmetrize(tm_dists)
 
-  # Step 2: Flatten the sequence embeddings to be able to classify each
-  # sequence with a supervised classifier. The classifier uses the same
-  # sequence distance as the distance matrix.
+  # Step 2: classify each sequence with a kNN classifier. With the sequence
+  # distance, the classifier uses the same distance as the distance matrices:
+  # the train distances are re-used, and the test-vs-train distances are
+  # computed in one pass.
+  if knn_distance == 'sequence':
+    (knn_dists['sp']['test'],
+     knn_dists['tm']['test']) = pairwise_sequence_distances(
+      [(embeddings['sp']['test'], embeddings['sp']['train']),
+       (embeddings['tm']['test'], embeddings['tm']['train'])],
+      nb_chunks, assume_sequence_alignment)
+  elif knn_distance != 'overlap':
+    raise ValueError('Invalid kNN distance: %s. Valid distances are: %s'
+                     % (knn_distance, KNN_DISTANCES))
   for cell_type in CELL_TYPES:
 
-    # Flatten embeddings.
-    # Note: we have to flatten X because sklearn doesn't allow for X to be > 2D.
-    # Here, the initial shape of X (i.e. sequence embeddings) is 3D and
-    # therefore has to be flattened to 2D. See the logic of reshape_embeddings()
-    # for details on how the embeddings are converted from 2D to 3D.
-    nb_sequences = len(embeddings[cell_type]['train'])
-
-    X[cell_type]['train'] = reshape_embeddings(embeddings[cell_type]['train'],
-                                               nb_sequences, nb_chunks,
-                                               sdr_widths[cell_type])
-    X[cell_type]['test'] = reshape_embeddings(embeddings[cell_type]['test'],
-                                              nb_sequences, nb_chunks,
-                                              sdr_widths[cell_type])
-
-    sequence_embedding_shape = (nb_chunks, sdr_widths[cell_type])
-    reshaped_distance = lambda a, b: reshaped_sequence_distance(
-      a, b, sequence_embedding_shape, assume_sequence_alignment)
-
     # Compute train and test accuracies
-    (accuracies[cell_type]['train'],
-     accuracies[cell_type]['test']) = train_and_test(X[cell_type]['train'],
-                                                     y['train'],
-                                                     X[cell_type]['test'],
-                                                     y['test'],
-                                                     reshaped_distance,
-                                                     n_neighbors)
+    if knn_distance == 'sequence':
+      (accuracies[cell_type]['train'],
+       accuracies[cell_type]['test']) = train_and_test_precomputed(
+        knn_dists[cell_type]['train'], y['train'],
+        knn_dists[cell_type]['test'], y['test'], n_neighbors)
+    else:
+      (accuracies[cell_type]['train'],
+       accuracies[cell_type]['test']) = train_and_test_overlap(
+        embeddings[cell_type]['train'], y['train'],
+        embeddings[cell_type]['test'], y['test'], n_neighbors)
 
     # Step 3: plot the distance matrix and 2D projections for each cell
     # type (SP or TM) and phase (train or test).
@@ -126,10 +153,9 @@ def analyze_sdr_sequences(sdr_sequences_train, sdr_sequences_test, data_id,
       plot_matrix(dist_mats[cell_type][phase], title, fig, ax[phase_idx][0])
 
       if tsne:
-        embeddings_proj = project_vectors(X[cell_type][phase],
-                                          reshaped_distance)
         # Re-use the distance matrix to compute the 2D projections. It's faster.
-        # embeddings_proj = project_matrix(dist_mats[cell_type][phase])
+        embeddings_proj = project_matrix(dist_mats[cell_type][phase],
+                                         n_iter=TSNE_N_ITER)
 
         title = make_plot_title('TSNE 2d projections', phase,
                                 accuracies[cell_type][phase])
@@ -138,36 +164,226 @@ def analyze_sdr_sequences(sdr_sequences_train, sdr_sequences_test, data_id,
 
     fig.savefig(plot_path)
 
+  if checkpoint_path is not None:
+    save_checkpoint({'accuracies': accuracies,
+                     'dist_mats': dist_mats,
+                     'labels': y,
+                     'params': checkpoint_params}, checkpoint_path)
+
   return accuracies
 
 
 
+def make_embedding_caches(sdr_sequences_train, sdr_sequences_test):
+  return {phase: EmbeddingCache(sdr_sequences.sort_values('label'))
+          for phase, sdr_sequences in zip(PHASES, [sdr_sequences_train,
+                                                   sdr_sequences_test])}
+
+
+
+def save_checkpoint(results, checkpoint_path):
+  # Write to a temporary file first, so that an interrupted write does not
+  # leave a partial checkpoint behind.
+  tmp_path = checkpoint_path + '.tmp'
+  with open(tmp_path, 'wb') as f:
+    cPickle.dump(results, f, cPickle.HIGHEST_PROTOCOL)
+  os.rename(tmp_path, checkpoint_path)
+
+
+
+def load_checkpoint(checkpoint_path, params=None):
+  """
+  :param params: (dict) if given, parameters the checkpoint must have been
+    saved with.
+  :return: (dict) the checkpoint, or None if there is no checkpoint at this
+    path or if it was saved with other parameters.
+  """
+  if not os.path.exists(checkpoint_path):
+    return None
+  with open(checkpoint_path, 'rb') as f:
+    results = cPickle.load(f)
+  if params is not None and results.get('params') != params:
+    return None
+  return results
+
+
+
+def get_analysis_params(trace_digest, aggregation, nb_chunks, n_neighbors,
+                        tsne, assume_sequence_alignment, knn_distance):
+  """
+  Parameters that determine the results of an analysis, used to key its
+  checkpoint.
+
+  :param trace_digest: (str) digest of the traces, see get_trace_digest().
+  """
+  return {'trace_digest': trace_digest,
+          'aggregation': aggregation,
+          'nb_chunks': nb_chunks,
+          'n_neighbors': n_neighbors,
+          'tsne': tsne,
+          'assume_sequence_alignment': assume_sequence_alignment,
+          'knn_distance': knn_distance,
+          'sp_width': SP_OUT_WIDTH,
+          'tm_width': TM_OUT_WIDTH}
+
+
+
+def get_checkpoint_path(checkpoint_dir, data_id, params):
+  """
+  The checkpoints of the same data ID with different parameters (see
+  get_analysis_params()) have different paths, so they don't overwrite each
+  other.
+  """
+  key = hashlib.md5(repr(sorted(params.items()))).hexdigest()[:12]
+  return os.path.join(checkpoint_dir, 'results_%s_%s_%s_%s.pkl'
+                      % (data_id, params['aggregation'], params['nb_chunks'],
+                         key))
+
+
+
+def get_trace_path(trace_dir, data_id, phase):
+  return os.path.join(trace_dir, 'trace_%s_%s' % (data_id, phase.upper()))
+
+
+
+def get_trace_digest(trace_dir, data_id):
+  """
+  MD5 digest of the contents of the train and test traces of a data ID.
+  """
+  digest = hashlib.md5()
+  for phase in PHASES:
+    with open(get_trace_path(trace_dir, data_id, phase), 'rb') as f:
+      for block in iter(lambda: f.read(2 ** 20), ''):
+        digest.update(block)
+  return digest.hexdigest()
+
+
+
+def log_accuracies(data_id, aggregation, nb_chunks, accuracies):
+  LOGGER.info(indent(1) + '%s | aggregation: %s | nb_chunks: %s'
+              % (data_id, aggregation, nb_chunks))
+  for cell_type, train_test_acc in accuracies.items():
+    for phase, acc in train_test_acc.items():
+      LOGGER.info(indent(2) + '%s %s accuracy: %s /100'
+                  % (cell_type.upper(), phase, acc))
+
+
+
+def _analyze_task(task):
+  """
+  Analyze the SDR sequences of one data ID for one number of chunks and
+  several aggregations. The chunk counts of the embeddings are shared by all
+  the aggregations.
+  """
+  (sdr_dir, trace_digest, data_id, nb_chunks, aggregations, n_neighbors, tsne,
+   plot_dir, assume_sequence_alignment, checkpoint_dir, knn_distance) = task
+  sdr_sequences = {phase: load_sparse_sdrs(os.path.join(sdr_dir, phase))
+                   for phase in PHASES}
+  embedding_caches = make_embedding_caches(sdr_sequences['train'],
+                                           sdr_sequences['test'])
+  results = []
+  for aggregation in aggregations:
+    params = get_analysis_params(trace_digest, aggregation, nb_chunks,
+                                 n_neighbors, tsne, assume_sequence_alignment,
+                                 knn_distance)
+    checkpoint_path = get_checkpoint_path(checkpoint_dir, data_id, params)
+    accuracies = analyze_sdr_sequences(
+      sdr_sequences['train'], sdr_sequences['test'], data_id, nb_chunks,
+      n_neighbors, tsne, aggregation, plot_dir, assume_sequence_alignment,
+      embedding_caches, checkpoint_path, knn_distance, params)
+    results.append((data_id, aggregation, nb_chunks, accuracies))
+  return results
+
+
+
 def run_analysis(trace_dir, data_ids, chunks, n_neighbors, tsne, aggregations,
-                 plot_dir, assume_sequence_alignment):
+                 plot_dir, assume_sequence_alignment, n_jobs=1,
+                 checkpoint_dir=None, knn_distance='sequence'):
+  """
+  Analyze every combination of data ID, aggregation and number of chunks.
+
+  The traces of each data ID are loaded once and saved as memory-mapped
+  arrays, shared read-only by the worker processes. The results of each
+  combination are checkpointed: if checkpoint_dir is given, combinations
+  with a checkpoint from a previous run, with the same parameters and traces,
+  are not re-computed.
+
+  :param n_jobs: (int) number of worker processes.
+  :param knn_distance: (str) distance of the kNN classifier, see
+    analyze_sdr_sequences().
+  :param checkpoint_dir: (str) directory of the checkpoints and of the
+    memory-mapped traces. Defaults to a temporary directory, removed at the
+    end of the analysis.
+  """
   if not os.path.exists(plot_dir): os.makedirs(plot_dir)
 
   tic = time.time()
-  LOGGER.info('Analysis tree')
-  for data_id in data_ids:
-    LOGGER.info(indent(1) + 'load: ' + data_id)
-    sdr_sequences = {}
-    for phase in PHASES:
-      f_path = os.path.join(trace_dir, 'trace_%s_%s' % (data_id, phase.upper()))
-      sdr_sequences[phase] = load_sdrs(f_path, SP_OUT_WIDTH, TM_OUT_WIDTH)
-      LOGGER.info(indent(2) + 'loaded: ' + f_path)
-    LOGGER.info(indent(1) + 'analyze: ' + data_id)
-    for aggregation in aggregations:
-      LOGGER.info(indent(2) + 'aggregation: ' + aggregation)
+  if checkpoint_dir is None:
+    work_dir = tempfile.mkdtemp()
+  else:
+    work_dir = checkpoint_dir
+    if not os.path.exists(work_dir): os.makedirs(work_dir)
+
+  try:
+    LOGGER.info('Analysis tree')
+    tasks = []
+    for data_id in data_ids:
+      trace_digest = get_trace_digest(trace_dir, data_id)
+      pending = []
+      for aggregation in aggregations:
+        for nb_chunks in chunks:
+          params = get_analysis_params(trace_digest, aggregation, nb_chunks,
+                                       n_neighbors, tsne,
+                                       assume_sequence_alignment, knn_distance)
+          results = load_checkpoint(
+            get_checkpoint_path(work_dir, data_id, params), params)
+          if results is not None:
+            log_accuracies(data_id, aggregation, nb_chunks,
+                           results['accuracies'])
+          else:
+            pending.append((aggregation, nb_chunks))
+      if len(pending) == 0:
+        continue
+
+      # The saved SDRs are keyed by the digest of the traces they come from
+      sdr_dir = os.path.join(work_dir, 'sdrs',
+                             '%s_%s' % (data_id, trace_digest))
+      if not os.path.exists(sdr_dir):
+        LOGGER.info(indent(1) + 'load: ' + data_id)
+        tmp_dir = sdr_dir + '.tmp'
+        if os.path.exists(tmp_dir): shutil.rmtree(tmp_dir)
+        for phase in PHASES:
+          f_path = get_trace_path(trace_dir, data_id, phase)
+          sdr_sequences = load_sdrs(f_path, SP_OUT_WIDTH, TM_OUT_WIDTH,
+                                    as_sparse=True)
+          save_sparse_sdrs(sdr_sequences, os.path.join(tmp_dir, phase))
+          LOGGER.info(indent(2) + 'loaded: ' + f_path)
+        os.rename(tmp_dir, sdr_dir)
+
       for nb_chunks in chunks:
-        LOGGER.info(indent(3) + 'nb_chunks: ' + str(nb_chunks))
-        accuracies = analyze_sdr_sequences(
-          sdr_sequences['train'].copy(), sdr_sequences['test'].copy(), data_id,
-          nb_chunks, n_neighbors, tsne, aggregation, plot_dir,
-          assume_sequence_alignment)
-        for cell_type, train_test_acc in accuracies.items():
-          for phase, acc in train_test_acc.items():
-            LOGGER.info(indent(4) + '%s %s accuracy: %s /100'
-                        % (cell_type.upper(), phase, acc))
+        chunk_aggregations = [a for (a, c) in pending if c == nb_chunks]
+        if len(chunk_aggregations) > 0:
+          tasks.append((sdr_dir, trace_digest, data_id, nb_chunks,
+                        chunk_aggregations, n_neighbors, tsne, plot_dir,
+                        assume_sequence_alignment, work_dir, knn_distance))
+
+    LOGGER.info('Analyzing %s tasks with %s jobs' % (len(tasks), n_jobs))
+    if n_jobs > 1 and len(tasks) > 1:
+      pool = multiprocessing.Pool(n_jobs)
+      try:
+        for results in pool.imap_unordered(_analyze_task, tasks):
+          for result in results:
+            log_accuracies(*result)
+      finally:
+        pool.close()
+        pool.join()
+    else:
+      for task in tasks:
+        for result in _analyze_task(task):
+          log_accuracies(*result)
+  finally:
+    if checkpoint_dir is None:
+      shutil.rmtree(work_dir)
 
   toc = time.time()
   td = datetime.timedelta(seconds=(toc - tic))
@@ -22,6 +22,9 @@
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.metrics import accuracy_score
 
+from htmresearch.frameworks.capybara.distance import \
+  pack_sdrs, percent_overlap_distances
+
 
 
 def train_and_test(X_train, y_train, X_test, y_test, distance, n_neighbors):
@@ -37,3 +40,56 @@ def train_and_test(X_train, y_train, X_test, y_test, distance, n_neighbors):
   test_acc = '%.2f' % (accuracy_score(y_test, y_pred) * 100)
 
   return train_acc, test_acc
+
+
+
+def train_and_test_precomputed(train_distances, y_train, test_distances,
+                               y_test, n_neighbors):
+  """
+  Same as train_and_test(), with pre-computed distances.
+
+  :param train_distances: (np.array) distances between the training
+    sequences, shape (nb_train, nb_train). Row i holds the distances from
+    training sequence i to all the training sequences.
+  :param test_distances: (np.array) distances between the test sequences and
+    the training sequences, shape (nb_test, nb_train).
+
+  The neighbors are found by brute force. When several training sequences
+  are at the same distance, the neighbors picked can differ from the
+  tree-based search of train_and_test(). The accuracies can then differ
+  slightly, as they can from rounding differences in the distances.
+  """
+  knn = KNeighborsClassifier(n_neighbors=n_neighbors,
+                             algorithm='brute', metric='precomputed')
+
+  knn.fit(train_distances, y_train)
+
+  y_pred = knn.predict(train_distances)
+  train_acc = '%.2f' % (accuracy_score(y_train, y_pred) * 100)
+
+  y_pred = knn.predict(test_distances)
+  test_acc = '%.2f' % (accuracy_score(y_test, y_pred) * 100)
+
+  return train_acc, test_acc
+
+
+
+def train_and_test_overlap(X_train, y_train, X_test, y_test, n_neighbors):
+  """
+  Same as train_and_test(), with the percent overlap distance between binary
+  embeddings. The embeddings are packed in bits and the overlaps computed
+  with popcounts.
+
+  :param X_train: (np.array or scipy sparse matrix) binary training
+    embeddings, flattened to shape (nb_train, width)
+  :param X_test: (np.array or scipy sparse matrix) binary test embeddings,
+    flattened to shape (nb_test, width)
+  """
+  packed_train, nb_active_train = pack_sdrs(X_train)
+  packed_test, nb_active_test = pack_sdrs(X_test)
+  train_distances = percent_overlap_distances(packed_train, nb_active_train,
+                                              packed_train, nb_active_train)
+  test_distances = percent_overlap_distances(packed_test, nb_active_test,
+                                             packed_train, nb_active_train)
+  return train_and_test_precomputed(train_distances, y_train, test_distances,
+                                    y_test, n_neighbors)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+import numpy as np
+
+from htmresearch.frameworks.capybara.distance import euclidian_distance
+
+
+
+class CentroidIndex(object):
+  def __init__(self, distance_func, dim=0):
+    """
+    Index of cluster centroids, shared by the online clustering algorithms.
+
+    The centroids are stored in a contiguous matrix, so that the distances
+    between a point and all the centroids are computed in one vectorized
+    call for euclidian distances. The distances between centroids are cached
+    in a matrix: adding, updating or removing a centroid only re-computes
+    one row of that matrix, i.e. O(k) distances for k centroids.
+
+    :param distance_func: (function) distance metric. The function signature
+      is "distance_func(x1, x2)" where x1 and x2 are np.arrays.
+    :param dim: (int) initial dimension of the centroids.
+    """
+    self.distance_func = distance_func
+    self._dim = dim
+    self._capacity = 0
+    self._centers = np.zeros((0, dim))
+    self._dists = np.zeros((0, 0))
+    # Time at which the distances of each centroid were last computed.
+    self._stamps = np.zeros(0, dtype='int64')
+    self._clock = 0
+    self._keys = []  # Keys of the centroids, in row order.
+    self._rows = {}  # Keys are the centroid keys; Values are matrix rows.
+
+
+  def __len__(self):
+    return len(self._keys)
+
+
+  def __contains__(self, key):
+    return key in self._rows
+
+
+  def keys(self):
+    return list(self._keys)
+
+
+  def batch_distances(self, x, rows=None):
+    """
+    Distances between x and the centroids.
+
+    :param x: (np.array) point
+    :param rows: (list) rows of the centroids. Defaults to all centroids.
+    :return: (np.array) distances, in the order of the rows.
+    """
+    if rows is None:
+      centers = self._centers[:len(self._keys)]
+    else:
+      centers = self._centers[rows]
+    if self.distance_func is euclidian_distance:
+      return np.sqrt(np.square(centers - x).sum(axis=1))
+    return np.array([self.distance_func(c, x) for c in centers],
+                    dtype=np.float64)
+
+
+  def distances(self, x, keys=None):
+    """
+    Distances between a point and the centroids.
+
+    :param x: (np.array) point
+    :param keys: (list) keys of the centroids. Defaults to all centroids.
+    :return keys: (list) keys of the centroids
+    :return distances: (np.array) distances to the centroids
+    """
+    if keys is None:
+      return self.keys(), self.batch_distances(x)
+    return keys, self.batch_distances(x, [self._rows[k] for k in keys])
+
+
+  def resize(self, dim):
+    """
+    Pad the centroids with zeros up to dimension dim.
+    """
+    if dim > self._dim:
+      centers = np.zeros((self._capacity, dim))
+      centers[:, :self._dim] = self._centers
+      self._centers = centers
+      self._dim = dim
+
+
+  def add(self, key, center):
+    """
+    Add a centroid and compute its distances to the other centroids.
+    """
+    if key in self._rows:
+      raise ValueError('Centroid %s already exists' % key)
+    self.resize(len(center))
+    n = len(self._keys)
+    if n == self._capacity:
+      self._grow(max(2 * self._capacity, 16))
+    self._keys.append(key)
+    self._rows[key] = n
+    self.update(key, center)
+
+
+  def update(self, key, center):
+    """
+    Update a centroid and re-compute its distances to the other centroids.
+    """
+    row = self._rows[key]
+    self.resize(len(center))
+    self._centers[row, :len(center)] = center
+    self._centers[row, len(center):] = 0
+    d = self.batch_distances(self._centers[row])
+    d[row] = 0
+    self._dists[row, :len(d)] = d
+    self._dists[:len(d), row] = d
+    self._clock += 1
+    self._stamps[row] = self._clock
+
+
+  def remove(self, key):
+    """
+    Remove a centroid. The last centroid is moved to its row, so that the
+    centroids stay contiguous.
+    """
+    row = self._rows.pop(key)
+    last = len(self._keys) - 1
+    if row != last:
+      last_key = self._keys[last]
+      self._keys[row] = last_key
+      self._rows[last_key] = row
+      self._centers[row] = self._centers[last]
+      self._stamps[row] = self._stamps[last]
+      self._dists[row, :] = self._dists[last, :]
+      self._dists[:, row] = self._dists[:, last]
+      self._dists[row, row] = 0
+    self._keys.pop()
+
+
+  def closest_pair(self):
+    """
+    Find the two closest centroids.
+
+    :return key1, key2: (tuple) keys of the closest centroids. key2 is the
+      centroid whose distances were updated last.
+    :return distance: (float) distance between the two centroids.
+    """
+    n = len(self._keys)
+    if n < 2:
+      return None, None, None
+    dists = self._dists[:n, :n].copy()
+    dists[np.tril_indices(n)] = np.inf
+    dists[np.isnan(dists)] = np.inf
+    i, j = np.unravel_index(np.argmin(dists), dists.shape)
+    if self._stamps[i] > self._stamps[j]:
+      i, j = j, i
+    return self._keys[i], self._keys[j], self._dists[i, j]
+
+
+  def mean_distance(self):
+    """
+    Average distance between centroids. 0.0 if there are less than 2
+    centroids.
+    """
+    n = len(self._keys)
+    if n < 2:
+      return 0.0
+    return np.mean(self._dists[:n, :n][np.triu_indices(n, 1)])
+
+
+  def _grow(self, capacity):
+    centers = np.zeros((capacity, self._dim))
+    centers[:self._capacity] = self._centers
+    dists = np.zeros((capacity, capacity))
+    dists[:self._capacity, :self._capacity] = self._dists
+    stamps = np.zeros(capacity, dtype='int64')
+    stamps[:self._capacity] = self._stamps
+    self._centers = centers
+    self._dists = dists
+    self._stamps = stamps
+    self._capacity = capacity
@@ -22,7 +22,9 @@
 import numpy as np
 
 from abc import ABCMeta, abstractmethod
-from queue import PriorityQueue
+
+from htmresearch.frameworks.capybara.unsupervised.centroid_index import \
+  CentroidIndex
 
 
 
@@ -124,6 +126,8 @@ class ClusteringInterface(object):
     """
     self.distance_func = distance_func
     self.clusters = {}  # Keys are cluster IDs; Values are Clusters.
+    # Cluster centers and inter-cluster distances. Keys are cluster IDs.
+    self._index = CentroidIndex(distance_func)
 
 
   @abstractmethod
@@ -175,45 +179,20 @@ class ClusteringInterface(object):
 
   def merge_closest_clusters(self):
     """
-    Merge closest two clusters.
+    Merge closest two clusters. The inter-cluster distances are cached by the
+    centroid index, so only the distances of the merged cluster are updated.
     """
-    inter_cluster_dists = PriorityQueue()
-
-    numClusters = len(self.clusters)
-    for i in range(numClusters):
-      for j in range(i + 1, numClusters):
-        c1 = self.clusters.values()[i]
-        c2 = self.clusters.values()[j]
-        d = self.distance_func(c1.center.value, c2.center.value)
-        inter_cluster_dists.put(InterClusterDist(c1, c2, d))
-
-    smallest_inter_cluster_dist = inter_cluster_dists.get()
-    cluster_to_merge = smallest_inter_cluster_dist.c2
-    smallest_inter_cluster_dist.c1.merge(cluster_to_merge)
-    del self.clusters[cluster_to_merge.id]
-
-
-
-class InterClusterDist(object):
-  """
-  Inter-cluster distance.
-
-  Useful to define cmp() for queue.PriorityQueue.
-  """
-
-
-  def __init__(self, c1, c2, c1_c2_dist):
-    self.c1 = c1
-    self.c2 = c2
-    self.dist = c1_c2_dist
-
-
-  def __cmp__(self, inter_cluster_dist):
-    return cmp(self.dist, inter_cluster_dist.dist)
-
-
-  def __str__(self):
-    return "InterClusterDist(%f)" % self.dist
+    c1_id, c2_id, _ = self._index.closest_pair()
+    # Merge into the cluster that comes first in the clusters dict.
+    cluster_ids = self.clusters.keys()
+    if cluster_ids.index(c1_id) > cluster_ids.index(c2_id):
+      c1_id, c2_id = c2_id, c1_id
+    c1 = self.clusters[c1_id]
+    cluster_to_merge = self.clusters[c2_id]
+    c1.merge(cluster_to_merge)
+    del self.clusters[c2_id]
+    self._index.remove(c2_id)
+    self._index.update(c1_id, c1.center.value)
 
 
 
@@ -283,21 +262,7 @@ class OnlineClustering(ClusteringInterface):
     
     :return average_distance: (float) average distance between clusters. 
     """
-    cluster_distances = []
-    cluster_ids = self.clusters.keys()
-
-    numClusters = len(cluster_ids)
-    for i in range(numClusters):
-      for j in range(i + 1, numClusters):
-        ci = self.clusters[cluster_ids[i]].center.value
-        cj = self.clusters[cluster_ids[j]].center.value
-        d = self.distance_func(ci, cj)
-        cluster_distances.append(d)
-
-    if len(cluster_distances) > 0:
-      return np.mean(cluster_distances)
-    else:
-      return 0.0
+    return self._index.mean_distance()
 
 
   def _add_or_merge_cluster(self, cluster, merge_threshold):
@@ -316,6 +281,7 @@ class OnlineClustering(ClusteringInterface):
      closest) = self._find_closest_cluster(cluster.center)
     if closest and distance_to_closest < merge_threshold:
       closest.merge(cluster)
+      self._index.update(closest.id, closest.center.value)
     else:
       self._add_cluster(cluster)
 
@@ -330,6 +296,7 @@ class OnlineClustering(ClusteringInterface):
     if cluster.id in self.clusters:
       raise ValueError('Cluster ID %s already exists' % cluster.id)
     self.clusters[cluster.id] = cluster
+    self._index.add(cluster.id, cluster.center.value)
 
 
   def _find_closest_cluster(self, point):
@@ -343,18 +310,14 @@ class OnlineClustering(ClusteringInterface):
       center and point.
     :return closest: (Cluster) closest cluster to point.
     """
-    distance_cluster_pairs = []
-    for cluster in self.clusters.values():
-      d = self.distance_func(cluster.center.value, point.value)
-      distance_cluster_pairs.append((d, cluster))
-    if len(distance_cluster_pairs) > 0:
-      cluster_distances = [d[0] for d in distance_cluster_pairs]
+    if len(self._index) > 0:
+      cluster_ids, cluster_distances = self._index.distances(point.value)
       min_dist_idx = np.argmin(cluster_distances)
 
       # Get the closest cluster and some other useful distance metrics.
       average_cluster_distances = np.mean(cluster_distances)
-      distance_to_closest = distance_cluster_pairs[min_dist_idx][0]
-      closest = distance_cluster_pairs[min_dist_idx][1]
+      distance_to_closest = cluster_distances[min_dist_idx]
+      closest = self.clusters[cluster_ids[min_dist_idx]]
       return average_cluster_distances, distance_to_closest, closest
     else:
       return None, None, None
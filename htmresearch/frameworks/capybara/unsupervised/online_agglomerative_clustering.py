@@ -1,7 +1,9 @@
-import heapq
-import operator
+import numpy as np
 import scipy
 
+from htmresearch.frameworks.capybara.unsupervised.centroid_index import \
+  CentroidIndex
+
 
 
 class Cluster(object):
@@ -36,28 +38,6 @@ class Cluster(object):
 
 
 
-class Dist(object):
-  """
-  this is just a tuple,
-  but we need an object so we can define cmp for heapq
-  """
-
-
-  def __init__(self, c1, c2, d):
-    self.c1 = c1
-    self.c2 = c2
-    self.d = d
-
-
-  def __cmp__(self, o):
-    return cmp(self.d, o.d)
-
-
-  def __str__(self):
-    return "Dist(%f)" % (self.d)
-
-
-
 class OnlineAgglomerativeClustering(object):
   def __init__(self,
                max_num_clusters,
@@ -76,23 +56,24 @@ class OnlineAgglomerativeClustering(object):
     self._cluster_size_cutoff = cluster_size_cutoff
 
     self._clusters = []
+    self._clusters_by_id = {}
     # max number of dimensions we've seen so far
     self._dim = 0
 
-    # cache inter-cluster distances
-    self._dist = []
+    # cache cluster centers and inter-cluster distances
+    self._index = CentroidIndex(distance_func)
 
 
   def _resize(self, dim):
     for c in self._clusters:
-      c._resize(dim)
+      c.resize(dim)
+    self._index.resize(dim)
     self._dim = dim
 
 
   def find_closest_cluster(self, point, clusters):
-    c = [(i, self._distance_func(c.center, point))
-         for i, c in enumerate(clusters)]
-    closest = clusters[min(c, key=operator.itemgetter(1))[0]]
+    _, dists = self._index.distances(point, [c.id for c in clusters])
+    closest = clusters[np.argmin(dists)]
     return closest
 
 
@@ -105,30 +86,32 @@ class OnlineAgglomerativeClustering(object):
       # compare new point to each existing cluster
       closest = self.find_closest_cluster(new_point, self._clusters)
       closest.add(new_point, label)
-      # invalidate dist-cache for this cluster
-      self._update_dist(closest)
+      # re-compute the cached distances of this cluster
+      self._index.update(closest.id, closest.center)
     else:
       closest = None
 
     if len(self._clusters) >= self._max_num_clusters and len(
       self._clusters) > 1:
-      # merge closest two clusters
-      inter_cluster_dist = heapq.heappop(self._dist)
-      cluster_to_merge = inter_cluster_dist.c2
-      inter_cluster_dist.c1.merge(cluster_to_merge)
-      if cluster_to_merge in self._clusters:
-        self._clusters.remove(cluster_to_merge)
-
-      # update inter-cluster distances      
-      self._remove_dist(cluster_to_merge)
-      self._update_dist(inter_cluster_dist.c1)
+      # merge closest two clusters. The cluster merged into the other one is
+      # the one whose distances were updated last.
+      c1_id, c2_id, _ = self._index.closest_pair()
+      c1 = self._clusters_by_id[c1_id]
+      cluster_to_merge = self._clusters_by_id.pop(c2_id)
+      c1.merge(cluster_to_merge)
+      self._clusters.remove(cluster_to_merge)
+
+      # update inter-cluster distances
+      self._index.remove(c2_id)
+      self._index.update(c1_id, c1.center)
 
     # make a new cluster for this point
     cluster_id = self._total_num_clusters_created + 1
     new_cluster = Cluster(cluster_id, new_point, self._distance_func)
     self._total_num_clusters_created += 1
     self._clusters.append(new_cluster)
-    self._update_dist(new_cluster)
+    self._clusters_by_id[cluster_id] = new_cluster
+    self._index.add(cluster_id, new_cluster.center)
 
     self._num_points_processed += 1
 
@@ -141,28 +124,6 @@ class OnlineAgglomerativeClustering(object):
       return self._clusters, closest
 
 
-  def _remove_dist(self, d):
-    """Invalidate inter-cluster distance cache for c"""
-    inter_cluster_dist_to_remove = []
-    for inter_cluster_dist in self._dist:
-      if inter_cluster_dist.c1 == d or inter_cluster_dist.c2 == d:
-        inter_cluster_dist_to_remove.append(inter_cluster_dist)
-    for x in inter_cluster_dist_to_remove:
-      self._dist.remove(x)
-    heapq.heapify(self._dist)
-
-
-  def _update_dist(self, c):
-    """Cluster c has changed, re-compute all inter-cluster distances"""
-    self._remove_dist(c)
-
-    for x in self._clusters:
-      if x == c: continue
-      d = self._distance_func(x.center, c.center)
-      inter_cluster_dist = Dist(x, c, d)
-      heapq.heappush(self._dist, inter_cluster_dist)
-
-
   def _trim_clusters(self):
     """Return only clusters over threshold"""
     mean_cluster_size = scipy.mean([x.size for x in self._clusters])
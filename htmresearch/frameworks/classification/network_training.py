@@ -25,6 +25,9 @@ import logging
 import numpy
 import sys
 
+from htmresearch.frameworks.classification.utils.trace_store import (
+  TraceWriter)
+
 _LOGGER = logging.getLogger(__name__)
 logging.basicConfig(format='[%(levelname)s] %(message)s', level=logging.DEBUG,
                     stream=sys.stdout)
@@ -78,7 +81,8 @@ def _stopLearning(network, trainedRegionNames, recordNumber):
 
 
 def trainNetwork(network, networkConfig, networkPartitions, numRecords,
-                 verbosity=0):
+                 verbosity=0, traceSink=None, chunkSize=1000,
+                 traceSampling=None):
   """
   Train the network.
 
@@ -88,6 +92,17 @@ def trainNetwork(network, networkConfig, networkPartitions, numRecords,
    region is to begin learning, including a test partition (the last entry).
   @param numRecords: (int) Number of records of the input dataset.
   @param verbosity: (0 or 1) How verbose the log is. (0 is less verbose)
+  @param traceSink: (str, TraceWriter or function) Optional sink of the network
+    traces. If set, the traces are not kept in memory but written to the sink
+    every chunkSize records. A string is the path of a trace store (see
+    trace_store.py). A function is called with the traces of each chunk.
+  @param chunkSize: (int) Number of records buffered before the traces are
+    written to the sink and the accuracies are computed.
+  @param traceSampling: (dict) Optional sampling period of the traces, keyed
+    by trace name. A trace with period n is only recorded every n records
+    (None for the other records). A trace with period 0 is dropped.
+  @return traces: (dict) Network traces if there is no trace sink. Otherwise,
+    the final classification results.
   """
 
   partitions = copy.deepcopy(networkPartitions)  # preserve original partitions
@@ -117,68 +132,40 @@ def trainNetwork(network, networkConfig, networkPartitions, numRecords,
 
   # Keep track of the regions that have been trained.
   trainedRegionNames = []
-
-  # Number of correctly classified records
-  numCorrectlyClassifiedRecords = 0
-  numCorrectlyClassifiedTestRecords = 0
-  numPoints = 0
-  numTestPoints = 0
+  isTesting = False
 
   # Network traces
-  sensorValueTrace = []
-  classificationAccuracyTrace = []
-  testClassificationAccuracyTrace = []
-  categoryTrace = []
-  tpActiveCellsTrace = []
-  tmActiveCellsTrace = []
-  tmPredictedActiveCellsTrace = []
-  predictedCategoryTrace = []
+  recorder = _TraceRecorder(traceSink, chunkSize, traceSampling, verbosity)
   for recordNumber in xrange(numRecords):
 
     # Run the network for a single iteration.
     network.run(1)
 
     if tpRegion:
-      tpActiveCells = tpRegion.getOutputData("mostActiveCells")
-      tpActiveCells = tpActiveCells.nonzero()[0]
-      tpActiveCellsTrace.append(tpActiveCells)
+      recorder.add(
+        "tpActiveCellsTrace", recordNumber,
+        lambda: tpRegion.getOutputData("mostActiveCells").nonzero()[0])
 
     if tmRegion:
-      tmPredictedActiveCells = tmRegion.getOutputData("predictedActiveCells")
-      tmPredictedActiveCells = tmPredictedActiveCells.nonzero()[0]
-      tmActiveCells = tmRegion.getOutputData("activeCells")
-      tmActiveCells = tmActiveCells.nonzero()[0]
-      tmActiveCellsTrace.append(tmActiveCells)
-      tmPredictedActiveCellsTrace.append(tmPredictedActiveCells)
-
-    sensorValueTrace.append(sensorRegion.getOutputData("sourceOut")[0])
+      recorder.add(
+        "tmActiveCellsTrace", recordNumber,
+        lambda: tmRegion.getOutputData("activeCells").nonzero()[0])
+      recorder.add(
+        "tmPredictiveActiveCellsTrace", recordNumber,
+        lambda: tmRegion.getOutputData("predictedActiveCells").nonzero()[0])
+
+    recorder.add("sensorValueTrace", recordNumber,
+                 lambda: sensorRegion.getOutputData("sourceOut")[0])
     inferredCategory = _getClassifierInference(classifierRegion)
-    predictedCategoryTrace.append(inferredCategory)
     actualCategory = sensorRegion.getOutputData("categoryOut")[0]
-    categoryTrace.append(actualCategory)
-    if actualCategory > 0:  # don't evaluate the noise (category = 0)
-      numPoints += 1
-      if actualCategory == inferredCategory:
-        numCorrectlyClassifiedRecords += 1
-      else:
-        if verbosity > 0:
-          _LOGGER.debug("recordNum=%s, actualCategory=%s, inferredCategory=%s"
-                        % (recordNumber, actualCategory, inferredCategory))
-      clfAccuracy = round(100.0 * numCorrectlyClassifiedRecords / numPoints, 2)
-      classificationAccuracyTrace.append(clfAccuracy)
-    else:
-      classificationAccuracyTrace.append(None)
 
     if trackTMmetrics:
-
-      activeColsTrace = tm.mmGetTraceActiveColumns()
-      predictedActiveColsTrace = tm.mmGetTracePredictedActiveColumns()
-
-      if tmRegion.getParameter("learningMode") and recordNumber % 100 == 0:
+      if (tmRegion.getParameter("learningMode") and
+          recordNumber % _TM_INSPECTION_WINDOW == 0):
         (avgPredictedActiveCols,
          avgPredictedInactiveCols,
          avgUnpredictedActiveCols) = _inspectTMPredictionQuality(
-          tm, numRecordsToInspect=100)
+          tm, numRecordsToInspect=_TM_INSPECTION_WINDOW)
         tmStats = ("recordNumber %4d # predicted -> active cols=%4.1f | "
                    "# predicted -> inactive cols=%4.1f | "
                    "# unpredicted -> active cols=%4.1f " % (
@@ -205,44 +192,303 @@ def trainNetwork(network, networkConfig, networkPartitions, numRecords,
                               partitionName,
                               recordNumber)
 
-    if recordNumber >= partitions[-1][1]:
+    if recordNumber >= partitions[-1][1] and not isTesting:
       # evaluate the predictions on the test set
-      # classifierConfig = networkConfig["classifierRegionConfig"]
       classifierRegion.setParameter("inferenceMode", True)
-      if actualCategory > 0:  # don't evaluate the noise (category = 0)
-        numTestPoints += 1
-        if actualCategory == inferredCategory:
-          numCorrectlyClassifiedTestRecords += 1
-        testClassificationAccuracy = round(
-          100.0 * numCorrectlyClassifiedTestRecords / numTestPoints, 2)
-        testClassificationAccuracyTrace.append(testClassificationAccuracy)
-      else:
-        testClassificationAccuracyTrace.append(None)
+      isTesting = True
+
+    recorder.addCategories(actualCategory, inferredCategory, isTesting)
+
+    if recorder.isFull() or recordNumber == numRecords - 1:
+      if trackTMmetrics and recorder.isStreaming():
+        # The monitor mixin keeps its own traces: move them to the sink too,
+        # but keep the records that _inspectTMPredictionQuality() reads.
+        _recordTMMetrics(recorder, tm)
+        _trimTMHistory(tm, _TM_INSPECTION_WINDOW)
+      recorder.flush()
+
+  recorder.close()
   _LOGGER.info("RESULTS: accuracy=%s | "
                "%s correctly classified records out of %s test records \n" %
-               (testClassificationAccuracyTrace[-1],
-                numCorrectlyClassifiedTestRecords,
-                numTestPoints))
-
-  traces = {
-    'predictedCategoryTrace': predictedCategoryTrace,
-    'classificationAccuracyTrace': classificationAccuracyTrace,
-    'testClassificationAccuracyTrace': testClassificationAccuracyTrace,
-    'sensorValueTrace': sensorValueTrace,
-    'categoryTrace': categoryTrace,
-    'tmActiveCellsTrace': tmActiveCellsTrace,
-    'tmPredictiveActiveCellsTrace': tmPredictedActiveCellsTrace,
-    'tpActiveCellsTrace': tpActiveCellsTrace
-  }
-
+               (recorder.lastTestAccuracy,
+                recorder.numCorrectlyClassifiedTestRecords,
+                recorder.numTestPoints))
+
+  if recorder.isStreaming():
+    return {
+      'classificationAccuracy': recorder.lastAccuracy,
+      'testClassificationAccuracy': recorder.lastTestAccuracy,
+      'numCorrectlyClassifiedTestRecords':
+        recorder.numCorrectlyClassifiedTestRecords,
+      'numTestPoints': recorder.numTestPoints
+    }
+
+  traces = recorder.traces
   if trackTMmetrics:
-    traces['activeColsTrace'] = activeColsTrace.data
-    traces['predictedActiveColsTrace'] = predictedActiveColsTrace.data
+    for traceName, getTrace in _TM_METRICS_TRACES:
+      if recorder.isRecorded(traceName):
+        traces[traceName] = recorder.sample(traceName, getTrace(tm).data)
 
   return traces
 
 
 
+# Number of records over which the TM prediction quality is inspected.
+_TM_INSPECTION_WINDOW = 100
+
+# Traces of the monitored TM, and how to get them from the monitor mixin.
+_TM_METRICS_TRACES = [
+  ('activeColsTrace', lambda tm: tm.mmGetTraceActiveColumns()),
+  ('predictedActiveColsTrace',
+   lambda tm: tm.mmGetTracePredictedActiveColumns()),
+]
+
+
+
+def _recordTMMetrics(recorder, tm):
+  """
+  Add the buffered records of the monitored TM traces to the trace recorder.
+  Column sets are converted to sorted arrays of column indices.
+
+  @param recorder: (_TraceRecorder) the trace recorder
+  @param tm: (MonitoredTemporalMemory) the TM instance
+  """
+  for traceName, getTrace in _TM_METRICS_TRACES:
+    if recorder.isRecorded(traceName):
+      data = getTrace(tm).data[-recorder.numBufferedRecords:]
+      recorder.extend(traceName,
+                      [numpy.array(sorted(columns), dtype="int32")
+                       for columns in data])
+
+
+
+def _trimTMHistory(tm, numRecords):
+  """
+  Drop the history of the monitored TM, except for its last numRecords
+  records. Like after mmClearHistory(), the transition traces (e.g. predicted
+  -> active columns) are recomputed from the remaining records when they are
+  read again.
+
+  @param tm: (MonitoredTemporalMemory) the TM instance
+  @param numRecords: (int) number of records to keep
+  """
+  for trace in tm._mmTraces.values():
+    del trace.data[:-numRecords]
+  tm._mmTransitionTracesStale = True
+
+
+
+class _TraceRecorder(object):
+  """
+  Buffer the network traces of trainNetwork() and write them to a trace sink
+  every chunkSize records. The classification accuracies of the buffered
+  records are computed at once when the buffer is flushed.
+
+  Without a trace sink, the traces are kept in memory (see traces). In this
+  case testClassificationAccuracyTrace only has the test records, otherwise it
+  is None for the training records.
+  """
+
+
+  def __init__(self, traceSink, chunkSize, traceSampling, verbosity):
+    if isinstance(traceSink, basestring):
+      self._writer = TraceWriter(traceSink, chunkSize)
+      self._sink = self._writer.extend
+    elif isinstance(traceSink, TraceWriter):
+      self._writer = None
+      self._sink = traceSink.extend
+    else:
+      self._writer = None
+      self._sink = traceSink
+    self.chunkSize = chunkSize
+    self.verbosity = verbosity
+    self._sampling = traceSampling or {}
+
+    self.traces = {name: [] for name in _TRACE_NAMES
+                   if self.isRecorded(name)}
+    self._chunk = {name: [] for name in self.traces}
+    self._actualCategories = []
+    self._inferredCategories = []
+    self._isTest = numpy.zeros(chunkSize, dtype=bool)
+    self.numBufferedRecords = 0
+    self.numRecords = 0
+
+    # Number of correctly classified records
+    self.numCorrectlyClassifiedRecords = 0
+    self.numCorrectlyClassifiedTestRecords = 0
+    self.numPoints = 0
+    self.numTestPoints = 0
+    self.lastAccuracy = None
+    self.lastTestAccuracy = None
+
+
+  def isStreaming(self):
+    return self._sink is not None
+
+
+  def isFull(self):
+    return self.numBufferedRecords >= self.chunkSize
+
+
+  def isRecorded(self, traceName, recordNumber=None):
+    """
+    @param traceName: (str) name of the trace
+    @param recordNumber: (int) record number. If None, check whether the
+      trace is recorded at all.
+    """
+    period = self._sampling.get(traceName, 1)
+    if not period:
+      return False
+    return recordNumber is None or recordNumber % period == 0
+
+
+  def sample(self, traceName, values, firstRecordNumber=0):
+    """
+    Replace the values of the records that are not sampled by None.
+    """
+    period = self._sampling.get(traceName, 1)
+    if period == 1:
+      return list(values)
+    return [v if (firstRecordNumber + i) % period == 0 else None
+            for i, v in enumerate(values)]
+
+
+  def add(self, traceName, recordNumber, getValue):
+    """
+    Add the value of a trace for the current record. getValue is only called
+    if the trace is recorded for this record.
+    """
+    if traceName not in self._chunk:
+      return
+    if self.isRecorded(traceName, recordNumber):
+      self._chunk[traceName].append(getValue())
+    else:
+      self._chunk[traceName].append(None)
+
+
+  def extend(self, traceName, values):
+    """
+    Add the values of a trace for all the buffered records.
+    """
+    self._chunk[traceName] = self.sample(traceName, values, self.numRecords)
+
+
+  def addCategories(self, actualCategory, inferredCategory, isTest):
+    self._actualCategories.append(actualCategory)
+    self._inferredCategories.append(inferredCategory)
+    self._isTest[self.numBufferedRecords] = isTest
+    self.numBufferedRecords += 1
+
+
+  def flush(self):
+    """
+    Compute the classification accuracies of the buffered records, then write
+    their traces to the sink.
+    """
+    n = self.numBufferedRecords
+    actualCategories = numpy.array(self._actualCategories, dtype=float)
+    inferredCategories = numpy.array(self._inferredCategories, dtype=float)
+    isTest = self._isTest[:n]
+
+    # don't evaluate the noise (category = 0)
+    evaluated = actualCategories > 0
+    correct = evaluated & (actualCategories == inferredCategories)
+    if self.verbosity > 0:
+      for i in numpy.flatnonzero(evaluated & ~correct):
+        _LOGGER.debug("recordNum=%s, actualCategory=%s, inferredCategory=%s"
+                      % (self.numRecords + i, actualCategories[i],
+                         inferredCategories[i]))
+
+    accuracies = _cumulativeAccuracies(evaluated, correct,
+                                       self.numPoints,
+                                       self.numCorrectlyClassifiedRecords)
+    testEvaluated = evaluated & isTest
+    testAccuracies = _cumulativeAccuracies(
+      testEvaluated, correct & isTest,
+      self.numTestPoints, self.numCorrectlyClassifiedTestRecords)
+
+    self.numPoints += int(evaluated.sum())
+    self.numCorrectlyClassifiedRecords += int(correct.sum())
+    self.numTestPoints += int(testEvaluated.sum())
+    self.numCorrectlyClassifiedTestRecords += int((correct & isTest).sum())
+    if n > 0:
+      self.lastAccuracy = accuracies[-1]
+    if isTest.any():
+      self.lastTestAccuracy = testAccuracies[numpy.flatnonzero(isTest)[-1]]
+
+    if self.isStreaming():
+      testAccuracies = [a if t else None
+                        for a, t in zip(testAccuracies, isTest)]
+    else:
+      testAccuracies = [a for a, t in zip(testAccuracies, isTest) if t]
+    categoryTraces = {
+      'predictedCategoryTrace': self._inferredCategories,
+      'categoryTrace': self._actualCategories,
+      'classificationAccuracyTrace': accuracies,
+      'testClassificationAccuracyTrace': testAccuracies,
+    }
+    for traceName, values in categoryTraces.iteritems():
+      if traceName in self._chunk:
+        self.extend(traceName, values)
+
+    if self.isStreaming():
+      chunk = {name: values for name, values in self._chunk.iteritems()
+               if len(values) > 0}
+      chunk['step'] = range(self.numRecords, self.numRecords + n)
+      self._sink(chunk)
+    else:
+      for traceName, values in self._chunk.iteritems():
+        self.traces[traceName].extend(values)
+
+    self._chunk = {name: [] for name in self.traces}
+    self._actualCategories = []
+    self._inferredCategories = []
+    self.numRecords += n
+    self.numBufferedRecords = 0
+
+
+  def close(self):
+    if self.numBufferedRecords > 0:
+      self.flush()
+    if self._writer is not None:
+      self._writer.close()
+
+
+
+# Traces recorded by trainNetwork(), in addition to the TM metrics traces.
+_TRACE_NAMES = [
+  'predictedCategoryTrace',
+  'classificationAccuracyTrace',
+  'testClassificationAccuracyTrace',
+  'sensorValueTrace',
+  'categoryTrace',
+  'tmActiveCellsTrace',
+  'tmPredictiveActiveCellsTrace',
+  'tpActiveCellsTrace'
+]
+
+
+
+def _cumulativeAccuracies(evaluated, correct, numPoints, numCorrect):
+  """
+  Running classification accuracy (in %) of a chunk of records.
+
+  @param evaluated: (np.array) boolean mask of the evaluated records
+  @param correct: (np.array) boolean mask of the correctly classified records
+  @param numPoints: (int) number of records evaluated before the chunk
+  @param numCorrect: (int) number of records correctly classified before the
+    chunk
+  @return: (list) accuracy after each record. None for the records that are
+    not evaluated.
+  """
+  cumPoints = numPoints + numpy.cumsum(evaluated)
+  cumCorrect = numCorrect + numpy.cumsum(correct)
+  accuracies = 100.0 * cumCorrect / numpy.maximum(cumPoints, 1)
+  return [round(a, 2) if e else None
+          for a, e in zip(accuracies.tolist(), evaluated)]
+
+
+
 def _getClassifierInference(classifierRegion):
   """Return output categories from the classifier region."""
   if classifierRegion.type == "py.KNNClassifierRegion":
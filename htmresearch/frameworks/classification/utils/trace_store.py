@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2017, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Columnar binary storage for network traces.
+
+A trace store is a directory with one binary file per column:
+- Scalar traces (e.g. sensorValueTrace) are typed arrays: int64, bool or
+  float64 after the type of their values.
+- Activity traces (e.g. tmActiveCellsTrace) are concatenated int32 cell
+  indices, with one int64 end offset per row.
+Each column also has a uint8 validity array, to store None values. The
+column types and number of rows are in a JSON metadata file.
+
+Rows can be appended while the network runs (TraceWriter) and the columns are
+read back through memory-mapped views (TraceStore).
+"""
+
+import csv
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+
+TRACE_STORE_EXTENSION = ".traces"
+METADATA_FILE = "metadata.json"
+SCALAR = "scalar"
+ACTIVITY = "activity"
+DEFAULT_SCALAR_DTYPE = "float64"
+INDEX_DTYPE = "int32"
+OFFSET_DTYPE = "int64"
+
+
+
+def isTraceStore(path):
+  """
+  @param path: (str) path to a trace file or trace store
+  @return: (bool) whether the path is a trace store directory
+  """
+  return os.path.isfile(os.path.join(path, METADATA_FILE))
+
+
+
+def _isActivity(value):
+  return isinstance(value, (list, tuple, np.ndarray))
+
+
+
+def _scalarDtype(value):
+  """
+  @return: (str) dtype of a scalar column for a value: bool, int64 for
+    integers and float64 otherwise.
+  """
+  if isinstance(value, (bool, np.bool_)):
+    return "bool"
+  if isinstance(value, (int, long, np.integer)):
+    return "int64"
+  return DEFAULT_SCALAR_DTYPE
+
+
+
+class TraceWriter(object):
+  """
+  Append network traces to a trace store. Rows are buffered and written to
+  disk every chunkSize rows, so memory usage does not grow with the number of
+  records.
+  """
+
+
+  def __init__(self, path, chunkSize=1000, dtypes=None):
+    """
+    @param path: (str) path of the trace store directory. If the store
+      already exists, new rows are appended to it.
+    @param chunkSize: (int) number of rows buffered before they are written
+    @param dtypes: (dict) optional numpy dtype of scalar columns. By default,
+      a scalar column is typed after its values: bool, int64 for integers
+      and float64 otherwise. It is promoted (e.g. from int64 to float64) if
+      later values need it.
+    """
+    self.path = path
+    self.chunkSize = chunkSize
+    self._dtypes = dtypes or {}
+    if isTraceStore(path):
+      with open(os.path.join(path, METADATA_FILE)) as f:
+        metadata = json.load(f)
+      self._columns = {str(name): column
+                       for name, column in metadata["columns"].iteritems()}
+      self.numRows = metadata["numRows"]
+    else:
+      if not os.path.exists(path):
+        os.makedirs(path)
+      self._columns = {}
+      self.numRows = 0
+    self._truncate()
+    self._buffers = {name: [] for name in self._columns}
+    self._numBufferedRows = 0
+    # Columns that only had None values so far.
+    self._untypedColumns = set()
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, *args):
+    self.close()
+
+
+  def append(self, row):
+    """
+    Append one row of traces.
+
+    @param row: (dict) values of the traces for this row. Keys are column
+      names. Missing columns and None values are stored as invalid.
+    """
+    for name, value in row.iteritems():
+      if name not in self._buffers:
+        if value is None:
+          # The column type is not known yet; it is added with its first
+          # value and back-filled with None.
+          self._untypedColumns.add(name)
+          continue
+        self._addColumn(name, value)
+      self._buffers[name].append(value)
+    self._numBufferedRows += 1
+    for name in self._buffers:
+      if len(self._buffers[name]) < self._numBufferedRows:
+        self._buffers[name].append(None)
+    if self._numBufferedRows >= self.chunkSize:
+      self.flush()
+
+
+  def extend(self, traces):
+    """
+    Append several rows of traces, given as columns.
+
+    @param traces: (dict) list of values of each trace. Shorter lists are
+      padded with None, like saveTraces() does.
+    """
+    numRows = max([len(values) for values in traces.values()] + [0])
+    for name, values in traces.iteritems():
+      if name not in self._buffers:
+        firstValue = next((v for v in values if v is not None), None)
+        self._addColumn(name, firstValue)
+      self._buffers[name].extend(values)
+      self._buffers[name].extend([None] * (numRows - len(values)))
+    self._numBufferedRows += numRows
+    for name in self._buffers:
+      missing = self._numBufferedRows - len(self._buffers[name])
+      self._buffers[name].extend([None] * missing)
+    if self._numBufferedRows >= self.chunkSize:
+      self.flush()
+
+
+  def flush(self):
+    """
+    Write the buffered rows to disk and update the metadata.
+    """
+    for name in self._untypedColumns:
+      if name not in self._buffers:
+        self._addColumn(name, None)
+    self._untypedColumns = set()
+    self._promoteScalarColumns()
+
+    for name, values in self._buffers.iteritems():
+      column = self._columns[name]
+      valid = np.array([v is not None for v in values], dtype="uint8")
+      self._write(name, "valid", valid)
+      if column["kind"] == ACTIVITY:
+        indices = [np.asarray(v, dtype=INDEX_DTYPE).ravel()
+                   if v is not None else np.zeros(0, dtype=INDEX_DTYPE)
+                   for v in values]
+        lengths = np.array([len(v) for v in indices], dtype=OFFSET_DTYPE)
+        offsets = column["numIndices"] + np.cumsum(lengths)
+        if len(indices) > 0:
+          self._write(name, "indices", np.concatenate(indices))
+        self._write(name, "offsets", offsets)
+        column["numIndices"] += int(lengths.sum())
+      else:
+        scalars = np.array([v if v is not None else 0 for v in values],
+                           dtype=column["dtype"])
+        self._write(name, "values", scalars)
+      self._buffers[name] = []
+
+    self.numRows += self._numBufferedRows
+    self._numBufferedRows = 0
+    self._writeMetadata()
+
+
+  def close(self):
+    self.flush()
+
+
+  def _addColumn(self, name, value):
+    """
+    Add a column, typed after its first value. The rows that are already
+    written are invalid for this column.
+    """
+    if name not in self._columns:
+      if _isActivity(value):
+        column = {"kind": ACTIVITY, "dtype": INDEX_DTYPE, "numIndices": 0}
+      elif value is None:
+        # No value yet: bool is promoted to the type of the first values.
+        column = {"kind": SCALAR, "dtype": self._dtypes.get(name, "bool")}
+      else:
+        column = {"kind": SCALAR,
+                  "dtype": self._dtypes.get(name, _scalarDtype(value))}
+      self._columns[name] = column
+      if self.numRows > 0:
+        self._write(name, "valid", np.zeros(self.numRows, dtype="uint8"))
+        if column["kind"] == ACTIVITY:
+          self._write(name, "offsets",
+                      np.zeros(self.numRows, dtype=OFFSET_DTYPE))
+        else:
+          self._write(name, "values",
+                      np.zeros(self.numRows, dtype=column["dtype"]))
+    self._buffers[name] = [None] * self._numBufferedRows
+
+
+  def _promoteScalarColumns(self):
+    """
+    Promote the type of the scalar columns whose buffered values need it, e.g.
+    an int64 column with float values. The values that are already written
+    are converted, and the metadata is updated before any new row is written.
+    """
+    promoted = False
+    for name, values in self._buffers.iteritems():
+      column = self._columns[name]
+      if column["kind"] != SCALAR or name in self._dtypes:
+        continue
+      dtype = np.result_type(column["dtype"], *set(
+        _scalarDtype(v) for v in values if v is not None)).name
+      if dtype == column["dtype"]:
+        continue
+      if self.numRows > 0:
+        filePath = os.path.join(self.path, "%s.values" % name)
+        written = np.fromfile(filePath, dtype=column["dtype"],
+                              count=self.numRows)
+        with open(filePath + ".tmp", "wb") as f:
+          written.astype(dtype).tofile(f)
+        os.rename(filePath + ".tmp", filePath)
+      column["dtype"] = dtype
+      promoted = True
+    if promoted:
+      self._writeMetadata()
+
+
+  def _writeMetadata(self):
+    tmpPath = os.path.join(self.path, METADATA_FILE + ".tmp")
+    with open(tmpPath, "w") as f:
+      json.dump({"numRows": self.numRows, "columns": self._columns}, f)
+    os.rename(tmpPath, os.path.join(self.path, METADATA_FILE))
+
+
+  def _truncate(self):
+    """
+    Drop the rows of an interrupted flush. The column files are written
+    before the metadata, so they are truncated to the number of rows and
+    indices of the metadata, and the files of columns that are not in the
+    metadata are removed.
+    """
+    for fileName in os.listdir(self.path):
+      name, _, part = fileName.rpartition(".")
+      if part not in ("valid", "values", "offsets", "indices"):
+        continue
+      filePath = os.path.join(self.path, fileName)
+      column = self._columns.get(name)
+      if column is None:
+        os.remove(filePath)
+        continue
+      if part == "valid":
+        size = self.numRows
+      elif part == "values":
+        size = self.numRows * np.dtype(column["dtype"]).itemsize
+      elif part == "offsets":
+        size = self.numRows * np.dtype(OFFSET_DTYPE).itemsize
+      else:
+        size = column["numIndices"] * np.dtype(INDEX_DTYPE).itemsize
+      if os.path.getsize(filePath) != size:
+        with open(filePath, "r+b") as f:
+          f.truncate(size)
+
+
+  def _write(self, name, part, array):
+    with open(os.path.join(self.path, "%s.%s" % (name, part)), "ab") as f:
+      array.tofile(f)
+
+
+
+class TraceStore(object):
+  """
+  Read-only access to a trace store. The columns are memory-mapped: scalar
+  columns and activity indices are returned as views on the files, without
+  copies.
+  """
+
+
+  def __init__(self, path, mmapMode="r"):
+    """
+    @param path: (str) path of the trace store directory
+    @param mmapMode: (str) numpy memmap mode. None to read the columns in
+      memory.
+    """
+    self.path = path
+    self.mmapMode = mmapMode
+    with open(os.path.join(path, METADATA_FILE)) as f:
+      metadata = json.load(f)
+    self.numRows = metadata["numRows"]
+    self._columns = {str(name): column
+                     for name, column in metadata["columns"].iteritems()}
+    self._arrays = {}
+
+
+  @property
+  def columns(self):
+    return self._columns.keys()
+
+
+  def isActivity(self, name):
+    return self._columns[name]["kind"] == ACTIVITY
+
+
+  def valid(self, name):
+    """
+    @return: (np.array) boolean mask of the rows that are not None
+    """
+    return self._array(name, "valid", "uint8", self.numRows).view(np.bool_)
+
+
+  def scalars(self, name):
+    """
+    @return: (np.array) values of a scalar column. Invalid rows are 0.
+    """
+    column = self._columns[name]
+    return self._array(name, "values", column["dtype"], self.numRows)
+
+
+  def activity(self, name):
+    """
+    @return indices: (np.array) int32 cell indices of all the rows
+    @return offsets: (np.array) int64 start offset of each row in indices,
+      followed by the end offset of the last row.
+    """
+    column = self._columns[name]
+    indices = self._array(name, "indices", INDEX_DTYPE, column["numIndices"])
+    endOffsets = self._array(name, "offsets", OFFSET_DTYPE, self.numRows)
+    offsets = np.zeros(self.numRows + 1, dtype=OFFSET_DTYPE)
+    offsets[1:] = endOffsets
+    return indices, offsets
+
+
+  def getColumn(self, name):
+    """
+    Same format as loadTraces(): a list with None for invalid rows. Activity
+    rows are views on the cell indices.
+    """
+    valid = self.valid(name)
+    if self.isActivity(name):
+      indices, offsets = self.activity(name)
+      return [indices[offsets[i]:offsets[i + 1]] if valid[i] else None
+              for i in xrange(self.numRows)]
+    scalars = self.scalars(name)
+    return [scalars[i].item() if valid[i] else None
+            for i in xrange(self.numRows)]
+
+
+  def toDict(self):
+    """
+    @return traces: (dict) network traces, in the format of loadTraces().
+    """
+    return {name: self.getColumn(name) for name in self.columns}
+
+
+  def _array(self, name, part, dtype, length):
+    key = (name, part)
+    if key not in self._arrays:
+      filePath = os.path.join(self.path, "%s.%s" % (name, part))
+      if length == 0:
+        array = np.zeros(0, dtype=dtype)
+      elif self.mmapMode is None:
+        array = np.fromfile(filePath, dtype=dtype, count=length)
+      else:
+        array = np.memmap(filePath, dtype=dtype, mode=self.mmapMode,
+                          shape=(length,))
+      self._arrays[key] = array
+    return self._arrays[key]
+
+
+
+def saveTraceStore(traces, path, chunkSize=1000, overwrite=False):
+  """
+  Save network traces (see saveTraces()) to a new trace store.
+
+  @param traces: (dict) network traces. E.g: activeCells, sensorValues, etc.
+  @param path: (str) path of the trace store directory
+  @param overwrite: (bool) whether to replace an existing trace store at path,
+    instead of raising a ValueError
+  """
+  if isTraceStore(path):
+    if not overwrite:
+      raise ValueError("Trace store %s already exists" % path)
+    shutil.rmtree(path)
+  numRows = max([len(values) for values in traces.values()] + [0])
+  with TraceWriter(path, chunkSize) as writer:
+    for start in xrange(0, numRows, chunkSize):
+      writer.extend({name: values[start:start + chunkSize]
+                     for name, values in traces.iteritems()})
+
+
+
+def convertCsvTraces(csvFileName, path, chunkSize=1000):
+  """
+  Convert CSV traces (see saveTraces()) to a trace store. The CSV rows are
+  streamed, so the whole CSV file is never held in memory.
+
+  @param csvFileName: (str) path to the CSV traces
+  @param path: (str) path of the new trace store directory
+  """
+  if isTraceStore(path):
+    raise ValueError("Trace store %s already exists" % path)
+
+  csv.field_size_limit(sys.maxsize)
+  with open(csvFileName, "rb") as fr, TraceWriter(path, chunkSize) as writer:
+    reader = csv.reader(fr)
+    headers = reader.next()
+    for row in reader:
+      writer.append({headers[i]: json.loads(row[i]) if row[i] != "" else None
+                     for i in xrange(len(row))})
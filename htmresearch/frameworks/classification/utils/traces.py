@@ -29,6 +29,9 @@ import os
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 
+from htmresearch.frameworks.classification.utils.trace_store import (
+  TRACE_STORE_EXTENSION, TraceStore, isTraceStore, saveTraceStore)
+
 
 
 def constructStableIntervals(confidence):
@@ -210,10 +213,19 @@ def plotTraces(xlim, traces, title, anomalyScoreType,
 
 def saveTraces(traces, fileName):
   """
-  Save netwrok traces to CSV
+  Save netwrok traces to CSV, or to a columnar trace store if the file name
+  ends with TRACE_STORE_EXTENSION (see trace_store.py). An existing file or
+  trace store is replaced.
   :param traces: (dict) network traces. E.g: activeCells, sensorValues, etc.
   :param fileName: (str) name of the file
   """
+  if fileName.endswith(TRACE_STORE_EXTENSION):
+    numRows = len(traces['sensorValueTrace'])
+    storeTraces = {t: traces[t][:numRows] for t in traces.keys()}
+    storeTraces['step'] = range(numRows)
+    saveTraceStore(storeTraces, fileName, overwrite=True)
+    return
+
   with open(fileName, 'wb') as fw:
     writer = csv.writer(fw)
     headers = ['step'] + traces.keys()
@@ -236,10 +248,13 @@ def saveTraces(traces, fileName):
 
 def loadTraces(fileName):
   """
-  Load network traces from CSV
+  Load network traces from CSV, or from a trace store (see trace_store.py).
+  Activity traces loaded from a trace store are memory-mapped arrays.
   :param fileName: (str) name of the file
   :return traces: (dict) network traces. E.g: activeCells, sensorValues, etc.
   """
+  if isTraceStore(fileName):
+    return TraceStore(fileName).toDict()
 
   csv.field_size_limit(sys.maxsize)
 
@@ -57,8 +57,8 @@ def project_in_2D(distance_mat, method='mds'):
 
 
 
-def project_matrix(mat):
-  tsne = TSNE(n_iter=1000, metric='precomputed', init='random')
+def project_matrix(mat, n_iter=1000):
+  tsne = TSNE(n_iter=n_iter, metric='precomputed', init='random')
   return tsne.fit_transform(mat)
 
 
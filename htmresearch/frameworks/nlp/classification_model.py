@@ -19,7 +19,6 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
-from collections import defaultdict
 import cPickle as pkl
 import numpy
 import os
@@ -70,6 +69,15 @@ class ClassificationModel(object):
       "correctSpell": True
     }
 
+    # Pattern to partition index of the classifier, see _getPartitionIndex()
+    self._partitionIndex = None
+
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    # Rebuilt on the first inference, see _getPartitionIndex()
+    state["_partitionIndex"] = None
+    return state
 
 
   ################## CORE METHODS #####################
@@ -113,6 +121,46 @@ class ClassificationModel(object):
         token, labels, sampleId, resetSequence=int(i == lastTokenIndex))
 
 
+  def trainDocuments(self, documents, tokenIdFactor=None, batchSize=1000):
+    """
+    Train the model with several documents. The documents are tokenized and
+    trained in batches of tokens (see _trainTokenBatch()), so that subclasses
+    can encode a whole batch at once and add its patterns to the classifier
+    together. As with trainDocument(), a reset is issued after each document.
+
+    @param documents     (iterable) (document, labels, sampleId) tuples, see
+                                    trainDocument().
+    @param tokenIdFactor (int)      If None, the tokens are trained with the
+                                    sampleId of their document. Otherwise each
+                                    token is trained with the ID
+                                    sampleId * tokenIdFactor + the index of
+                                    its word in the document (from the
+                                    tokenizer mapping).
+    @param batchSize     (int)      Minimum number of tokens per batch; the
+                                    last batch may be smaller.
+    """
+    batch = []
+    numTokens = 0
+    for document, labels, sampleId in documents:
+      assert (sampleId is not None), "Must pass in a sampleId"
+      tokenList, mapping = self.tokenize(document)
+      if tokenIdFactor is None:
+        tokenIds = [sampleId] * len(tokenList)
+      else:
+        tokenIds = [sampleId * tokenIdFactor + wordIndex
+                    for wordIndex in mapping[:len(tokenList)]]
+      batch.append((tokenList, labels, tokenIds))
+      numTokens += len(tokenList)
+
+      if numTokens >= batchSize:
+        self._trainTokenBatch(batch)
+        batch = []
+        numTokens = 0
+
+    if batch:
+      self._trainTokenBatch(batch)
+
+
   def inferToken(self, token, resetSequence=0, returnDetailedResults=False,
                  sortResults=True):
     """
@@ -394,6 +442,41 @@ class ClassificationModel(object):
     pass
 
 
+  def _trainTokenBatch(self, documents):
+    """
+    Protected method that is called by trainDocuments() with a batch of
+    tokenized documents. The default implementation trains on each token with
+    trainToken(), with a reset after each document. Subclasses can override it
+    to encode the batch in one go.
+
+    @param documents (list) (tokenList, labels, tokenIds) tuples, with the ID
+                            of each token of the document.
+    """
+    for tokenList, labels, tokenIds in documents:
+      lastTokenIndex = len(tokenList) - 1
+      for i, (token, tokenId) in enumerate(zip(tokenList, tokenIds)):
+        self.trainToken(
+          token, labels, tokenId, resetSequence=int(i == lastTokenIndex))
+
+
+  def _learnPatterns(self, bitmaps, categories, partitionIds, n):
+    """
+    Add the sparse patterns of a batch to the classifier of the model, in
+    order.
+
+    @param bitmaps      (list) Sorted indices of the active bits of each
+                               pattern.
+    @param categories   (list) Category of each pattern.
+    @param partitionIds (list) Partition ID of each pattern.
+    @param n            (int)  Number of bits of the patterns.
+    """
+    self._invalidatePartitionIndex()
+    classifier = self.getClassifier()
+    for bitmap, category, partitionId in zip(bitmaps, categories,
+                                             partitionIds):
+      classifier.learn(bitmap, category, isSparse=n, partitionId=partitionId)
+
+
   def _inferDocumentDetailed(self, tokenList, sortResults=True):
     """
     Run inference on the model with this list of tokens and return classification
@@ -422,7 +505,8 @@ class ClassificationModel(object):
 
     classifier = self.getClassifier()
     lastTokenIndex = len(tokenList) - 1
-    distancesForEachId = defaultdict(float)
+    protoIdList = []
+    distanceToProtoIds = numpy.zeros(0)
     voteTotals = numpy.zeros(self.numLabels)
     count = 0
     for i, token in enumerate(tokenList):
@@ -442,34 +526,75 @@ class ClassificationModel(object):
           distances[numpy.where(distances != 0)] = 1.0
 
         # For each prototype id (in the classifier), add the distance to this
-        # inference token. When there are multiple prototypes per id, we use the
-        # total add the minimum distance among the prototypes
-        for protoId in set(idList):
-          patternIds = classifier.getPatternIndicesWithPartitionId(protoId)
-          distancesForEachId[protoId] += distances[patternIds].min()
+        # inference token. When there are multiple prototypes per id, we add
+        # the minimum distance among the prototypes
+        (protoIdList,
+         patternOrder,
+         partitionStarts) = self._getPartitionIndex(classifier, idList)
+        if len(distanceToProtoIds) != len(protoIdList):
+          distanceToProtoIds = numpy.zeros(len(protoIdList))
+        distanceToProtoIds += numpy.minimum.reduceat(
+          numpy.asarray(distances)[patternOrder], partitionStarts)
 
     if count:
       # Normalize for the number of inferred tokens that yielded results
       normalizedVotes = voteTotals / float(count)
-      for protoId, dist in distancesForEachId.iteritems():
-        distancesForEachId[protoId] = dist / float(count)
+      distanceToProtoIds /= float(count)
     else:
       normalizedVotes = voteTotals
 
-    # Put distance from each prototype id to this document into a numpy array
-    # ordered consistently with a list of protoIds
-    protoIdList = distancesForEachId.keys()
-    distanceToProtoIds = numpy.zeros(len(protoIdList))
-    for i, protoId in enumerate(protoIdList):
-      distanceToProtoIds[i] = distancesForEachId.get(protoId, numpy.inf)
-
     # Sort the results if requested
     if sortResults:
-      sortedIndices = distanceToProtoIds.argsort()
+      sortedIndices = distanceToProtoIds.argsort(kind="mergesort")
       sortedDistances = distanceToProtoIds[sortedIndices]
       sortedIdList = [protoIdList[i] for i in sortedIndices]
 
       return normalizedVotes, sortedIdList, sortedDistances
 
     else:
-      return normalizedVotes, protoIdList, distanceToProtoIds
+      return normalizedVotes, list(protoIdList), distanceToProtoIds
+
+
+  def _invalidatePartitionIndex(self):
+    """
+    Protected method that must be called whenever the patterns of the
+    classifier are added, removed or relabeled, so that the next inference
+    rebuilds the partition index (see _getPartitionIndex()).
+    """
+    self._partitionIndex = None
+
+
+  def _getPartitionIndex(self, classifier, idList):
+    """
+    Index of the partition (prototype id) of each pattern of the classifier,
+    so that the distances to the patterns are reduced per prototype id in one
+    call. The index is only rebuilt after _invalidatePartitionIndex(), or
+    when the number of patterns of the classifier changes.
+
+    @param classifier (KNNClassifier) The classifier of the model.
+    @param idList     (list)          Prototype id of each pattern, as
+                                      returned by inferToken() when the results
+                                      are not sorted.
+
+    @return protoIdList     (list)        Unique prototype ids.
+            patternOrder    (numpy array) Pattern indices, grouped by prototype
+                                          id in the order of protoIdList.
+            partitionStarts (numpy array) Start of the patterns of each
+                                          prototype id in patternOrder.
+    """
+    key = (id(classifier), classifier._numPatterns)
+    partitionIndex = getattr(self, "_partitionIndex", None)
+    if partitionIndex is None or partitionIndex[0] != key:
+      partitions = {}
+      patternPartitions = numpy.array(
+        [partitions.setdefault(protoId, len(partitions)) for protoId in idList],
+        dtype=numpy.int64)
+      protoIdList = [None] * len(partitions)
+      for protoId, partition in partitions.iteritems():
+        protoIdList[partition] = protoId
+      patternOrder = numpy.argsort(patternPartitions, kind="mergesort")
+      partitionStarts = numpy.searchsorted(patternPartitions[patternOrder],
+                                           numpy.arange(len(partitions)))
+      partitionIndex = (key, protoIdList, patternOrder, partitionStarts)
+      self._partitionIndex = partitionIndex
+    return partitionIndex[1:]
@@ -126,6 +126,7 @@ class ClassificationModelDocumentFingerprint(ClassificationNetworkAPI):
       sensor.addDataToQueue(token=document, categoryList=labels,
                             sequenceId=sampleId, reset=resetSequence)
 
+      self._invalidatePartitionIndex()
       for region in self.learningRegions:
         region.setParameter("learningMode", True)
       self.network.run(1)
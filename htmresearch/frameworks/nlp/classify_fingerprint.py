@@ -95,6 +95,7 @@ class ClassificationModelFingerprint(ClassificationModel):
         print "CioFP model training with: '{}'".format(document)
         print "\tBitmap:", bitmap
 
+      self._invalidatePartitionIndex()
       for label in labels:
         self.classifier.learn(
             bitmap, label, isSparse=self.encoder.n, partitionId=sampleId)
@@ -102,6 +103,36 @@ class ClassificationModelFingerprint(ClassificationModel):
       self.currentDocument = None
 
 
+  def _trainTokenBatch(self, documents):
+    """
+    Train the model with a batch of tokenized documents: the documents are
+    encoded together and their patterns are added to the classifier at once.
+    As in trainToken(), a document is trained with the sampleId of its last
+    token.
+
+    See base class for description of parameters.
+    """
+    if self.verbosity >= 2 or self.currentDocument is not None:
+      super(ClassificationModelFingerprint, self)._trainTokenBatch(documents)
+      return
+
+    documents = [document for document in documents if document[0]]
+    encodings = self.encoder.encodeMany(
+      [" ".join(tokenList) for tokenList, _, _ in documents])
+
+    bitmaps = []
+    categories = []
+    partitionIds = []
+    for (_, labels, tokenIds), encoding in zip(documents, encodings):
+      bitmap = encoding["fingerprint"]["positions"]
+      for label in labels:
+        bitmaps.append(bitmap)
+        categories.append(label)
+        partitionIds.append(tokenIds[-1])
+
+    self._learnPatterns(bitmaps, categories, partitionIds, self.encoder.n)
+
+
   def inferToken(self, token, resetSequence=0, returnDetailedResults=False,
                  sortResults=True):
     """
@@ -79,6 +79,7 @@ class ClassificationModelHTM(ClassificationNetworkAPI):
 
     See base class for description of parameters.
     """
+    self._invalidatePartitionIndex()
     for region in self.learningRegions:
       region.setParameter("learningMode", True)
     sensor = self.sensorRegion.getSelf()
@@ -97,6 +98,35 @@ class ClassificationModelHTM(ClassificationNetworkAPI):
       self.reset()
 
 
+  def _trainTokenBatch(self, documents):
+    """
+    Train the model with a batch of tokenized documents: all the tokens are
+    queued in the sensor and the network is run once for the whole batch.
+
+    See base class for description of parameters.
+    """
+    if self.verbosity >= 2:
+      super(ClassificationModelHTM, self)._trainTokenBatch(documents)
+      return
+
+    self._invalidatePartitionIndex()
+    for region in self.learningRegions:
+      region.setParameter("learningMode", True)
+    sensor = self.sensorRegion.getSelf()
+    numTokens = 0
+    for tokenList, labels, tokenIds in documents:
+      lastTokenIndex = len(tokenList) - 1
+      for i, (token, tokenId) in enumerate(zip(tokenList, tokenIds)):
+        sensor.addDataToQueue(token,
+                              categoryList=labels,
+                              sequenceId=tokenId,
+                              reset=int(i == lastTokenIndex))
+      numTokens += len(tokenList)
+
+    if numTokens > 0:
+      self.network.run(numTokens)
+
+
   def inferToken(self, token, resetSequence=0, returnDetailedResults=False,
                  sortResults=True):
     """
@@ -65,6 +65,7 @@ class ClassificationModelKeywords(ClassificationModel):
 
     See base class for description of parameters.
     """
+    self._invalidatePartitionIndex()
     bitmap = self._encodeToken(token)
     if self.verbosity >= 2:
       print "Keywords training with:",token
@@ -77,6 +78,33 @@ class ClassificationModelKeywords(ClassificationModel):
                             partitionId=tokenId)
 
 
+  def _trainTokenBatch(self, documents):
+    """
+    Train the model with a batch of tokenized documents: each distinct token
+    is encoded once and all the patterns are added to the classifier at once.
+
+    See base class for description of parameters.
+    """
+    if self.verbosity >= 2:
+      super(ClassificationModelKeywords, self)._trainTokenBatch(documents)
+      return
+
+    encodings = {}
+    bitmaps = []
+    categories = []
+    partitionIds = []
+    for tokenList, labels, tokenIds in documents:
+      for token, tokenId in zip(tokenList, tokenIds):
+        if token not in encodings:
+          encodings[token] = self._encodeToken(token)
+        for label in labels:
+          bitmaps.append(encodings[token])
+          categories.append(label)
+          partitionIds.append(tokenId)
+
+    self._learnPatterns(bitmaps, categories, partitionIds, self.n)
+
+
   def inferToken(self, token, resetSequence=0, returnDetailedResults=False,
                  sortResults=True):
     """
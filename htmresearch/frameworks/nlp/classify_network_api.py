@@ -191,7 +191,7 @@ class ClassificationNetworkAPI(ClassificationModel):
 
     See also: _serializeExtraData()
     """
-    state = self.__dict__.copy()
+    state = super(ClassificationNetworkAPI, self).__getstate__()
     # Remove member variables that we can't pickle
     state.pop("network")
     state.pop("sensorRegion")
@@ -37,6 +37,7 @@ the repo's base dir):
 """
 
 import argparse
+import collections
 import copy
 import numpy
 import os
@@ -46,6 +47,7 @@ from tqdm import tqdm
 
 from htmresearch.encoders import EncoderTypes
 from htmresearch.frameworks.nlp.classification_model import ClassificationModel
+from htmresearch.frameworks.nlp.imbu_query_index import QueryIndex
 from htmresearch.support.csv_helper import readCSV
 from htmresearch.support.register_regions import registerAllResearchRegions
 from htmresearch.frameworks.nlp.model_factory import (
@@ -104,6 +106,11 @@ class ImbuModels(object):
   defaultRetina = "en_associative"
   defaultContextSize = 20
   tokenIndexingFactor = 1000
+  # Max number of scored documents, over all the cached queries, kept in the
+  # LRU cache of getResults()
+  queryCacheSize = 100000
+  # Directory of the query index, in the directory of a saved model
+  queryIndexDir = "query_index"
 
   # Mapping of acceptable model names to names expected by the model factory
   modelMappings = dict((name, name) for name in ("CioWordFingerprint",
@@ -145,6 +152,14 @@ class ImbuModels(object):
     self.dataDict = self._loadData()
     self.apiKey = apiKey
     self.retina = retina or self.defaultRetina
+    # Query indexes (see QueryIndex), keyed by model name
+    self._queryIndexes = {}
+    # Results of the unscored documents, keyed by model name, see
+    # expandResults()
+    self._defaultResults = {}
+    # LRU cache of scored query results, see getResults()
+    self._queryResults = collections.OrderedDict()
+    self._numCachedDocuments = 0
 
 
   def __repr__(self):
@@ -256,6 +271,8 @@ class ImbuModels(object):
                                    **modelFactoryKwargs)
         self.train(model, savePath)
 
+    self._loadQueryIndex(modelName, loadPath or savePath)
+
     return model
 
 
@@ -279,20 +296,18 @@ class ImbuModels(object):
     in the dataDict values.
     """
     labels = [0]
-    modelType = type(model)
-    for seqId, (text, _, _) in tqdm(self.dataDict.iteritems()):
-      if modelType in self.documentLevel:
-        model.trainDocument(text, labels, seqId)
-      else:
-        # Word-level model, so use token-word mappings
-        tokenList, mapping = model.tokenize(text)
-        lastTokenIndex = len(tokenList) - 1
-        for i, (token, tokenIndex) in enumerate(zip(tokenList, mapping)):
-          wordId = seqId * self.tokenIndexingFactor + tokenIndex
-          model.trainToken(token,
-                           labels,
-                           wordId,
-                           resetSequence=int(i == lastTokenIndex))
+    if type(model) in self.documentLevel:
+      tokenIdFactor = None
+    else:
+      # Word-level model, so use token-word mappings
+      tokenIdFactor = self.tokenIndexingFactor
+    model.trainDocuments(((text, labels, seqId)
+                          for seqId, (text, _, _)
+                          in tqdm(self.dataDict.iteritems())),
+                         tokenIdFactor=tokenIdFactor)
+
+    # Cached results are stale once a model is trained
+    self.clearCachedScores()
 
     if savePath:
       self.save(model, savePath)
@@ -313,6 +328,108 @@ class ImbuModels(object):
     model.save(savePath)
 
 
+  def _loadQueryIndex(self, modelName, modelPath=None):
+    """ Load the query index of a model from the model directory, or build it
+    (and save it there) if there is no index of this dataset yet.
+    """
+    indexPath = None
+    index = None
+    if modelPath:
+      indexPath = os.path.join(modelPath, self.queryIndexDir)
+      index = QueryIndex.load(indexPath, self.dataDict)
+
+    if index is None:
+      index = QueryIndex.build(self.dataDict)
+      if indexPath:
+        try:
+          index.save(indexPath)
+        except (IOError, OSError) as e:
+          print "Could not save the query index at '{}': {}".format(indexPath,
+                                                                    e)
+
+    self._queryIndexes[modelName] = index
+    self._defaultResults.pop(modelName, None)
+    # Results cached for an earlier model of the same name are stale
+    self.clearCachedScores(modelName)
+
+
+  def getQueryIndex(self, modelName):
+    """ Return the query index of a model. Models that were not created with
+    createModel() get an index that is built on first use.
+    """
+    if modelName not in self._queryIndexes:
+      self._queryIndexes[modelName] = QueryIndex.build(self.dataDict)
+    return self._queryIndexes[modelName]
+
+
+  def getCacheKey(self, modelName, model, query, contextSize=None):
+    """ Key of the results of a query in the LRU cache of getResults().
+    Queries with the same tokens share their results.
+    """
+    tokenList, _ = model.tokenize(query)
+    return (modelName, " ".join(tokenList), contextSize)
+
+
+  def getCachedScores(self, key):
+    """ Return the scored results (see scoreResults()) cached under the given
+    key, or None.
+    """
+    scoredResults = self._queryResults.pop(key, None)
+    if scoredResults is not None:
+      self._queryResults[key] = scoredResults
+    return scoredResults
+
+
+  def cacheScores(self, key, scoredResults):
+    """ Add scored results (see scoreResults()) to the LRU cache, evicting the
+    least recently used queries beyond queryCacheSize scored documents.
+    """
+    previous = self._queryResults.pop(key, None)
+    if previous is not None:
+      self._numCachedDocuments -= len(previous)
+    self._queryResults[key] = scoredResults
+    self._numCachedDocuments += len(scoredResults)
+    while self._numCachedDocuments > self.queryCacheSize:
+      _, evicted = self._queryResults.popitem(last=False)
+      self._numCachedDocuments -= len(evicted)
+
+
+  def clearCachedScores(self, modelName=None):
+    """ Remove the scored results of the given model, or of all models, from
+    the LRU cache.
+    """
+    if modelName is None:
+      self._queryResults.clear()
+      self._numCachedDocuments = 0
+      return
+
+    for key in [key for key in self._queryResults if key[0] == modelName]:
+      self._numCachedDocuments -= len(self._queryResults.pop(key))
+
+
+  def getResults(self, modelName, model, query, contextSize=None):
+    """ Query the model and format the results (see formatResults()). The
+    scored documents of recent queries are kept in an LRU cache, so the
+    returned results share their lists with the cache and must not be
+    modified.
+    """
+    key = self.getCacheKey(modelName, model, query, contextSize)
+    scoredResults = self.getCachedScores(key)
+    if scoredResults is None:
+      scoredResults = self.scoreQuery(modelName, model, query, contextSize)
+      self.cacheScores(key, scoredResults)
+    return self.expandResults(modelName, scoredResults)
+
+
+  def scoreQuery(self, modelName, model, query, contextSize=None):
+    """ Query the model and return the results of the scored documents (see
+    scoreResults()).
+    """
+    _, sortedIds, sortedDistances = self.query(model, query)
+    return self.scoreResults(modelName, query, sortedDistances, sortedIds,
+                             contextSize)
+
+
   def formatResults(self, modelName, query, distanceArray, idList,
       contextSize=None):
     """ Returns a dict of results as expected by the frontend of the Imbu app:
@@ -337,49 +454,98 @@ class ImbuModels(object):
 
     Windows correspond to the last token of the window, so a window of length
     10 for index 13 implies the window contains indices 4-13.
+
+    The results of the documents without scores are shared between queries
+    and must not be modified.
     """
-    # Consistent with Imbu's JS components (search-results.jsx) we tokenize
-    # simply on spaces.
-    queryLength = float(len(query.split(" ")))
+    return self.expandResults(
+      modelName,
+      self.scoreResults(modelName, query, distanceArray, idList, contextSize))
 
-    # Format distances to reflect pctOverlap metric
-    formattedDistances = (1.0 - distanceArray) * 100
 
-    modelType = (
-      getattr(ClassificationModelTypes, self._mapModelName(modelName))
-      or self.defaultModelType )
+  def scoreResults(self, modelName, query, distanceArray, idList,
+      contextSize=None):
+    """ Returns the results of formatResults() for the scored documents only,
+    without their text, keyed by document ID. They are expanded into the
+    results of all the documents by expandResults().
+    """
+    # Format distances to reflect pctOverlap metric
+    formattedDistances = (1.0 - numpy.asarray(distanceArray)) * 100
 
-    # Format results - initially each entry represents one document.
-    results = self._initResultsDataStructure(modelType)
-    for protoID, dist in zip(idList, formattedDistances):
-      if modelType in self.documentLevel:
-        # Prototypes correspond to documents
-        results[protoID]["scores"][0] = dist
-      else:
-        # Prototypes correspond to words, so get the docID from the protoID via
-        # the indexing scheme
-        wordID = protoID % self.tokenIndexingFactor
-        docID = (protoID - wordID) / self.tokenIndexingFactor
-        results[docID]["scores"][wordID] = dist
-      if modelName in ("HTM_sensor_simple_tp_knn",
-                       "HTM_sensor_tm_simple_tp_knn"):
-        # Windows always length 10
-        results[docID]["windowSize"] = 10
+    modelType = self._getModelType(modelName)
+    index = self.getQueryIndex(modelName)
+    scoredResults = {}
 
     if modelType in self.documentLevel:
-      # Doc-level results remain documents, not fragments of documents
-      return results
+      # Prototypes correspond to documents. Doc-level results remain
+      # documents, not fragments of documents. Documents with a score of 0 are
+      # the same as unscored ones.
+      docLengths = index.docLengths[index.getRows(idList)].tolist()
+      for protoID, dist, docLength in zip(idList, formattedDistances,
+                                          docLengths):
+        if dist != 0:
+          scoredResults[protoID] = {"scores": [dist],
+                                    "windowSize": 0,
+                                    "indices": [[0, docLength]]}
+      return scoredResults
+
+    if modelName in ("HTM_sensor_simple_tp_knn",
+                     "HTM_sensor_tm_simple_tp_knn"):
+      # Windows always length 10
+      windowSize = 10
+    else:
+      windowSize = 1
+
+    # Prototypes correspond to words, so get the docIDs from the protoIDs via
+    # the indexing scheme
+    docIds, wordIds = index.decodeWordIds(idList, self.tokenIndexingFactor)
+    order = numpy.argsort(docIds, kind="mergesort")
+    scoredDocIds, starts = numpy.unique(docIds[order], return_index=True)
+    ends = numpy.append(starts[1:], len(order))
+    docLengths = index.docLengths[index.getRows(scoredDocIds)].tolist()
+    for docID, start, end, docLength in zip(scoredDocIds.tolist(), starts,
+                                            ends, docLengths):
+      protos = order[start:end]
+      if windowSize == 1 and not formattedDistances[protos].any():
+        # Same as the results of unscored documents
+        continue
+      scores = numpy.zeros(docLength)
+      scores[wordIds[protos]] = formattedDistances[protos]
+      scoredResults[docID] = {"scores": scores.tolist(),
+                              "windowSize": windowSize,
+                              "indices": [[0, docLength]]}
 
     # Populate results with fragments indices
     contextSize = contextSize or self.defaultContextSize
-    self._fragmentResults(results, contextSize)
+    self._fragmentResults(scoredResults, contextSize)
+
+    return scoredResults
 
+
+  def expandResults(self, modelName, scoredResults):
+    """ Returns the results of all the documents (see formatResults()) from the
+    results of the scored documents (see scoreResults()).
+    """
+    if modelName not in self._defaultResults:
+      self._defaultResults[modelName] = self._initResultsDataStructure(
+        self._getModelType(modelName), self.getQueryIndex(modelName))
+
+    results = dict(self._defaultResults[modelName])
+    for docID, scoredResult in scoredResults.iteritems():
+      docResult = dict(scoredResult)
+      docResult["text"] = self.dataDict[docID][0]
+      results[docID] = docResult
     return results
 
 
-  def _initResultsDataStructure(self, modelType):
-    """ Initialize a results list to be populated in formatResults(). There's
-    one entry for each document in the dataset.
+  def _getModelType(self, modelName):
+    return (getattr(ClassificationModelTypes, self._mapModelName(modelName))
+            or self.defaultModelType)
+
+
+  def _initResultsDataStructure(self, modelType, index):
+    """ Initialize the results of the documents without scores, see
+    expandResults(). There's one entry for each document in the dataset.
 
     windowSize specifies the number of previous words (inclusive) that each
     score represents.
@@ -387,8 +553,9 @@ class ImbuModels(object):
     [start, end]).
     """
     results = {}
-    for docID, documentData in self.dataDict.iteritems():
-      docLength = len(documentData[0].split(" "))
+    for docID, docLength in zip(index.docIds.tolist(),
+                                index.docLengths.tolist()):
+      documentData = self.dataDict[docID]
       if modelType in self.documentLevel:
         # Only one match per document
         scoresArray = [0]
@@ -416,10 +583,8 @@ class ImbuModels(object):
       fragmentOrigins = [i for i, s in enumerate(docResult["scores"])
                          if s == maxScore]
 
-      # Consistent with Imbu's JS components (search-results.jsx) we tokenize
-      # simply on spaces.
-      docText = docResult["text"].split(" ")
-      docLength = len(docText)
+      # There's one score per word of the document
+      docLength = len(docResult["scores"])
 
       # Set the start and end indices for this doc's fragments
       fragmentsIndices = []
@@ -0,0 +1,142 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Precomputed data of the documents of an Imbu dataset, used to format query
+results without re-processing the corpus for every query.
+"""
+
+import json
+import os
+import shutil
+import zlib
+
+import numpy
+
+METADATA_FILE = "metadata.json"
+ARRAY_NAMES = ("docIds", "docLengths")
+
+
+
+def _checksum(dataDict):
+  """ CRC of the document IDs and texts of a dataset, in document ID order.
+  """
+  checksum = 0
+  for docID in sorted(dataDict):
+    checksum = zlib.crc32(str(docID), checksum)
+    checksum = zlib.crc32(dataDict[docID][0], checksum)
+  return checksum & 0xffffffff
+
+
+
+class QueryIndex(object):
+  """ Per-document data of an Imbu dataset, as numpy arrays sorted by document
+  ID:
+    - docIds: the document IDs (keys of ImbuModels.dataDict).
+    - docLengths: the number of words of each document, splitting on spaces as
+      Imbu's JS components do.
+
+  An index is saved as one .npy file per array, which are memory-mapped when
+  the index is loaded.
+  """
+
+  def __init__(self, docIds, docLengths, checksum=None):
+    self.docIds = docIds
+    self.docLengths = docLengths
+    self.checksum = checksum
+
+
+  def __len__(self):
+    return len(self.docIds)
+
+
+  @classmethod
+  def build(cls, dataDict):
+    """ Build the index of a dataset.
+
+    @param dataDict (dict) Imbu dataset, see ImbuModels._loadData().
+    """
+    docIds = sorted(dataDict)
+    docLengths = numpy.array([len(dataDict[docID][0].split(" "))
+                              for docID in docIds], dtype=numpy.int32)
+
+    return cls(numpy.array(docIds, dtype=numpy.int64), docLengths,
+               _checksum(dataDict))
+
+
+  @classmethod
+  def load(cls, path, dataDict=None, mmapMode="r"):
+    """ Load an index saved with save().
+
+    @param path (str) Directory of the index.
+    @param dataDict (dict) Optional dataset of the index. If the index was
+        built from a different dataset, None is returned.
+    @param mmapMode (str) numpy memmap mode of the arrays. None to read them in
+        memory.
+    @return (QueryIndex) The index, or None if there is no index at path.
+    """
+    metadataPath = os.path.join(path, METADATA_FILE)
+    if not os.path.isfile(metadataPath):
+      return None
+    with open(metadataPath, "r") as f:
+      metadata = json.load(f)
+    if dataDict is not None and metadata["checksum"] != _checksum(dataDict):
+      return None
+
+    arrays = [numpy.load(os.path.join(path, name + ".npy"), mmap_mode=mmapMode)
+              for name in ARRAY_NAMES]
+    return cls(*arrays, checksum=metadata["checksum"])
+
+
+  def save(self, path):
+    """ Save the index in the given directory, replacing any index there.
+    """
+    tmpPath = path.rstrip(os.sep) + ".tmp"
+    if os.path.exists(tmpPath):
+      shutil.rmtree(tmpPath)
+    os.makedirs(tmpPath)
+    for name in ARRAY_NAMES:
+      numpy.save(os.path.join(tmpPath, name + ".npy"), getattr(self, name))
+    with open(os.path.join(tmpPath, METADATA_FILE), "w") as f:
+      json.dump({"numDocuments": len(self), "checksum": self.checksum}, f)
+
+    if os.path.exists(path):
+      shutil.rmtree(path)
+    os.rename(tmpPath, path)
+
+
+  def getRows(self, docIds):
+    """ Rows of the given documents in the arrays of the index.
+    """
+    return numpy.searchsorted(self.docIds, docIds)
+
+
+  @staticmethod
+  def decodeWordIds(protoIds, tokenIndexingFactor):
+    """ Decode the prototype IDs of word-level models (see ImbuModels.train())
+    into document IDs and word indices.
+
+    @return docIds (numpy.array) Document ID of each prototype.
+    @return wordIndices (numpy.array) Index of the word of each prototype in
+        its document.
+    """
+    return numpy.divmod(numpy.asarray(protoIds, dtype=numpy.int64),
+                        tokenIndexingFactor)
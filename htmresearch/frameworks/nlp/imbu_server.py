@@ -0,0 +1,403 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Serving layer for Imbu's web API (projects/imbu/engine/fluent_api.py).
+
+Models are loaded and health-checked when the server starts, instead of on the
+first query that names them. Queries run either in the server process, one at a
+time per model, or in a pool of worker processes. The workers are forked from
+the server process after the models are loaded, so they share the memory of
+the models (e.g. the KNN prototype matrices) copy-on-write, and each worker has
+its own inference state. Workers only send back the scored documents of a
+query; the server caches them and expands them into the results of all the
+documents.
+
+The script runs an offline benchmark, replaying a file of queries (one per
+line) against a model:
+
+  python htmresearch/frameworks/nlp/imbu_server.py \
+    --loadPathPrefix projects/imbu/engine -d sample_reviews \
+    -m CioDocumentFingerprint -q queries.txt --numWorkers 4
+"""
+
+import argparse
+import functools
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+import time
+
+import numpy
+
+from htmresearch.frameworks.nlp.imbu import ImbuModels
+
+
+
+g_log = logging.getLogger(__name__)
+
+# Server of the worker processes, inherited from the server process when the
+# pool is forked, see _initWorker().
+_g_server = None
+
+
+
+def _initWorker(server):
+  """ Initializer of the worker processes. Locks held by threads of the server
+  process when the pool was forked would never be released in the worker, so
+  the worker gets fresh ones.
+  """
+  global _g_server
+
+  server._locks = {}
+  server._cacheLocks = {dataset: threading.Lock()
+                        for dataset in server._cacheLocks}
+  server._poolLock = threading.Lock()
+  server._pool = None
+  _g_server = server
+
+
+
+def _workerScoreQuery(args):
+  return _g_server._scoreQuery(*args)
+
+
+
+def _timedQuery(server, task):
+  start = time.time()
+  server.query(*task)
+  return time.time() - start
+
+
+
+class ImbuModelServer(object):
+  """ Serves the Imbu models of all the datasets in a directory. Each dataset is
+  a subdirectory with a data.csv file and one saved model per model name.
+  """
+
+  def __init__(self, loadPathPrefix, cacheRoot=None, retina=None, apiKey=None,
+      numWorkers=0):
+    """
+    @param loadPathPrefix (str) Root directory of the datasets.
+    @param cacheRoot (str) Directory in which to cache encodings.
+    @param retina (str) Cortical.io retina of the models.
+    @param apiKey (str) Cortical.io API key.
+    @param numWorkers (int) Number of worker processes that run the queries.
+        With 0, queries run in the server process.
+    """
+    self.loadPathPrefix = loadPathPrefix
+    self.numWorkers = numWorkers
+    self.imbus = {}
+    self.models = {}
+    # Result of the last health check of each model, keyed by
+    # (dataset, modelName)
+    self.health = {}
+    # Models are not reentrant (e.g. they accumulate the tokens of the current
+    # document), so queries on a model are serialized within a process. Locks
+    # are keyed by (dataset, modelName).
+    self._locks = {}
+    # Locks of the query results cache of each dataset
+    self._cacheLocks = {}
+    self._poolLock = threading.Lock()
+    self._pool = None
+
+    for datasetName in sorted(os.listdir(loadPathPrefix)):
+      datasetPath = os.path.join(loadPathPrefix, datasetName)
+      if os.path.isdir(datasetPath) and "egg" not in datasetPath:
+        self.imbus[datasetName] = ImbuModels(
+          cacheRoot=cacheRoot,
+          modelSimilarityMetric=None,
+          dataPath=os.path.join(datasetPath, "data.csv"),
+          retina=retina,
+          apiKey=apiKey)
+        self.models[datasetName] = {}
+        self._cacheLocks[datasetName] = threading.Lock()
+
+
+  def getModelNames(self, dataset):
+    """ Names of the saved models of a dataset.
+    """
+    datasetPath = os.path.join(self.loadPathPrefix, dataset)
+    return sorted(name for name in os.listdir(datasetPath)
+                  if name in ImbuModels.modelMappings
+                  and os.path.isdir(os.path.join(datasetPath, name)))
+
+
+  def preload(self, modelNames=None):
+    """ Load and health-check models of every dataset, then fork the worker
+    processes, if any, so that they inherit the loaded models and are forked
+    before the server handles queries from other threads.
+
+    @param modelNames (list) Names of the models to load. By default, all the
+        saved models of each dataset are loaded.
+    @return (bool) Whether all the models are healthy.
+    """
+    for dataset in sorted(self.imbus):
+      for modelName in modelNames or self.getModelNames(dataset):
+        if os.path.isdir(os.path.join(self.loadPathPrefix, dataset, modelName)):
+          self.checkModel(dataset, modelName)
+
+    if self.numWorkers > 0:
+      self._getPool()
+
+    return self.isHealthy()
+
+
+  def getModel(self, dataset, modelName):
+    """ Return a model, loading it if needed.
+    """
+    with self._getLock(dataset, modelName):
+      if modelName not in self.models[dataset]:
+        loadPath = os.path.join(self.loadPathPrefix, dataset, modelName)
+        start = time.time()
+        # Loading a model drops its results from the query results cache
+        with self._cacheLocks[dataset]:
+          self.models[dataset][modelName] = self.imbus[dataset].createModel(
+            modelName, str(loadPath), None)
+        g_log.info("Loaded model %s/%s in %.2fs", dataset, modelName,
+                   time.time() - start)
+      return self.models[dataset][modelName]
+
+
+  def checkModel(self, dataset, modelName):
+    """ Health check: load the model and query it with the first words of the
+    first document, bypassing the results cache. The results must have an
+    entry for each document of the dataset.
+
+    @return (bool) Whether the model is healthy.
+    """
+    imbu = self.imbus[dataset]
+    try:
+      self.getModel(dataset, modelName)
+      probe = " ".join(imbu.dataDict[min(imbu.dataDict)][0].split(" ")[:5])
+      results = imbu.expandResults(modelName,
+                                   self._scoreQuery(dataset, modelName, probe))
+      healthy = len(results) == len(imbu.dataDict)
+      if not healthy:
+        g_log.error("Health check of %s/%s returned %d results for %d "
+                    "documents", dataset, modelName, len(results),
+                    len(imbu.dataDict))
+    except Exception:
+      g_log.exception("Health check of %s/%s failed", dataset, modelName)
+      healthy = False
+
+    self.health[(dataset, modelName)] = healthy
+    return healthy
+
+
+  def isHealthy(self):
+    """ Whether all the loaded models passed their last health check.
+    """
+    return all(self.health.values())
+
+
+  def query(self, dataset, modelName, text, useCache=True):
+    """ Query a model and return its formatted results, see
+    ImbuModels.formatResults().
+
+    @param useCache (bool) Whether to use the LRU cache of recent query
+        results. Results share their lists with the cache and must not be
+        modified.
+    """
+    imbu = self.imbus[dataset]
+    scoredResults = None
+    if useCache:
+      # Cache keys use the tokenizer of the model
+      model = self.getModel(dataset, modelName)
+      key = imbu.getCacheKey(modelName, model, text)
+      with self._cacheLocks[dataset]:
+        scoredResults = imbu.getCachedScores(key)
+
+    if scoredResults is None:
+      if self.numWorkers > 0:
+        scoredResults = self._getPool().apply(_workerScoreQuery,
+                                              ((dataset, modelName, text),))
+      else:
+        scoredResults = self._scoreQuery(dataset, modelName, text)
+      if useCache:
+        with self._cacheLocks[dataset]:
+          imbu.cacheScores(key, scoredResults)
+
+    return imbu.expandResults(modelName, scoredResults)
+
+
+  def close(self):
+    """ Stop the worker processes.
+    """
+    with self._poolLock:
+      if self._pool is not None:
+        self._pool.close()
+        self._pool.join()
+        self._pool = None
+
+
+  def _getLock(self, dataset, modelName):
+    # setdefault is atomic, so concurrent callers get the same lock
+    return self._locks.setdefault((dataset, modelName), threading.RLock())
+
+
+  def _scoreQuery(self, dataset, modelName, text):
+    """ Query a model in this process and return the scored documents, see
+    ImbuModels.scoreResults().
+    """
+    with self._getLock(dataset, modelName):
+      model = self.getModel(dataset, modelName)
+      return self.imbus[dataset].scoreQuery(modelName, model, text)
+
+
+  def _getPool(self):
+    """ Return the pool of worker processes, forking it on first use. The pool
+    is normally forked by preload(); models loaded after that are loaded by
+    each worker.
+    """
+    with self._poolLock:
+      if self._pool is None:
+        self._pool = multiprocessing.Pool(self.numWorkers,
+                                          initializer=_initWorker,
+                                          initargs=(self,))
+      return self._pool
+
+
+
+def runBenchmark(server, dataset, modelName, queries, numPasses=1,
+    useCache=False):
+  """ Replay queries against a model and measure the latency of each query and
+  the overall throughput.
+
+  @param server (ImbuModelServer) Server of the model.
+  @param queries (list) Query texts.
+  @param numPasses (int) Number of times the queries are replayed.
+  @param useCache (bool) Whether to use the LRU cache of query results.
+  @return (dict) Latency statistics, in seconds, and throughput, in queries per
+      second.
+  """
+  server.getModel(dataset, modelName)
+  tasks = [(dataset, modelName, text, useCache)
+           for _ in xrange(numPasses) for text in queries]
+
+  start = time.time()
+  if server.numWorkers > 0:
+    # Queries are sent from as many threads as there are workers, and timed
+    # in this process, as the web API queries are. The pool is forked before
+    # the threads start.
+    server._getPool()
+    threadPool = ThreadPool(server.numWorkers)
+    try:
+      latencies = threadPool.map(functools.partial(_timedQuery, server), tasks)
+    finally:
+      threadPool.close()
+      threadPool.join()
+  else:
+    latencies = [_timedQuery(server, task) for task in tasks]
+  totalTime = time.time() - start
+
+  latencies = numpy.array(latencies)
+  return {
+    "numQueries": len(tasks),
+    "numWorkers": server.numWorkers,
+    "totalTime": totalTime,
+    "throughput": len(tasks) / totalTime if totalTime > 0 else 0.0,
+    "meanLatency": latencies.mean() if len(tasks) else 0.0,
+    "p50Latency": numpy.percentile(latencies, 50) if len(tasks) else 0.0,
+    "p90Latency": numpy.percentile(latencies, 90) if len(tasks) else 0.0,
+    "p99Latency": numpy.percentile(latencies, 99) if len(tasks) else 0.0,
+    "maxLatency": latencies.max() if len(tasks) else 0.0,
+  }
+
+
+
+def getArgs():
+  """ Parse the command line options of the benchmark.
+  """
+  parser = argparse.ArgumentParser()
+
+  parser.add_argument("--loadPathPrefix",
+                      default=os.environ.get("IMBU_LOAD_PATH_PREFIX"),
+                      type=str,
+                      help="Root directory of the datasets and their saved "
+                           "models.")
+  parser.add_argument("-d", "--dataset",
+                      default=ImbuModels.defaultDataset,
+                      type=str)
+  parser.add_argument("-m", "--modelName",
+                      default=ImbuModels.defaultModelType,
+                      choices=ImbuModels.modelMappings,
+                      type=str)
+  parser.add_argument("-q", "--queriesPath",
+                      required=True,
+                      type=str,
+                      help="Text file with one query per line.")
+  parser.add_argument("--numWorkers",
+                      default=0,
+                      type=int,
+                      help="Number of worker processes; 0 to run the queries "
+                           "in this process.")
+  parser.add_argument("--numPasses",
+                      default=1,
+                      type=int,
+                      help="Number of times the queries are replayed.")
+  parser.add_argument("--useCache",
+                      default=False,
+                      action="store_true",
+                      help="Use the LRU cache of query results.")
+  parser.add_argument("--cacheRoot",
+                      type=str,
+                      help="Root directory in which to cache encodings")
+  parser.add_argument("--imbuRetinaId",
+                      default=os.environ.get("IMBU_RETINA_ID"),
+                      type=str)
+  parser.add_argument("--corticalApiKey",
+                      default=os.environ.get("CORTICAL_API_KEY"),
+                      type=str)
+
+  return parser.parse_args()
+
+
+
+if __name__ == "__main__":
+
+  args = getArgs()
+
+  with open(args.queriesPath, "r") as f:
+    benchmarkQueries = [line.strip() for line in f if line.strip()]
+
+  modelServer = ImbuModelServer(args.loadPathPrefix,
+                                cacheRoot=args.cacheRoot,
+                                retina=args.imbuRetinaId,
+                                apiKey=args.corticalApiKey,
+                                numWorkers=args.numWorkers)
+  if not modelServer.checkModel(args.dataset, args.modelName):
+    raise RuntimeError("Model {}/{} failed its health check".format(
+      args.dataset, args.modelName))
+
+  try:
+    stats = runBenchmark(modelServer, args.dataset, args.modelName,
+                         benchmarkQueries, numPasses=args.numPasses,
+                         useCache=args.useCache)
+  finally:
+    modelServer.close()
+
+  for key in ("numQueries", "numWorkers", "totalTime", "throughput",
+              "meanLatency", "p50Latency", "p90Latency", "p99Latency",
+              "maxLatency"):
+    print "{}: {}".format(key, stats[key])
@@ -21,6 +21,7 @@
 
 import cPickle as pkl
 import itertools
+import multiprocessing
 import numpy
 import os
 import random
@@ -53,6 +54,25 @@ _MODEL_MAPPING = {
 
 
 
+# Runner of the trial worker processes, and the pickled model that each trial
+# starts from; inherited from the parent process when the pool is forked.
+_g_runner = None
+_g_modelState = None
+
+
+
+def _runTrial(args):
+  """Train and test a copy of the model for one trial, in a worker process."""
+  trial, seed = args
+  _g_runner.model = pkl.loads(_g_modelState)
+  _g_runner.results = []
+  _g_runner.resetModel(trial)
+  _g_runner.training(trial)
+  _g_runner.testing(trial, seed)
+  return trial, _g_runner.partitions[trial], _g_runner.results[-1]
+
+
+
 class Runner(object):
   """
   Class to run the baseline NLP experiments with the specified data, models,
@@ -239,10 +259,21 @@ class Runner(object):
     self.patterns = self.model.encodeSamples(self.samples, write=writeEncodings)
 
 
-  def runExperiment(self, seed=42):
-    """Train and test the model for each trial specified by self.splitting."""
+  def runExperiment(self, seed=42, numWorkers=1):
+    """
+    Train and test the model for each trial specified by self.splitting.
+
+    @param seed         (int)     Random seed, used in partitioning the data.
+    @param numWorkers   (int)     Number of worker processes. With more than
+                                  one worker, the trials run in parallel, see
+                                  runTrialsInParallel().
+    """
     self.partitionIndices(seed)
 
+    if numWorkers > 1 and len(self.partitions) > 1:
+      self.runTrialsInParallel(seed, numWorkers)
+      return
+
     for i, _ in enumerate(self.partitions):
       self.resetModel(i)
       if self.verbosity > 0:
@@ -251,6 +282,37 @@ class Runner(object):
       self.testing(i, seed)
 
 
+  def runTrialsInParallel(self, seed, numWorkers):
+    """
+    Run the trials in a pool of worker processes. Each trial trains and tests
+    its own copy of the model, deserialized from the model as it is before the
+    trials. The results are merged in trial order, so they are the same as
+    those of a serial run with the same seed.
+
+    @param seed         (int)     Random seed passed to testing().
+    @param numWorkers   (int)     Number of worker processes.
+    """
+    global _g_runner
+    global _g_modelState
+
+    _g_runner = self
+    _g_modelState = pkl.dumps(self.model, pkl.HIGHEST_PROTOCOL)
+    pool = multiprocessing.Pool(min(numWorkers, len(self.partitions)))
+    try:
+      trialResults = sorted(pool.imap_unordered(
+        _runTrial, [(i, seed) for i in xrange(len(self.partitions))]))
+    finally:
+      pool.close()
+      pool.join()
+      _g_runner = None
+      _g_modelState = None
+
+    for trial, partition, results in trialResults:
+      # Some runners update the partitions of a trial while testing it.
+      self.partitions[trial] = partition
+      self.results.append(results)
+
+
   def partitionIndices(self, seed=42):
     """
     Partitions list of two-tuples of train and test indices for each trial.
@@ -271,7 +333,9 @@ class Runner(object):
         random.seed(seed)
         for split in self.trainSizes:
           trainIndices = random.sample(xrange(length), split)
-          testIndices = [i for i in xrange(length) if i not in trainIndices]
+          isTrain = numpy.zeros(length, dtype=bool)
+          isTrain[trainIndices] = True
+          testIndices = numpy.flatnonzero(~isTrain).tolist()
           self.partitions.append((trainIndices, testIndices))
 
 
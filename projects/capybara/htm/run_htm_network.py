@@ -170,6 +170,13 @@ def _runOnTimeIndexedData(network, learningMode, traceCsvWriter, writeChunkSize,
 
 
 
+def _splitIndices(indices, offsets):
+  """Split stacked indices (see BaseNetwork.handleRecords) into lists."""
+  return [indices[offsets[i]:offsets[i + 1]].tolist()
+          for i in range(len(offsets) - 1)]
+
+
+
 def _runOnSequenceIndexedData(network, learningMode, traceCsvWriter,
                               writeChunkSize, inputCsvReader):
   timeIndexed = False
@@ -183,14 +190,11 @@ def _runOnSequenceIndexedData(network, learningMode, traceCsvWriter,
     label = int(float(row[0]))
     sequence_values = row[1:]
 
-    spActiveColumns = []
-    tmPredictedActiveCells = []
-    for valueString in sequence_values:
-      value = float(valueString)
-      network.handleRecord(value, label=label, learningMode=learningMode)
-      spActiveColumns.append(network.getSpOutputNZ().tolist())
-      tmPredictedActiveCells.append(
-        network.getTmPredictedActiveCellsNZ().tolist())
+    values = [float(valueString) for valueString in sequence_values]
+    outputs = network.handleRecords(values, labels=[label] * len(values),
+                                    learningMode=learningMode)
+    spActiveColumns = _splitIndices(*outputs['spActiveColumns'])
+    tmPredictedActiveCells = _splitIndices(*outputs['tmPredictedActiveCells'])
 
     traceUpdate = {
       'label': label, 'spActiveColumns': spActiveColumns,
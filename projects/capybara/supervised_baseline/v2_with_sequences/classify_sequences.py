@@ -30,6 +30,9 @@ def main():
   trace_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                            os.pardir, os.pardir, 'htm', 'traces')
   assume_sequence_alignment = True
+  knn_distance = 'sequence'  # Or 'overlap', see analyze_sdr_sequences().
+  n_jobs = 4
+  checkpoint_dir = 'checkpoints'  # Set to None to always re-run the analysis.
   if assume_sequence_alignment:
     plot_dir = 'plots_assume_sequences_aligned'
   else:
@@ -43,7 +46,8 @@ def main():
   ]
 
   run_analysis(trace_dir, data_ids, chunks, n_neighbors, tsne, aggregations,
-               plot_dir, assume_sequence_alignment)
+               plot_dir, assume_sequence_alignment, n_jobs, checkpoint_dir,
+               knn_distance)
 
 
 
@@ -0,0 +1,44 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2017, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+import unittest
+import numpy as np
+from htmresearch.frameworks.capybara.sdr import \
+  convert_to_sdrs, convert_to_sparse_sdrs
+
+
+
+class SdrTest(unittest.TestCase):
+  """
+  Unit tests for the conversion of patternNZs to SDRs.
+  """
+
+
+  def test_convert_to_sparse_sdrs(self):
+    input_width = 20
+    patternNZs = [[3, 1, 7], [], [5, 5, 2, 19, 2], [0]]
+    sdrs = convert_to_sparse_sdrs(patternNZs, input_width)
+
+    self.assertEqual(sdrs.shape, (len(patternNZs), input_width))
+    self.assertTrue(sdrs.has_sorted_indices)
+    self.assertEqual(sdrs.nnz, 7)
+    np.testing.assert_array_equal(
+      sdrs.toarray(), np.array(convert_to_sdrs(patternNZs, input_width)))
@@ -27,6 +27,7 @@ import pkg_resources
 import web
 
 from htmresearch.frameworks.nlp.imbu import ImbuModels
+from htmresearch.frameworks.nlp.imbu_server import ImbuModelServer
 from htmresearch.frameworks.nlp.model_factory import ClassificationModelTypes
 
 
@@ -41,22 +42,30 @@ if "IMBU_LOAD_PATH_PREFIX" in os.environ:
 else:
   raise KeyError("Required IMBU_LOAD_PATH_PREFIX missing from environment")
 
-g_imbus = {}  # Global ImbuModels cache
-g_models = {}  # Global NLP model cache
-for datasetName in os.listdir(_IMBU_LOAD_PATH_PREFIX):
-  datasetPath = os.path.join(_IMBU_LOAD_PATH_PREFIX, datasetName)
-  if os.path.isdir(datasetPath) and "egg" not in datasetPath:
-    # Create an imbu instance for each dataset
-    imbu = ImbuModels(
-      cacheRoot=os.environ.get("MODEL_CACHE_DIR", os.getcwd()),
-      modelSimilarityMetric=None,
-      dataPath=os.path.join(datasetPath, "data.csv"),
-      retina=os.environ["IMBU_RETINA_ID"],
-      apiKey=os.environ["CORTICAL_API_KEY"]
-    )
-    g_imbus.update(((datasetName, imbu),))
-    # Init the dict for this dataset's models
-    g_models[datasetName] = {}
+# Global model server, with an ImbuModels instance for each dataset. Queries run
+# in IMBU_NUM_WORKERS worker processes, or in the web server process if 0.
+g_server = ImbuModelServer(
+  _IMBU_LOAD_PATH_PREFIX,
+  cacheRoot=os.environ.get("MODEL_CACHE_DIR", os.getcwd()),
+  retina=os.environ["IMBU_RETINA_ID"],
+  apiKey=os.environ["CORTICAL_API_KEY"],
+  numWorkers=int(os.environ.get("IMBU_NUM_WORKERS", 0))
+)
+g_imbus = g_server.imbus  # Global ImbuModels cache
+
+# Load the models before serving, so the first queries don't pay for loading
+# them. IMBU_PRELOAD_MODELS is a comma-separated list of model names; by
+# default all the saved models are loaded.
+if "IMBU_PRELOAD_MODELS" in os.environ:
+  _preloadModels = [name.strip()
+                    for name in os.environ["IMBU_PRELOAD_MODELS"].split(",")
+                    if name.strip()]
+else:
+  _preloadModels = None
+if not g_server.preload(_preloadModels):
+  g_log.error("Some models failed their health check: %s",
+              [key for key, healthy in g_server.health.iteritems()
+               if not healthy])
 
 
 def addStandardHeaders(contentType="application/json; charset=UTF-8"):
@@ -104,18 +113,8 @@ class FluentWrapper(object):
         ...
     }
     """
-    global g_imbus
-    global g_models
-
-    if model not in g_models[dataset]:
-      loadPath = os.path.join(_IMBU_LOAD_PATH_PREFIX, dataset, model)
-      g_models[dataset][model] = g_imbus[dataset].createModel(
-        model, str(loadPath), None)
-
     if text:
-      _, sortedIds, sortedDistances = g_imbus[dataset].query(
-        g_models[dataset][model], text)
-      return g_imbus[dataset].formatResults(model, text, sortedDistances, sortedIds)
+      return g_server.query(dataset, model, text)
 
     else:
       return {}
@@ -155,7 +154,7 @@ class FluentAPIHandler(object):
     addStandardHeaders()
     addCORSHeaders()
 
-    return json.dumps(True)
+    return json.dumps(g_server.isHealthy())
 
 
   def POST(self,
@@ -72,7 +72,7 @@ def run(args):
   print ("Encoding complete; elapsed time is {0:.2f} seconds.\nNow running the "
          "experiment.".format(time.time() - encodeTime))
 
-  runner.runExperiment(args.seed)
+  runner.runExperiment(args.seed, args.numWorkers)
 
   runner.writeOutClassifications()
 
@@ -160,6 +160,11 @@ if __name__ == "__main__":
                       default=42,
                       type=int,
                       help="Random seed, used in partitioning the data.")
+  parser.add_argument("--numWorkers",
+                      default=1,
+                      type=int,
+                      help="Number of worker processes that run the trials "
+                           "in parallel.")
   parser.add_argument("--writeEncodings",
                       default=False,
                       action="store_true",
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2017, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark the learning and inference throughput of the SDRClassifier.
+
+Feeds a stream of random SDRs (e.g. TM active cells) with random bucket
+indices to the classifier and reports the number of records processed per
+second for several sets of prediction steps.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from htmresearch.algorithms.sdr_classifier import SDRClassifier
+
+
+
+def _generateRecords(numRecords, numInputs, numActive, numBuckets, seed):
+  rng = np.random.RandomState(seed)
+  patternNZs = [rng.choice(numInputs, numActive, replace=False)
+                for _ in xrange(numRecords)]
+  classifications = [{"bucketIdx": bucketIdx, "actValue": float(bucketIdx)}
+                     for bucketIdx in rng.randint(numBuckets,
+                                                  size=numRecords)]
+  return patternNZs, classifications
+
+
+
+def runBenchmark(steps, patternNZs, classifications, batchSize=None):
+  """
+  Run the classifier on all the records and return the throughput.
+
+  :param steps: (tuple) steps of prediction of the classifier
+  :param patternNZs: (list) active indices of each record
+  :param classifications: (list) classification dict of each record
+  :param batchSize: (int) if set, feed the records through computeBatch() in
+                    blocks of batchSize records instead of compute().
+  :return: (float) records per second
+  """
+  classifier = SDRClassifier(steps=steps, alpha=0.001)
+  numRecords = len(patternNZs)
+
+  start = time.time()
+  if batchSize is None:
+    for recordNum in xrange(numRecords):
+      classifier.compute(recordNum, patternNZs[recordNum],
+                         classifications[recordNum], learn=True, infer=True)
+  else:
+    for first in xrange(0, numRecords, batchSize):
+      last = min(first + batchSize, numRecords)
+      classifier.computeBatch(range(first, last), patternNZs[first:last],
+                              classifications[first:last],
+                              learn=True, infer=True)
+  elapsed = time.time() - start
+
+  return numRecords / elapsed
+
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--numRecords", type=int, default=2000)
+  parser.add_argument("--numInputs", type=int, default=2048 * 32)
+  parser.add_argument("--numActive", type=int, default=40)
+  parser.add_argument("--numBuckets", type=int, default=100)
+  parser.add_argument("--batchSize", type=int, default=None,
+                      help="Use computeBatch() with this many records per "
+                           "call instead of compute()")
+  parser.add_argument("--seed", type=int, default=42)
+  args = parser.parse_args()
+
+  patternNZs, classifications = _generateRecords(args.numRecords,
+                                                 args.numInputs,
+                                                 args.numActive,
+                                                 args.numBuckets,
+                                                 args.seed)
+
+  print "%d records, %d inputs, %d active bits, %d buckets" % (
+    args.numRecords, args.numInputs, args.numActive, args.numBuckets)
+  for steps in [(1,), (1, 2), (1, 2, 5), (1, 2, 5, 10)]:
+    recordsPerSec = runBenchmark(steps, patternNZs, classifications,
+                                 args.batchSize)
+    print "steps=%-14s %10.1f records/sec" % (steps, recordsPerSec)
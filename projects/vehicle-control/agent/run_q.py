@@ -84,6 +84,8 @@ class Agent(object):
     self.plotter.update(sensor, encoding, steer, reward, value, qValues)
 
     if outputData.get("reset"):
+      # End of the episode, its eligibility traces must not carry over
+      self.learner.reset()
       self.plotter.render()
 
     self.lastState = encoding
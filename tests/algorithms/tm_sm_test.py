@@ -0,0 +1,88 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2017, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+import unittest
+
+import numpy as np
+
+from htmresearch.algorithms.TM_SM import TM_SM, Segment
+
+
+
+def _updateListSynapses(syns, synapses, delta, permanenceMax):
+  """
+  Permanence update of the list implementation of Segment.updateSynapses(),
+  on [srcCellCol, srcCellIdx, permanence] lists.
+  """
+  for synapse in synapses:
+    syns[synapse][2] = newValue = syns[synapse][2] + delta
+    if delta > 0 and newValue > permanenceMax:
+      syns[synapse][2] = permanenceMax
+    elif delta < 0 and newValue <= 0:
+      syns[synapse][2] = 0
+
+
+
+class SegmentTest(unittest.TestCase):
+  """
+  Synapse permanences of TM_SM segments.
+  """
+
+
+  def setUp(self):
+    self.tm = TM_SM(numberOfCols=20, numberOfDistalInput=10, cellsPerColumn=4,
+                    activationThreshold=3, minThreshold=2, initialPerm=0.21,
+                    connectedPerm=0.5, permanenceInc=0.01,
+                    permanenceDec=0.003, permanenceMax=0.95, seed=42)
+    # Segments are created during learning iterations
+    self.tm.lrnIterationIdx = 1
+
+
+  def testRepeatedUpdates(self):
+    tm = self.tm
+    segment = Segment(tp=tm, isSequenceSeg=False)
+    syns = []
+    dsyns = []
+    for i in xrange(8):
+      segment.addSynapse(i, i % 4, tm.initialPerm)
+      syns.append([i, i % 4, np.float32(tm.initialPerm)])
+      segment.addDistalSynapse(i, 0, tm.initialPerm)
+      dsyns.append([i, 0, np.float32(tm.initialPerm)])
+
+    rng = np.random.RandomState(0)
+    for _ in xrange(400):
+      lateral = sorted(rng.choice(8, 4, replace=False).tolist())
+      distal = sorted(rng.choice(8, 4, replace=False).tolist())
+      if rng.rand() < 0.8:
+        delta = tm.permanenceInc
+      else:
+        delta = -tm.permanenceDec
+      segment.updateSynapses(lateral, distal, delta)
+      _updateListSynapses(syns, lateral, delta, tm.permanenceMax)
+      _updateListSynapses(dsyns, distal, delta, tm.permanenceMax)
+
+    self.assertEqual(segment.synPerms.dtype, np.float32)
+    self.assertEqual(segment.dsynPerms.dtype, np.float32)
+    self.assertEqual(segment.synPerms.tolist(), [s[2] for s in syns])
+    self.assertEqual(segment.dsynPerms.tolist(), [s[2] for s in dsyns])
+    # Some synapses reached permanenceMax, others are still updated
+    self.assertIn(np.float32(tm.permanenceMax), segment.synPerms)
+    self.assertTrue((segment.synPerms < tm.permanenceMax).any())
@@ -0,0 +1,106 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2017, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import unittest
+
+from htmresearch.encoders import EncoderTypes
+from htmresearch.encoders.cio_encoder import CioEncoder
+from htmresearch.encoders.fake_cortical_client import FakeCorticalClient
+
+
+
+TEXTS = ["the quick brown fox", "jumps over the lazy dog",
+         "the quick brown fox", "hello world", "jumps over the lazy dog"]
+
+
+
+class CioEncoderTest(unittest.TestCase):
+  """
+  Encodings of a CioEncoder with a FakeCorticalClient.
+  """
+
+
+  def setUp(self):
+    self.tmpDir = tempfile.mkdtemp()
+    self.storeDir = os.path.join(self.tmpDir, "fingerprints")
+
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpDir)
+
+
+  def assertEncodingsEqual(self, encodings, expected):
+    self.assertEqual(len(encodings), len(expected))
+    for encoding, expectedEncoding in zip(encodings, expected):
+      self.assertEqual(list(encoding["fingerprint"]["positions"]),
+                       list(expectedEncoding["fingerprint"]["positions"]))
+      self.assertEqual(encoding["text"], expectedEncoding["text"])
+
+
+  def testEncodeMany(self):
+    for fingerprintType in (EncoderTypes.word, EncoderTypes.document):
+      encoder = CioEncoder(client=FakeCorticalClient(),
+                           fingerprintType=fingerprintType,
+                           fingerprintStoreDir=self.storeDir)
+      # Encodings denser than maxSparsity are randomly subsampled.
+      random.seed(42)
+      encodings = encoder.encodeMany(TEXTS)
+      random.seed(42)
+      expected = [encoder.encode(text) for text in TEXTS]
+      self.assertEncodingsEqual(encodings, expected)
+
+      # Duplicate texts get their own copy of the encoding.
+      self.assertIsNot(encodings[0], encodings[2])
+      encodings[0]["fingerprint"]["positions"] = []
+      self.assertEncodingsEqual(encodings[2:3], expected[2:3])
+
+
+  def testFingerprintStore(self):
+    client = FakeCorticalClient()
+    encoder = CioEncoder(client=client, fingerprintType=EncoderTypes.word,
+                         fingerprintStoreDir=self.storeDir)
+    expected = encoder.encodeMany(TEXTS)
+    # One query per distinct word.
+    self.assertEqual(client.numQueries, 10)
+
+    client = FakeCorticalClient()
+    encoder = CioEncoder(client=client, fingerprintType=EncoderTypes.word,
+                         fingerprintStoreDir=self.storeDir)
+    self.assertEncodingsEqual(encoder.encodeMany(TEXTS), expected)
+    self.assertEqual(client.numQueries, 0)
+
+
+  def testPickleWithoutFingerprintStore(self):
+    encoder = CioEncoder(client=FakeCorticalClient(),
+                         fingerprintType=EncoderTypes.word,
+                         fingerprintStoreDir=self.storeDir)
+    expected = encoder.encodeMany(TEXTS)
+    state = pickle.dumps(encoder)
+    # E.g. the encoder is unpickled on another machine.
+    shutil.rmtree(self.storeDir)
+
+    encoder = pickle.loads(state)
+    self.assertEncodingsEqual(encoder.encodeMany(TEXTS), expected)
@@ -0,0 +1,200 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2017, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from htmresearch.encoders.fake_cortical_client import FakeCorticalClient
+from htmresearch.encoders.fingerprint_store import (
+  FingerprintCache, FingerprintStore, POSITIONS_FILE, TERMS_FILE)
+
+
+
+def _fingerprint(term):
+  return FakeCorticalClient().getBitmap(term)["fingerprint"]["positions"]
+
+
+
+def _addTerms(path, terms):
+  store = FingerprintStore(path)
+  for term in terms:
+    store.addMany({term: _fingerprint(term)})
+
+
+
+class FingerprintStoreTest(unittest.TestCase):
+  """
+  Fingerprints written to and read from fingerprint stores.
+  """
+
+
+  def setUp(self):
+    self.tmpDir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmpDir, "fingerprints")
+
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpDir)
+
+
+  def assertStoreHas(self, store, terms):
+    self.assertEqual(len(store), len(terms))
+    for term in terms:
+      self.assertEqual(store.get(term).tolist(), _fingerprint(term))
+
+
+  def testAddAndReopen(self):
+    store = FingerprintStore(self.path)
+    self.assertIsNone(store.get(u"cat"))
+    store.addMany({t: _fingerprint(t) for t in (u"cat", u"dog")})
+    store.addMany({t: _fingerprint(t) for t in (u"dog", u"caf\xe9")})
+
+    self.assertStoreHas(store, [u"cat", u"dog", u"caf\xe9"])
+    self.assertStoreHas(FingerprintStore(self.path),
+                        [u"cat", u"dog", u"caf\xe9"])
+
+
+  def testReopenAfterInterruptedWrite(self):
+    _addTerms(self.path, [u"cat", u"dog"])
+
+    # Positions and a partial line of a third fingerprint were written.
+    with open(os.path.join(self.path, POSITIONS_FILE), "ab") as f:
+      np.arange(10, dtype=np.uint32).tofile(f)
+    with open(os.path.join(self.path, TERMS_FILE), "a") as f:
+      f.write('"bi')
+
+    store = FingerprintStore(self.path)
+    self.assertStoreHas(store, [u"cat", u"dog"])
+    store.addMany({u"bird": _fingerprint(u"bird")})
+    self.assertStoreHas(FingerprintStore(self.path),
+                        [u"cat", u"dog", u"bird"])
+
+
+  def testSharedStore(self):
+    store1 = FingerprintStore(self.path)
+    store2 = FingerprintStore(self.path)
+    store1.addMany({u"cat": _fingerprint(u"cat")})
+    store2.addMany({u"dog": _fingerprint(u"dog")})
+    store1.addMany({u"bird": _fingerprint(u"bird")})
+
+    self.assertStoreHas(store1, [u"cat", u"dog", u"bird"])
+    self.assertStoreHas(FingerprintStore(self.path),
+                        [u"cat", u"dog", u"bird"])
+
+
+  def testConcurrentWriters(self):
+    terms = [[u"term{}_{}".format(i, j) for j in xrange(20)]
+             for i in xrange(4)]
+    processes = [multiprocessing.Process(target=_addTerms,
+                                         args=(self.path, t))
+                 for t in terms]
+    for p in processes:
+      p.start()
+    for p in processes:
+      p.join()
+      self.assertEqual(p.exitcode, 0)
+
+    self.assertStoreHas(FingerprintStore(self.path), sum(terms, []))
+
+
+  def testPickle(self):
+    store = FingerprintStore(self.path)
+    store.addMany({u"cat": _fingerprint(u"cat")})
+    state = pickle.dumps(store)
+    _addTerms(self.path, [u"dog"])
+
+    self.assertStoreHas(pickle.loads(state), [u"cat", u"dog"])
+
+
+
+class FingerprintCacheTest(unittest.TestCase):
+  """
+  Fingerprints looked up through fingerprint caches.
+  """
+
+
+  def setUp(self):
+    self.tmpDir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmpDir, "fingerprints")
+
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpDir)
+
+
+  def testGetMany(self):
+    client = FakeCorticalClient()
+    cache = FingerprintCache(client, maxSize=2)
+    fingerprints = cache.getMany([u"cat", u"dog", u"cat", u"bird"])
+
+    self.assertEqual(sorted(fingerprints), [u"bird", u"cat", u"dog"])
+    for term, positions in fingerprints.iteritems():
+      self.assertEqual(positions.tolist(), _fingerprint(term))
+    self.assertEqual(client.numQueries, 3)
+
+    # Only the 2 most recent terms are kept.
+    cache.get(u"bird")
+    self.assertEqual(client.numQueries, 3)
+    cache.get(u"cat")
+    self.assertEqual(client.numQueries, 4)
+
+
+  def testStore(self):
+    FingerprintCache(FakeCorticalClient(), self.path).getMany([u"cat",
+                                                               u"dog"])
+
+    client = FakeCorticalClient()
+    cache = FingerprintCache(client, self.path)
+    self.assertEqual(cache.get(u"cat").tolist(), _fingerprint(u"cat"))
+    cache.getMany([u"dog", u"bird"])
+    self.assertEqual(client.numQueries, 1)
+    self.assertEqual(len(cache.store), 3)
+
+
+  def testPickle(self):
+    cache = FingerprintCache(FakeCorticalClient(), self.path)
+    cache.get(u"cat")
+    state = pickle.dumps(cache)
+
+    cache = pickle.loads(state)
+    self.assertEqual(len(cache.store), 1)
+    self.assertEqual(cache.client.numQueries, 1)
+    cache.get(u"cat")
+    self.assertEqual(cache.client.numQueries, 1)
+
+
+  def testPickleWithoutStore(self):
+    cache = FingerprintCache(FakeCorticalClient(), self.path)
+    cache.get(u"cat")
+    state = pickle.dumps(cache)
+    # E.g. the cache is unpickled on another machine.
+    shutil.rmtree(self.path)
+
+    cache = pickle.loads(state)
+    self.assertIsNone(cache.store)
+    self.assertEqual(cache.get(u"cat").tolist(), _fingerprint(u"cat"))
+    self.assertFalse(os.path.exists(self.path))
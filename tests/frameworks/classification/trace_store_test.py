@@ -0,0 +1,138 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2017, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from htmresearch.frameworks.classification.utils.trace_store import \
+  TraceWriter, TraceStore, saveTraceStore
+
+
+
+def _makeTraces(numRows, seed):
+  rng = np.random.RandomState(seed)
+  return {
+    'step': range(numRows),
+    'categoryTrace': [int(c) for c in rng.randint(0, 3, numRows)],
+    'sensorValueTrace': [float(v) for v in rng.rand(numRows)],
+    'resetTrace': [bool(r) for r in rng.rand(numRows) < 0.1],
+    'tmActiveCellsTrace': [sorted(rng.choice(1024, 10, replace=False).tolist())
+                           for _ in range(numRows)],
+  }
+
+
+
+def _toLists(traces):
+  return {name: [list(v) if isinstance(v, np.ndarray) else v for v in values]
+          for name, values in traces.iteritems()}
+
+
+
+class TraceStoreTest(unittest.TestCase):
+  """
+  Round trips of network traces through trace stores.
+  """
+
+
+  def setUp(self):
+    self.tmpDir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmpDir, 'network.traces')
+
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpDir)
+
+
+  def assertTracesEqual(self, expected, path):
+    traces = _toLists(TraceStore(path).toDict())
+    self.assertEqual(sorted(traces), sorted(expected))
+    for name, values in expected.iteritems():
+      self.assertEqual(traces[name], values, name)
+      # Integers and bools must not come back as floats
+      for value, expectedValue in zip(traces[name], values):
+        self.assertEqual(type(value), type(expectedValue), name)
+
+
+  def testRoundTrip(self):
+    traces = _makeTraces(25, seed=0)
+    saveTraceStore(traces, self.path, chunkSize=7)
+    self.assertTracesEqual(traces, self.path)
+
+
+  def testOverwrite(self):
+    saveTraceStore(_makeTraces(25, seed=0), self.path)
+    traces = _makeTraces(10, seed=1)
+    self.assertRaises(ValueError, saveTraceStore, traces, self.path)
+    saveTraceStore(traces, self.path, overwrite=True)
+    self.assertTracesEqual(traces, self.path)
+
+
+  def testReopenAndAppend(self):
+    traces = _makeTraces(20, seed=1)
+    moreTraces = _makeTraces(13, seed=2)
+    with TraceWriter(self.path, chunkSize=6) as writer:
+      writer.extend(traces)
+    with TraceWriter(self.path, chunkSize=6) as writer:
+      for i in range(13):
+        writer.append({name: values[i]
+                       for name, values in moreTraces.iteritems()})
+
+    self.assertTracesEqual({name: traces[name] + moreTraces[name]
+                            for name in traces}, self.path)
+
+
+  def testNoneValuesAndLateColumns(self):
+    with TraceWriter(self.path, chunkSize=4) as writer:
+      writer.append({'step': 0, 'anomalyScore': None})
+      writer.append({'step': 1, 'anomalyScore': 1})
+      writer.extend({'step': [2, 3, 4], 'anomalyScore': [0.5, None, 2],
+                     'tmActiveCellsTrace': [[1, 2], None, []]})
+
+    self.assertTracesEqual({'step': [0, 1, 2, 3, 4],
+                            'anomalyScore': [None, 1.0, 0.5, None, 2.0],
+                            'tmActiveCellsTrace': [None, None, [1, 2], None,
+                                                   []]}, self.path)
+
+
+  def testReopenAfterInterruptedFlush(self):
+    traces = _makeTraces(10, seed=3)
+    moreTraces = _makeTraces(5, seed=4)
+    saveTraceStore(traces, self.path, chunkSize=4)
+
+    # Simulate a flush interrupted before the metadata is written: the
+    # column files have extra rows, and a new column has files.
+    with open(os.path.join(self.path, 'metadata.json')) as f:
+      metadata = f.read()
+    with TraceWriter(self.path) as writer:
+      writer.extend(_makeTraces(3, seed=5))
+      writer.extend({'newTrace': [1, 2, 3]})
+    with open(os.path.join(self.path, 'metadata.json'), 'w') as f:
+      f.write(metadata)
+
+    with TraceWriter(self.path, chunkSize=4) as writer:
+      writer.extend(moreTraces)
+
+    self.assertTracesEqual({name: traces[name] + moreTraces[name]
+                            for name in traces}, self.path)
@@ -0,0 +1,91 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2017, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+import unittest
+
+from htmresearch.frameworks.nlp.classify_keywords import (
+  ClassificationModelKeywords)
+
+
+
+DOCUMENTS = [
+  ("The quick brown fox jumps over the lazy dog", [0], 0),
+  ("hello world", [1], 1),
+  ("", [2], 2),
+  ("the dog and the fox are friends", [0, 2], 3),
+  ("A lazy afternoon with brown dogs", [1], 4),
+  ("quick quick quick", [2], 5),
+]
+
+
+
+def _createModel():
+  return ClassificationModelKeywords(n=200, w=10, numLabels=3, k=5,
+                                     verbosity=0)
+
+
+
+class ClassificationModelTest(unittest.TestCase):
+  """
+  Bulk training of classification models with trainDocuments().
+  """
+
+
+  def assertSameClassifier(self, model, expectedModel):
+    classifier = model.getClassifier()
+    expected = expectedModel.getClassifier()
+    self.assertGreater(expected._numPatterns, 0)
+    self.assertEqual(classifier._numPatterns, expected._numPatterns)
+    self.assertEqual(classifier._categoryList, expected._categoryList)
+    self.assertEqual(classifier.getPartitionIdList(),
+                     expected.getPartitionIdList())
+    for i in xrange(expected._numPatterns):
+      self.assertEqual(
+        list(classifier.getPattern(i, sparseBinaryForm=True)),
+        list(expected.getPattern(i, sparseBinaryForm=True)))
+
+    for document, _, _ in DOCUMENTS[:2]:
+      votes, idList, distances = model.inferDocument(
+        document, returnDetailedResults=True)
+      expectedVotes, expectedIdList, expectedDistances = (
+        expectedModel.inferDocument(document, returnDetailedResults=True))
+      self.assertEqual(list(votes), list(expectedVotes))
+      self.assertEqual(dict(zip(idList, distances)),
+                       dict(zip(expectedIdList, expectedDistances)))
+
+
+  def testTrainDocuments(self):
+    for tokenIdFactor in (None, 1000):
+      for batchSize in (1, 7, 1000):
+        expectedModel = _createModel()
+        for document, labels, sampleId in DOCUMENTS:
+          tokenList, mapping = expectedModel.tokenize(document)
+          for i, token in enumerate(tokenList):
+            tokenId = (sampleId if tokenIdFactor is None
+                       else sampleId * tokenIdFactor + mapping[i])
+            expectedModel.trainToken(
+              token, labels, tokenId,
+              resetSequence=int(i == len(tokenList) - 1))
+
+        model = _createModel()
+        model.trainDocuments(iter(DOCUMENTS), tokenIdFactor=tokenIdFactor,
+                             batchSize=batchSize)
+        self.assertSameClassifier(model, expectedModel)